@@ -0,0 +1,273 @@
+"""
+请求路径CPU热点微基准测试
+覆盖提示词构造、URL格式化、响应JSON解析、输出模型构造、关键信息提取和证明链接筛选，
+记录耗时中位数与tracemalloc内存峰值，并可与保存的基线对比检测性能回退
+
+用法：
+    python benchmarks/bench_hot_paths.py                  # 运行全部基准并打印结果
+    python benchmarks/bench_hot_paths.py --check          # 与基线对比，超过阈值时返回非0退出码
+    python benchmarks/bench_hot_paths.py --save-baseline  # 将本次结果保存为新的基线
+    python benchmarks/bench_hot_paths.py -k parse --quick # 只运行名称包含parse的基准，缩短采样
+"""
+import argparse
+import gc
+import json
+import os
+import statistics
+import sys
+import timeit
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 添加src目录和当前目录到Python路径
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+sys.path.insert(0, BENCH_DIR)
+
+from corpora import SIZES, make_llm_response, make_tender_text
+from core import build_analysis_output
+from domain_index import DomainIndex
+from llm_client import opportunity_generator
+from schemas import output_from_validated, validate_opportunities, validate_records
+from utils import WebSearcher
+
+
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+
+# 默认回退阈值：耗时中位数超过基线的1.5倍、内存峰值超过基线的1.25倍视为回退；
+# 两者各有一个固定余量，避免亚微秒级用例的计时噪声和小额分配被误报为回退
+DEFAULT_THRESHOLDS = {"time_ratio": 1.5, "time_slack_us": 2.0, "memory_ratio": 1.25, "memory_slack_bytes": 4096}
+
+
+def _run_coroutine(coro):
+    """
+    同步驱动一个不会挂起的协程，避免事件循环调度开销计入测量结果
+    """
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coro.close()
+    raise RuntimeError("基准测试中的协程发生了挂起，无法同步驱动")
+
+
+def _build_cases() -> List[Tuple[str, Callable[[], Any]]]:
+    """
+    构造所有基准用例，语料在此处一次性生成，不计入测量
+    """
+    generator = opportunity_generator
+    client = generator.llm_client
+    cases: List[Tuple[str, Callable[[], Any]]] = []
+
+    prompt_inputs = {
+        "small": ("市政工程", "国企", "意向阶段"),
+        "typical": ("桥梁与隧道工程", "上市公司", "竞标阶段"),
+        # 自定义内容可以很长，例如直接粘贴一段项目说明
+        "large": ("装配式建筑与智能建造，" * 400, "地方城投平台公司及其下属子公司，" * 250, "二次招标后的补充公告，" * 400),
+    }
+    for size in SIZES:
+        args = prompt_inputs[size]
+        cases.append((f"build_prompt[{size}]", lambda args=args: generator._build_prompt(*args)))
+
+    for size in SIZES:
+        raw = make_llm_response(size)
+        cases.append((f"format_urls[{size}]", lambda raw=raw: client._format_urls(raw)))
+
+    for size in SIZES:
+        formatted = client._format_urls(make_llm_response(size))
+        cases.append((f"parse_response[{size}]", lambda text=formatted: generator._parse_response(text)))
+
+    for size in ("small", "typical"):
+        items = generator._parse_response(client._format_urls(make_llm_response(size)))
+        cases.append((f"build_output[{size}]", lambda items=items: build_analysis_output(items)))
+
+        validated = build_analysis_output(items).model_dump()["opportunities"]
+        cases.append((f"output_from_cache[{size}]", lambda items=validated: output_from_validated(items)))
+
+    # 批处理场景：一次校验上万条商机
+    batch = generator._parse_response(make_llm_response("large")) * 200
+    cases.append(("validate_batch[large]", lambda: validate_opportunities(batch)))
+    cases.append(("validate_records[large]", lambda: validate_records(batch)))
+
+    for size in SIZES:
+        text = make_tender_text(size)
+        cases.append((
+            f"extract_key_info[{size}]",
+            lambda text=text: _run_coroutine(WebSearcher.extract_key_info_from_text(text))
+        ))
+
+    # 证明链接筛选：进程内缓存命中时的整段筛选，以及未命中缓存时单个域名的索引查找
+    index = DomainIndex()
+    index.record_many([(f"http://hallucinated{i}.com/", False) for i in range(200)])
+    for size in SIZES:
+        formatted = client._format_urls(make_llm_response(size))
+        cases.append((f"screen_urls[{size}]", lambda text=formatted: index.screen(text)))
+    cases.append(("classify_host[cold]", lambda: index._classify("ggzy.jsj.example-city.com")))
+
+    return cases
+
+
+def measure_time(func: Callable[[], Any], repeat: int, min_seconds: float) -> Dict[str, float]:
+    """
+    测量单次调用耗时
+    先自动确定每轮调用次数使单轮耗时不低于min_seconds，预热后重复repeat轮，取每次调用的中位数与最小值
+    """
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_seconds:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_seconds / elapsed) + 1))
+
+    samples = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    median = statistics.median(samples)
+    spread = (statistics.pstdev(samples) / median * 100) if median else 0.0
+    return {
+        "median_us": round(median * 1e6, 3),
+        "min_us": round(min(samples) * 1e6, 3),
+        "stdev_pct": round(spread, 2),
+        "loops": number,
+    }
+
+
+def measure_memory(func: Callable[[], Any]) -> Dict[str, int]:
+    """
+    使用tracemalloc测量单次调用的内存分配峰值和调用结束后仍持有的内存
+    """
+    gc.collect()
+    already_tracing = tracemalloc.is_tracing()
+    if not already_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    result = func()
+    current, peak = tracemalloc.get_traced_memory()
+    del result
+    if not already_tracing:
+        tracemalloc.stop()
+    return {"peak_bytes": peak - before, "retained_bytes": max(0, current - before)}
+
+
+def run_benchmarks(name_filter: Optional[str] = None, quick: bool = False) -> Dict[str, Dict[str, Any]]:
+    """
+    运行基准测试并返回按名称组织的结果
+    """
+    repeat, min_seconds = (3, 0.02) if quick else (7, 0.1)
+    results: Dict[str, Dict[str, Any]] = {}
+    for name, func in _build_cases():
+        if name_filter and name_filter not in name:
+            continue
+        func()  # 预热，填充正则缓存等
+        entry = measure_time(func, repeat, min_seconds)
+        entry.update(measure_memory(func))
+        results[name] = entry
+    return results
+
+
+def load_baseline(path: str = BASELINE_PATH) -> Optional[Dict[str, Any]]:
+    """
+    加载基线文件，不存在时返回None
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_baseline(results: Dict[str, Dict[str, Any]], path: str = BASELINE_PATH,
+                  thresholds: Optional[Dict[str, float]] = None) -> None:
+    """
+    保存基线，保留已有基线中的阈值配置
+    """
+    previous = load_baseline(path) or {}
+    baseline = {
+        "python": sys.version.split()[0],
+        "thresholds": thresholds or previous.get("thresholds", DEFAULT_THRESHOLDS),
+        "benchmarks": {
+            name: {"median_us": r["median_us"], "peak_bytes": r["peak_bytes"]}
+            for name, r in results.items()
+        },
+    }
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(baseline, file, ensure_ascii=False, indent=2)
+        file.write("\n")
+
+
+def compare_with_baseline(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any]) -> List[str]:
+    """
+    与基线对比，返回回退描述列表（为空表示没有回退）
+    """
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    thresholds.update(baseline.get("thresholds", {}))
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get("benchmarks", {}).get(name)
+        if base is None:
+            continue
+        time_limit = base["median_us"] * thresholds["time_ratio"] + thresholds["time_slack_us"]
+        if result["median_us"] > time_limit:
+            regressions.append(
+                f"{name}: 耗时 {result['median_us']:.1f}us 超过基线 {base['median_us']:.1f}us 的 {thresholds['time_ratio']} 倍"
+            )
+        memory_limit = base["peak_bytes"] * thresholds["memory_ratio"] + thresholds["memory_slack_bytes"]
+        if result["peak_bytes"] > memory_limit:
+            regressions.append(
+                f"{name}: 内存峰值 {result['peak_bytes']}B 超过基线 {base['peak_bytes']}B 的 {thresholds['memory_ratio']} 倍"
+            )
+    return regressions
+
+
+def print_results(results: Dict[str, Dict[str, Any]], baseline: Optional[Dict[str, Any]] = None) -> None:
+    """
+    以表格形式打印结果
+    """
+    print(f"{'基准名称':<28}{'中位数(us)':>14}{'最小值(us)':>14}{'波动%':>8}{'峰值内存(B)':>14}{'相对基线':>10}")
+    print("-" * 90)
+    for name, r in results.items():
+        ratio = ""
+        base = (baseline or {}).get("benchmarks", {}).get(name)
+        if base and base["median_us"]:
+            ratio = f"{r['median_us'] / base['median_us']:.2f}x"
+        print(f"{name:<30}{r['median_us']:>14.2f}{r['min_us']:>14.2f}{r['stdev_pct']:>8.1f}{r['peak_bytes']:>14}{ratio:>10}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="请求路径CPU热点微基准测试")
+    parser.add_argument("-k", dest="name_filter", help="只运行名称包含该字符串的基准")
+    parser.add_argument("--quick", action="store_true", help="缩短采样时间，用于快速冒烟检查")
+    parser.add_argument("--check", action="store_true", help="与基线对比，存在回退时返回非0退出码")
+    parser.add_argument("--save-baseline", action="store_true", help="将本次结果保存为基线")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="基线文件路径")
+    parser.add_argument("--json", dest="json_path", help="将本次结果以JSON格式写入指定文件")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.name_filter, args.quick)
+    baseline = load_baseline(args.baseline)
+    print_results(results, baseline)
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+        print(f"\n基线已保存: {args.baseline}")
+
+    if args.check:
+        if baseline is None:
+            print(f"\n未找到基线文件: {args.baseline}")
+            return 1
+        regressions = compare_with_baseline(results, baseline)
+        if regressions:
+            print("\n检测到性能回退:")
+            for line in regressions:
+                print(f"- {line}")
+            return 1
+        print("\n未检测到性能回退")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
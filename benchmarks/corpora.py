@@ -0,0 +1,104 @@
+"""
+基准测试语料
+按固定随机种子生成小型、典型和超大三档的大模型响应文本与招标公告文本，保证每次运行的输入完全一致
+"""
+import json
+import random
+from typing import Dict, List
+
+from utils import GOVERNMENT_SITES, TENDER_SITES, ENTERPRISE_SITES
+
+
+# 语料生成使用的固定随机种子
+CORPUS_SEED = 20240601
+
+DIRECTIONS = ["结构工程", "岩土工程", "桥梁与隧道工程", "道路与铁道工程", "市政工程", "水利工程"]
+CUSTOMER_TYPES = ["行政机关", "事业单位", "央企", "国企", "上市公司", "民营企业"]
+BUSINESS_STATUSES = ["意向阶段", "争夺阶段", "竞标阶段", "废标重启", "成果扩大"]
+
+_COMPANY_PREFIXES = ["中国建筑", "中国中铁", "中国铁建", "中国交建", "中国电建", "上海建工", "北京城建", "广东水电"]
+_COMPANY_SUFFIXES = ["第八工程局有限公司", "集团有限公司", "股份有限公司", "城市建设发展有限公司", "基础设施投资有限公司"]
+_PROJECT_WORDS = ["综合管廊", "跨江大桥", "地铁隧道", "污水处理厂", "水库除险加固", "高速公路改扩建", "保障性住房", "产业园区"]
+_PHRASES = [
+    "该项目已列入年度重点建设计划",
+    "项目可行性研究报告已获批复",
+    "建设单位已完成前期勘察设计招标",
+    "根据公开的环评公示信息",
+    "财政预算资金已落实",
+    "采用EPC总承包模式建设",
+    "预计下半年启动施工总承包招标",
+    "建议通过技术交流会切入",
+]
+
+
+def _url(rng: random.Random) -> str:
+    site = rng.choice(GOVERNMENT_SITES + TENDER_SITES + ENTERPRISE_SITES).rstrip("/")
+    return f"{site}/notice/{rng.randint(2023, 2025)}/{rng.randint(100000, 999999)}.html?id={rng.randint(1, 9999)}"
+
+
+def _sentence(rng: random.Random, length: int, with_urls: int = 0) -> str:
+    parts = []
+    while sum(len(p) for p in parts) < length:
+        parts.append(rng.choice(_PHRASES))
+    for _ in range(with_urls):
+        parts.append(f"详见：{_url(rng)}")
+    return "，".join(parts) + "。"
+
+
+def make_opportunity(rng: random.Random, field_length: int, urls_per_field: int) -> Dict[str, str]:
+    """
+    生成一条商机数据
+    """
+    company = rng.choice(_COMPANY_PREFIXES) + rng.choice(_COMPANY_SUFFIXES)
+    project = rng.choice(_PROJECT_WORDS)
+    return {
+        "company_name": company,
+        "project_info": f"{project}项目，总投资约{rng.randint(2, 80)}亿元"[:50],
+        "proof_info": _sentence(rng, field_length, urls_per_field),
+        "inferred_info": _sentence(rng, field_length, urls_per_field),
+        "marketing_plan": _sentence(rng, field_length),
+    }
+
+
+def make_llm_response(size: str) -> str:
+    """
+    生成模拟的大模型响应文本，包含前后说明文字和markdown代码块包裹的JSON
+    :param size: small / typical / large
+    """
+    rng = random.Random(f"{CORPUS_SEED}-response-{size}")
+    if size == "small":
+        count, field_length, urls = 5, 20, 0
+    elif size == "typical":
+        count, field_length, urls = 5, 150, 2
+    elif size == "large":
+        count, field_length, urls = 60, 240, 6
+    else:
+        raise ValueError(f"未知的语料规模: {size}")
+
+    payload = {"opportunities": [make_opportunity(rng, field_length, urls) for _ in range(count)]}
+    body = json.dumps(payload, ensure_ascii=False, indent=2)
+    return f"以下是根据您的条件生成的商机分析报告：\n```json\n{body}\n```\n以上信息仅供参考，请以官方公告为准。"
+
+
+def make_tender_text(size: str) -> str:
+    """
+    生成模拟的招标公告文本，包含日期、网址和项目名称
+    :param size: small / typical / large
+    """
+    rng = random.Random(f"{CORPUS_SEED}-tender-{size}")
+    paragraphs = {"small": 2, "typical": 12, "large": 600}.get(size)
+    if paragraphs is None:
+        raise ValueError(f"未知的语料规模: {size}")
+
+    lines: List[str] = []
+    for _ in range(paragraphs):
+        project = rng.choice(_PROJECT_WORDS)
+        date = f"{rng.randint(2023, 2025)}年{rng.randint(1, 12)}月{rng.randint(1, 28)}日"
+        lines.append(
+            f"{date}，{rng.choice(_COMPANY_PREFIXES)}发布{project}工程施工招标公告，"
+            f"项目{project}建设已完成立项，{rng.choice(_PHRASES)}。公告原文：{_url(rng)}"
+        )
+    return "\n".join(lines)
+
+
+SIZES = ["small", "typical", "large"]
@@ -1,20 +1,187 @@
 """
 建筑行业新商机分析 Agent Skill
 项目入口文件
+
+批处理用法：
+    python main.py run --input records.jsonl --output-dir out --shard 0/4 --workers 8 --cache cache.db
+    python main.py merge --output-dir out --output merged.jsonl
+
+夜间预计算（服务商离线批量任务）：
+    python main.py precompute --cache cache.db
+
+招标公告入库后增量更新受影响的结果：
+    python main.py ingest --notices notices.jsonl --cache cache.db --recompute
+
+批处理结果写入历史报告归档：
+    python main.py archive --input merged.jsonl --archive reports.cda
 """
+import argparse
+import asyncio
+import json
 import sys
 import os
 # 添加src目录到Python路径，以便能够导入模块
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
 from core import analyze_opportunities, OpportunityAnalysisInput
+from sync_api import analyze_opportunities_batch_sync, analyze_opportunities_sync, speculate_sync
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """构造命令行参数解析器"""
+    parser = argparse.ArgumentParser(description="建筑行业新商机分析 Agent Skill")
+    subparsers = parser.add_subparsers(dest="command")
+
+    run = subparsers.add_parser("run", help="按分片批量分析JSONL输入文件")
+    run.add_argument("--input", required=True, help="JSONL输入文件，每行包含 construction_direction、customer_type、business_status")
+    run.add_argument("--output-dir", required=True, help="输出目录，结果写入 shard-i-of-N.jsonl")
+    run.add_argument("--shard", default="0/1", help="本机处理的分片，格式为 i/N，默认 0/1")
+    run.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="工作进程数，默认等于CPU核数")
+    run.add_argument("--concurrency", type=int, default=4, help="每个工作进程内同时进行的分析数")
+    run.add_argument("--cache", help="共享的结果缓存文件（SQLite），所有分片和进程使用同一个文件")
+    run.add_argument("--progress", help="共享的进度文件，默认为输出目录下的 progress.jsonl")
+    run.add_argument("--allow-mock", action="store_true", help="大模型调用失败时写入模拟数据，默认记录为失败")
+    run.add_argument("--tenant", default=os.getenv("BATCH_TENANT", "batch"), help="公平调度使用的租户名称，默认 batch")
+
+    merge = subparsers.add_parser("merge", help="合并输出目录下的全部分片文件")
+    merge.add_argument("--output-dir", required=True, help="包含分片文件的目录")
+    merge.add_argument("--output", required=True, help="合并后的结果文件")
+
+    precompute = subparsers.add_parser("precompute", help="通过服务商离线批量任务预计算全部预设组合")
+    precompute.add_argument("--cache", required=True, help="结果缓存文件（SQLite），在线服务使用同一文件即可命中")
+    precompute.add_argument("--model", help="模型名称，默认使用配置中的模型")
+    precompute.add_argument("--poll-interval", type=float, default=30.0, help="初始轮询间隔（秒）")
+    precompute.add_argument("--timeout", type=float, help="最长等待时间（秒），默认一直等待")
+
+    ingest = subparsers.add_parser("ingest", help="导入招标公告，标记并增量更新受影响的结果")
+    ingest.add_argument("--notices", required=True, help="JSONL公告文件，每行包含 title、content，可选 url、customer_type、tags")
+    ingest.add_argument("--cache", required=True, help="结果缓存文件（SQLite），依赖记录保存在同一文件中")
+    ingest.add_argument("--recompute", action="store_true", help="标记后立即重新计算待更新的结果")
+    ingest.add_argument("--limit", type=int, help="最多重新计算的结果数，默认全部")
+    ingest.add_argument("--concurrency", type=int, default=2, help="同时进行的重新计算数")
+
+    archive = subparsers.add_parser("archive", help="将批处理结果追加到历史报告归档")
+    archive.add_argument("--input", required=True, help="run 或 merge 输出的JSONL结果文件")
+    archive.add_argument("--archive", required=True, help="归档数据文件，字典和索引保存在同目录的 .dict 和 .idx 文件")
+    archive.add_argument("--block-size", type=int, default=32, help="每个压缩块包含的报告数")
+    return parser
+
+
+def archive(args) -> int:
+    """将批处理结果追加到历史报告归档，生成时间取结果文件的修改时间"""
+    from report_archive import ReportArchive
+    from schemas import OpportunityAnalysisOutput
+
+    created_at = os.path.getmtime(args.input)
+    with ReportArchive(args.archive, block_size=args.block_size) as report_archive:
+        count = 0
+        with open(args.input, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                report_archive.append(OpportunityAnalysisInput(**record["input"]),
+                                      OpportunityAnalysisOutput(**record["output"]), created_at)
+                count += 1
+        print(f"已归档 {count} 份报告，归档共 {len(report_archive)} 份，占用 {report_archive.storage_size()} 字节")
+    return 0
+
+
+def ingest(args) -> int:
+    """导入招标公告，将受影响的结果标记为待更新，可选立即重新计算"""
+    from dependency_tracker import DependencyTracker
+    from refresh_scheduler import recompute_dirty
+    from result_cache import ResultCache
+
+    tracker = DependencyTracker(args.cache)
+    with open(args.notices, encoding="utf-8") as f:
+        notices = [json.loads(line) for line in f if line.strip()]
+    marked = tracker.ingest(notices)
+    print(f"导入公告 {len(notices)} 条，新标记待更新结果 {len(marked)} 个，"
+          f"当前待更新 {len(tracker.dirty_keys())} 个")
+    from domain_index import domain_index
+    if domain_index.path:
+        # 公告中的链接同时作为可信域名，证明链接筛选时无需联网验证
+        print(f"域名信誉索引新增可信域名 {domain_index.learn_notices(notices)} 个")
+    if not args.recompute:
+        return 0
+
+    async def recompute():
+        from llm_client import opportunity_generator
+        try:
+            return await recompute_dirty(args.limit, args.concurrency,
+                                         cache=ResultCache(args.cache, ttl=float(os.getenv("RESULT_CACHE_TTL", "86400"))),
+                                         tracker=tracker)
+        finally:
+            await opportunity_generator.llm_client.aclose()
+
+    stats = asyncio.run(recompute())
+    print(f"增量更新完成：更新 {stats['refreshed']}，失败 {stats['failed']}，跳过 {stats['skipped']}")
+    return 1 if stats["failed"] else 0
+
+
+def precompute(args) -> int:
+    """提交全部预设组合的离线批量任务，结果写入缓存"""
+    from batch_jobs import BatchJobClient
+    from core import grid_inputs
+    from dependency_tracker import DependencyTracker
+    from result_cache import ResultCache
+
+    async def submit():
+        client = BatchJobClient(cache=ResultCache(args.cache, ttl=float(os.getenv("RESULT_CACHE_TTL", "86400"))),
+                                tracker=DependencyTracker(args.cache))
+        try:
+            return await client.run(grid_inputs(), model=args.model,
+                                    poll_interval=args.poll_interval, timeout=args.timeout)
+        finally:
+            await client.llm_client.aclose()
+
+    summary = asyncio.run(submit())
+    print(f"批量任务 {summary['batch_id']} 状态: {summary['status']}，写入缓存 {summary['ok']}，失败 {summary['failed']}")
+    return 0 if summary["status"] == "completed" and not summary["failed"] else 1
+
+
+def main(argv=None):
+    """主函数"""
+    args = build_parser().parse_args(argv)
+
+    if args.command is None:
+        print("建筑行业新商机分析 Agent Skill")
+        print("请使用对应的前端界面或API调用此功能，或运行tests目录下的测试文件查看示例")
+        print("批处理请使用: python main.py run --help")
+        return 0
+
+    if args.command == "precompute":
+        return precompute(args)
+
+    if args.command == "ingest":
+        return ingest(args)
+
+    if args.command == "archive":
+        return archive(args)
+
+    from batch_runner import merge_shards, parse_shard, run_shard
 
+    if args.command == "run":
+        shard, shard_count = parse_shard(args.shard)
+        stats = run_shard(
+            args.input, args.output_dir, shard, shard_count,
+            workers=max(1, args.workers),
+            concurrency=max(1, args.concurrency),
+            cache_path=args.cache,
+            progress_path=args.progress,
+            use_mock_data=args.allow_mock,
+            tenant=args.tenant,
+        )
+        print(f"分片 {shard}/{shard_count} 处理完成：成功 {stats['ok']}，失败 {stats['failed']}，跳过 {stats['skipped']}")
+        return 1 if stats["failed"] else 0
 
-def main():
-    """主函数，用于演示功能"""
-    print("建筑行业新商机分析 Agent Skill")
-    print("请使用对应的前端界面或API调用此功能，或运行tests目录下的测试文件查看示例")
+    if args.command == "merge":
+        count = merge_shards(args.output_dir, args.output)
+        print(f"已合并 {count} 条记录到 {args.output}")
+        return 0
+    return 0
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,259 @@
+"""
+服务商离线批量任务
+将全部输入的请求写入JSONL文件，通过OpenAI兼容的 /files 和 /batches 接口提交，轮询完成后
+逐行读取结果、解析校验并写入结果缓存。批量任务价格更低且不占用在线接口的限流额度，适合夜间预计算
+"""
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, Optional
+
+import httpx
+
+from batch_runner import record_key
+from dependency_tracker import DependencyTracker, dependency_tracker
+from llm_client import ConstructionOpportunityGenerator, opportunity_generator
+from metrics import get_logger
+from result_cache import ResultCache, result_cache
+from schemas import MIN_OPPORTUNITIES, OpportunityAnalysisInput, validate_output
+
+
+logger = get_logger("batch_jobs")
+
+# 批量任务的终止状态
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+# 请求文件中每行请求对应的接口
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+
+class BatchJobError(Exception):
+    """批量任务提交或执行失败"""
+
+
+class BatchJobClient:
+    """
+    批量任务客户端
+    复用在线调用的服务商配置、HTTP连接池和提示词，结果经 _parse_response 解析后写入缓存
+    """
+
+    def __init__(self, generator: Optional[ConstructionOpportunityGenerator] = None,
+                 cache: Optional[ResultCache] = None,
+                 completion_window: str = "24h", temperature: float = 0.7, max_tokens: int = 2048,
+                 tracker: Optional[DependencyTracker] = None):
+        """
+        :param generator: 商机生成器，默认使用全局实例
+        :param cache: 结果缓存，默认使用全局实例
+        :param completion_window: 服务商完成任务的时限
+        :param tracker: 结果依赖跟踪器，默认使用全局实例
+        """
+        self.generator = generator or opportunity_generator
+        # ResultCache 定义了 __len__，空缓存为假值，不能用 or 判断
+        self.cache = cache if cache is not None else result_cache
+        self.tracker = tracker or dependency_tracker
+        self.completion_window = completion_window
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+
+    @property
+    def llm_client(self):
+        return self.generator.llm_client
+
+    def _url(self, path: str) -> str:
+        return f"{self.llm_client.config['base_url']}{path}"
+
+    def _headers(self) -> Dict[str, str]:
+        if not self.llm_client.config["api_key"]:
+            raise ValueError("API Key未配置，请设置对应的环境变量")
+        return {"Authorization": f"Bearer {self.llm_client.config['api_key']}"}
+
+    async def _request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        client = self.llm_client._get_http_client()
+        response = await client.request(method, self._url(path), headers=self._headers(), **kwargs)
+        if response.status_code >= 400:
+            raise BatchJobError(f"批量任务接口请求失败: {method} {path} {response.status_code}, {response.text}")
+        return response
+
+    def build_request(self, input_data: OpportunityAnalysisInput, model: Optional[str] = None) -> Dict[str, Any]:
+        """
+        构造请求文件中的一行
+        custom_id 使用输入记录的稳定键，用于将结果对应回输入
+        """
+        messages = self.generator._build_messages(
+            input_data.construction_direction, input_data.customer_type, input_data.business_status
+        )
+        return {
+            "custom_id": record_key(input_data),
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {
+                "model": model or self.llm_client.config["default_model"],
+                "messages": messages,
+                "temperature": self.temperature,
+                "max_tokens": self.max_tokens,
+            },
+        }
+
+    def write_request_file(self, inputs: Iterable[OpportunityAnalysisInput], path: str,
+                           model: Optional[str] = None) -> Dict[str, OpportunityAnalysisInput]:
+        """
+        将全部输入的请求逐行写入JSONL文件，相同输入只写一次
+        :return: custom_id 到输入的映射
+        """
+        pending: Dict[str, OpportunityAnalysisInput] = {}
+        with open(path, 'w', encoding='utf-8') as file:
+            for input_data in inputs:
+                request = self.build_request(input_data, model)
+                if request["custom_id"] in pending:
+                    continue
+                pending[request["custom_id"]] = input_data
+                file.write(json.dumps(request, ensure_ascii=False) + "\n")
+        return pending
+
+    async def upload(self, path: str) -> str:
+        """
+        上传请求文件
+        :return: 文件ID
+        """
+        with open(path, 'rb') as file:
+            content = file.read()
+        response = await self._request(
+            "POST", "/files",
+            data={"purpose": "batch"},
+            files={"file": (os.path.basename(path), content, "application/jsonl")},
+        )
+        return response.json()["id"]
+
+    async def create(self, input_file_id: str) -> Dict[str, Any]:
+        """创建批量任务"""
+        response = await self._request("POST", "/batches", json={
+            "input_file_id": input_file_id,
+            "endpoint": BATCH_ENDPOINT,
+            "completion_window": self.completion_window,
+        })
+        return response.json()
+
+    async def retrieve(self, batch_id: str) -> Dict[str, Any]:
+        """查询批量任务状态"""
+        return (await self._request("GET", f"/batches/{batch_id}")).json()
+
+    async def wait(self, batch_id: str, poll_interval: float = 5.0, max_interval: float = 300.0,
+                   timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        轮询直到任务结束，轮询间隔按指数退避增长
+        :param poll_interval: 初始轮询间隔（秒）
+        :param max_interval: 最大轮询间隔（秒）
+        :param timeout: 最长等待时间（秒），为None时一直等待
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        interval = poll_interval
+        while True:
+            batch = await self.retrieve(batch_id)
+            status = batch.get("status")
+            if status in TERMINAL_STATUSES:
+                return batch
+            counts = batch.get("request_counts") or {}
+            logger.info("批量任务 %s 状态: %s，已完成 %s/%s", batch_id, status,
+                        counts.get("completed", "?"), counts.get("total", "?"))
+            if deadline is not None and time.monotonic() + interval > deadline:
+                raise BatchJobError(f"等待批量任务超时: {batch_id}，当前状态: {status}")
+            await asyncio.sleep(interval * (0.8 + random.random() * 0.4))
+            interval = min(max_interval, interval * 2)
+
+    async def iter_file_lines(self, file_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """流式读取结果文件，逐行解析"""
+        client = self.llm_client._get_http_client()
+        async with client.stream("GET", self._url(f"/files/{file_id}/content"), headers=self._headers()) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                raise BatchJobError(f"下载结果文件失败: {file_id} {response.status_code}, {response.text}")
+            async for line in response.aiter_lines():
+                if line.strip():
+                    yield json.loads(line)
+
+    def _require_cache(self) -> None:
+        """结果缓存关闭时 put 不写入任何数据，批量任务的结果会全部丢失，提交前即报错"""
+        if not self.cache.enabled:
+            raise BatchJobError("结果缓存未开启，批量任务的结果无处保存；请设置 RESULT_CACHE_PATH 或 RESULT_CACHE_TTL")
+
+    async def _store_result(self, input_data: OpportunityAnalysisInput, line: Dict[str, Any], model: str) -> bool:
+        """
+        解析一行结果并写入缓存，SQLite写入在线程中执行，不阻塞事件循环
+        :return: 是否得到有效结果
+        """
+        response = line.get("response") or {}
+        if line.get("error") or response.get("status_code", 200) != 200:
+            return False
+        content = response.get("body", {})["choices"][0]["message"]["content"]
+        items = self.generator._parse_response(self.llm_client._format_urls(content))
+        if len(items) < MIN_OPPORTUNITIES:
+            return False
+        output = validate_output(items)
+        if len(output.opportunities) < MIN_OPPORTUNITIES:
+            return False
+        labels = self.llm_client.metric_labels(model)
+        key = self.cache.make_key(
+            labels["provider"], labels["model"],
+            input_data.construction_direction, input_data.customer_type, input_data.business_status
+        )
+        items = output.model_dump()["opportunities"]
+
+        def write() -> None:
+            self.cache.put(key, items)
+            self.tracker.record(key, items)
+
+        await asyncio.to_thread(write)
+        return True
+
+    async def collect(self, batch: Dict[str, Any], pending: Dict[str, OpportunityAnalysisInput],
+                      model: str) -> Dict[str, int]:
+        """
+        读取已完成任务的结果文件并写入缓存
+        :return: 成功和失败的请求数
+        """
+        self._require_cache()
+        stats = {"ok": 0, "failed": 0}
+        remaining = dict(pending)
+        if batch.get("output_file_id"):
+            async for line in self.iter_file_lines(batch["output_file_id"]):
+                input_data = remaining.pop(line.get("custom_id"), None)
+                if input_data is None:
+                    continue
+                try:
+                    stored = await self._store_result(input_data, line, model)
+                except Exception as e:
+                    logger.warning("解析批量任务结果失败: %s, %s", line.get("custom_id"), e)
+                    stored = False
+                stats["ok" if stored else "failed"] += 1
+        # 错误文件中的请求以及未返回结果的请求均记为失败
+        stats["failed"] += len(remaining)
+        return stats
+
+    async def run(self, inputs: Iterable[OpportunityAnalysisInput], model: Optional[str] = None,
+                  poll_interval: float = 5.0, max_interval: float = 300.0,
+                  timeout: Optional[float] = None, work_dir: Optional[str] = None) -> Dict[str, Any]:
+        """
+        提交批量任务并等待结果写入缓存
+        :param inputs: 输入组合，例如 core.grid_inputs()
+        :param model: 模型名称，默认使用配置中的模型
+        :param work_dir: 请求文件的存放目录，默认使用临时目录
+        :return: 任务ID、最终状态以及成功和失败的请求数
+        """
+        self._require_cache()
+        model = model or self.llm_client.config["default_model"]
+        with tempfile.TemporaryDirectory(dir=work_dir) as directory:
+            path = os.path.join(directory, "requests.jsonl")
+            pending = self.write_request_file(inputs, path, model)
+            if not pending:
+                return {"batch_id": None, "status": "empty", "ok": 0, "failed": 0}
+            file_id = await self.upload(path)
+        batch = await self.create(file_id)
+        logger.info("已提交批量任务 %s，共 %d 个请求", batch["id"], len(pending))
+        batch = await self.wait(batch["id"], poll_interval, max_interval, timeout)
+        if batch["status"] != "completed":
+            logger.warning("批量任务 %s 未成功完成，状态: %s", batch["id"], batch["status"])
+        stats = await self.collect(batch, pending, model)
+        return {"batch_id": batch["id"], "status": batch["status"], **stats}
@@ -0,0 +1,292 @@
+"""
+分片批处理
+按输入记录的哈希值确定性地分片，每个分片由多个工作进程并行处理，结果流式写入分片文件。
+同一台机器上的工作进程共享磁盘缓存和进度文件；分布到多台机器时，每台机器使用本地的缓存和输出目录
+（SQLite和O_APPEND追加在网络文件系统上都不可靠），运行结束后将各机器的输出目录汇总，由 merge_shards 合并
+"""
+import asyncio
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import time
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from schemas import OpportunityAnalysisInput
+
+
+def record_key(input_data: OpportunityAnalysisInput) -> str:
+    """
+    计算输入记录的稳定键，与进程、机器和Python哈希种子无关
+    """
+    canonical = json.dumps(
+        [input_data.construction_direction, input_data.customer_type, input_data.business_status],
+        ensure_ascii=False
+    )
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def assign(key: str, shard_count: int, worker_count: int) -> Tuple[int, int]:
+    """
+    根据记录键计算所属的分片和工作进程
+    :return: (分片序号, 工作进程序号)
+    """
+    value = int(key[:16], 16)
+    return value % shard_count, (value // shard_count) % worker_count
+
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """
+    解析 "i/N" 形式的分片参数
+    """
+    try:
+        index, count = (int(part) for part in spec.split("/", 1))
+    except ValueError:
+        raise ValueError(f"分片参数格式应为 i/N，例如 0/4，实际为: {spec}")
+    if count <= 0 or not 0 <= index < count:
+        raise ValueError(f"分片序号超出范围: {spec}")
+    return index, count
+
+
+def read_records(path: str) -> Iterator[OpportunityAnalysisInput]:
+    """
+    逐行读取JSONL输入文件，跳过空行
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        for line_number, line in enumerate(file, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield OpportunityAnalysisInput(**json.loads(line))
+            except Exception as e:
+                raise ValueError(f"输入文件第{line_number}行无效: {e}")
+
+
+class ProgressLog:
+    """
+    共享进度文件
+    每完成一条记录追加一行，写入使用O_APPEND单次写，同一台机器上的多个进程可安全地同时追加；
+    不要放在网络文件系统上供多台机器共用
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def completed(self) -> Set[str]:
+        """读取已完成的记录键"""
+        done: Set[str] = set()
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    done.add(json.loads(line)["key"])
+                except (ValueError, KeyError):
+                    # 进程被中断时可能留下不完整的最后一行
+                    continue
+        return done
+
+    def mark(self, key: str, **extra: Any) -> None:
+        line = json.dumps(dict(key=key, at=time.time(), **extra), ensure_ascii=False) + "\n"
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode("utf-8"))
+        finally:
+            os.close(fd)
+
+
+def shard_path(output_dir: str, shard: int, shard_count: int) -> str:
+    return os.path.join(output_dir, f"shard-{shard:04d}-of-{shard_count:04d}.jsonl")
+
+
+def part_path(output_dir: str, shard: int, shard_count: int, worker: int, suffix: str = "part") -> str:
+    return os.path.join(output_dir, f"shard-{shard:04d}-of-{shard_count:04d}.{suffix}-{worker:03d}.jsonl")
+
+
+async def _run_worker_async(input_path: str, output_dir: str, shard: int, shard_count: int,
+                            worker: int, worker_count: int, progress_path: str,
+                            concurrency: int, use_mock_data: bool) -> Dict[str, int]:
+    # 延迟导入：缓存路径等环境变量由父进程在启动工作进程前设置
+    from core import iter_analyses
+    from llm_client import opportunity_generator
+
+    progress = ProgressLog(progress_path)
+    done = progress.completed()
+    stats = {"ok": 0, "failed": 0, "skipped": 0}
+
+    def owned() -> Iterator[OpportunityAnalysisInput]:
+        for input_data in read_records(input_path):
+            key = record_key(input_data)
+            if assign(key, shard_count, worker_count) != (shard, worker):
+                continue
+            if key in done:
+                stats["skipped"] += 1
+                continue
+            done.add(key)
+            yield input_data
+
+    with open(part_path(output_dir, shard, shard_count, worker), 'a', encoding='utf-8') as output, \
+            open(part_path(output_dir, shard, shard_count, worker, "errors"), 'a', encoding='utf-8') as errors:
+        async for input_data, result in iter_analyses(owned(), concurrency, use_mock_data, return_exceptions=True):
+            key = record_key(input_data)
+            if isinstance(result, Exception):
+                errors.write(json.dumps({"key": key, "input": input_data.model_dump(), "error": str(result)},
+                                        ensure_ascii=False) + "\n")
+                errors.flush()
+                stats["failed"] += 1
+                continue
+            output.write(json.dumps({"key": key, "input": input_data.model_dump(), "output": result.model_dump()},
+                                    ensure_ascii=False) + "\n")
+            output.flush()
+            progress.mark(key, shard=shard, worker=worker)
+            stats["ok"] += 1
+
+    await opportunity_generator.llm_client.aclose()
+    return stats
+
+
+def _collect_results(processes: Dict[int, "multiprocessing.Process"], results: "multiprocessing.Queue",
+                     poll_interval: float = 1.0) -> Tuple[Dict[str, int], List[str]]:
+    """
+    汇总各工作进程上报的统计
+    定期检查进程是否存活，被信号终止、内存不足等原因未上报结果就退出的进程记为失败，不会无限等待
+    :return: (各状态的记录数, 错误信息列表)
+    """
+    totals = {"ok": 0, "failed": 0, "skipped": 0}
+    errors: List[str] = []
+    pending = dict(processes)
+
+    def handle(message: Tuple[int, Optional[Dict[str, int]], Optional[str]]) -> None:
+        worker, stats, error = message
+        pending.pop(worker, None)
+        if error:
+            errors.append(f"工作进程{worker}: {error}")
+            return
+        for name, value in stats.items():
+            totals[name] += value
+
+    while pending:
+        try:
+            handle(results.get(timeout=poll_interval))
+            continue
+        except queue.Empty:
+            pass
+        dead = [worker for worker, process in pending.items() if not process.is_alive()]
+        if not dead:
+            continue
+        # 进程退出前写入的结果可能仍在管道中，先取完再判断
+        while True:
+            try:
+                handle(results.get_nowait())
+            except queue.Empty:
+                break
+        for worker in dead:
+            if worker in pending:
+                errors.append(f"工作进程{worker}: 未上报结果即退出，exitcode={pending.pop(worker).exitcode}")
+    return totals, errors
+
+
+def _worker_main(args: Tuple, results: "multiprocessing.Queue", tenant: str = "batch") -> None:
+    """工作进程入口，每个进程拥有独立的事件循环和连接池；调用按批处理类别参与公平调度"""
+    from fair_scheduler import BATCH, request_context
+
+    worker = args[4]
+    try:
+        with request_context(tenant=tenant, request_class=BATCH):
+            results.put((worker, asyncio.run(_run_worker_async(*args)), None))
+    except Exception as e:
+        results.put((worker, None, repr(e)))
+
+
+def run_shard(input_path: str, output_dir: str, shard: int, shard_count: int,
+              workers: int = 1, concurrency: int = 4, cache_path: Optional[str] = None,
+              progress_path: Optional[str] = None, use_mock_data: bool = False,
+              tenant: str = "batch") -> Dict[str, int]:
+    """
+    处理一个分片
+    :param input_path: JSONL输入文件，每行一个 OpportunityAnalysisInput
+    :param output_dir: 输出目录
+    :param shard: 分片序号
+    :param shard_count: 分片总数
+    :param workers: 工作进程数
+    :param concurrency: 每个工作进程内同时进行的分析数
+    :param cache_path: 结果缓存文件，本机所有分片和进程使用同一个文件，应位于本地磁盘
+    :param progress_path: 本机共享的进度文件，默认为输出目录下的 progress.jsonl
+    :param use_mock_data: 大模型调用失败时是否写入模拟数据，默认记录为失败以便下次重试
+    :param tenant: 公平调度使用的租户名称，调用按批处理类别排在交互请求之后
+    :return: 各状态的记录数
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    progress_path = progress_path or os.path.join(output_dir, "progress.jsonl")
+    if cache_path:
+        # 工作进程以spawn方式启动，会继承该环境变量并打开同一个缓存文件
+        os.environ["RESULT_CACHE_PATH"] = os.path.abspath(cache_path)
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    processes = []
+    for worker in range(workers):
+        args = (input_path, output_dir, shard, shard_count, worker, workers,
+                progress_path, concurrency, use_mock_data)
+        process = context.Process(target=_worker_main, args=(args, results, tenant), name=f"shard{shard}-worker{worker}")
+        process.start()
+        processes.append(process)
+
+    totals, errors = _collect_results(dict(enumerate(processes)), results)
+    for process in processes:
+        process.join()
+    if errors:
+        raise RuntimeError("部分工作进程异常退出：" + "；".join(errors))
+
+    merge_parts(output_dir, shard, shard_count)
+    return totals
+
+
+def _iter_unique_lines(paths: List[str], seen: Set[str]) -> Iterator[str]:
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    key = json.loads(line)["key"]
+                except (ValueError, KeyError):
+                    continue
+                if key in seen:
+                    continue
+                seen.add(key)
+                yield line if line.endswith("\n") else line + "\n"
+
+
+def merge_parts(output_dir: str, shard: int, shard_count: int) -> str:
+    """
+    将一个分片下各工作进程的结果文件合并为分片文件，按记录键去重
+    已存在的分片文件（例如上一次运行的结果）会一并保留
+    """
+    target = shard_path(output_dir, shard, shard_count)
+    parts = sorted(glob.glob(os.path.join(output_dir, f"shard-{shard:04d}-of-{shard_count:04d}.part-*.jsonl")))
+    sources = ([target] if os.path.exists(target) else []) + parts
+    tmp_path = f"{target}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as output:
+        output.writelines(_iter_unique_lines(sources, set()))
+    os.replace(tmp_path, target)
+    for part in parts:
+        os.remove(part)
+    return target
+
+
+def merge_shards(output_dir: str, target: str) -> int:
+    """
+    合并输出目录下的全部分片文件为一个结果文件，按记录键去重
+    各台机器的输出目录拷贝到一起后即可合并
+    :return: 合并后的记录数
+    """
+    sources = sorted(glob.glob(os.path.join(output_dir, "shard-*-of-*.jsonl")))
+    sources = [path for path in sources if os.path.basename(path).count(".") == 1]
+    seen: Set[str] = set()
+    tmp_path = f"{target}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as output:
+        output.writelines(_iter_unique_lines(sources, seen))
+    os.replace(tmp_path, target)
+    return len(seen)
@@ -4,43 +4,42 @@
 """
 import json
 import asyncio
-from typing import Dict, List, Optional
-from pydantic import BaseModel, Field
+import itertools
+import os
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
 import aiohttp
 import re
 
-from utils import WebSearcher, ConstructionOpportunityHelper, GOVERNMENT_SITES, TENDER_SITES
+from utils import WebSearcher, ConstructionOpportunityHelper, DIRECTION_KEYWORDS, GOVERNMENT_SITES, TENDER_SITES
 from llm_client import opportunity_generator
+from micro_batcher import micro_batcher
+from metrics import metrics, get_logger
+from profiling import profiler
+from dependency_tracker import DependencyTracker, dependency_tracker
+from fair_scheduler import BATCH, REQUEST_CLASSES, current_request_class, request_context
+from result_cache import ResultCache, result_cache
+from schemas import (
+    OpportunityAnalysisInput,
+    OpportunityInfo,
+    OpportunityAnalysisOutput,
+    BUSINESS_STATUSES,
+    CONSTRUCTION_DIRECTIONS,
+    CUSTOMER_TYPES,
+    MIN_OPPORTUNITIES,
+    output_from_validated,
+    validate_output,
+)
 
 
-class OpportunityAnalysisInput(BaseModel):
-    """商机分析输入参数"""
-    construction_direction: str = Field(
-        ..., 
-        description="建筑方向，可选值：结构工程、岩土工程、桥梁与隧道工程、道路与铁道工程、市政工程、水利工程，或自定义内容"
-    )
-    customer_type: str = Field(
-        ..., 
-        description="客户类型，可选值：行政机关、事业单位、央企、国企、上市公司、民营企业，或自定义内容"
-    )
-    business_status: str = Field(
-        ..., 
-        description="商机状态，可选值：意向阶段、争夺阶段、竞标阶段、废标重启、成果扩大，或自定义内容"
-    )
-
-
-class OpportunityInfo(BaseModel):
-    """单个商机信息"""
-    company_name: str = Field(..., description="公司名称")
-    project_info: str = Field(..., description="项目信息，50字以内")
-    proof_info: str = Field(..., description="证明信息，包括网站公告、招标信息等，255字以内")
-    inferred_info: str = Field(..., description="基于网络信息推断的商机信息，255字以内")
-    marketing_plan: str = Field(..., description="营销方案，255字以内")
+logger = get_logger("core")
 
+# 正在进行的后台刷新任务，按缓存键去重
+_refresh_tasks: Dict[str, "asyncio.Task"] = {}
+# 各后台刷新任务在公平调度中的请求类别
+_refresh_classes: Dict[str, str] = {}
 
-class OpportunityAnalysisOutput(BaseModel):
-    """商机分析输出结果"""
-    opportunities: List[OpportunityInfo] = Field(..., description="商机列表，包含5个客户或潜在客户的信息")
+# 同时进行的后台刷新任务上限
+REFRESH_MAX_INFLIGHT = int(os.getenv("REFRESH_MAX_INFLIGHT", "4"))
 
 
 async def search_for_construction_opportunities(construction_direction: str, customer_type: str) -> List[Dict]:
@@ -48,16 +47,7 @@ async def search_for_construction_opportunities(construction_direction: str, cus
     搜索相关的建筑行业机会信息
     """
     # 创建搜索关键词
-    direction_keywords = {
-        "结构工程": ["建筑工程", "高层建筑", "工业厂房"],
-        "岩土工程": ["地基基础", "地下空间", "边坡治理"],
-        "桥梁与隧道工程": ["桥梁建设", "隧道工程", "跨海工程"],
-        "道路与铁道工程": ["高速公路", "城市道路", "铁路建设"],
-        "市政工程": ["市政建设", "基础设施", "管网改造"],
-        "水利工程": ["水库建设", "引水工程", "防洪治理"]
-    }
-    
-    keywords = direction_keywords.get(construction_direction, [construction_direction])
+    keywords = DIRECTION_KEYWORDS.get(construction_direction, [construction_direction])
     
     # 构造搜索查询
     search_results = []
@@ -78,40 +68,241 @@ async def search_for_construction_opportunities(construction_direction: str, cus
     return search_results[:5]  # 返回前5个结果
 
 
-async def analyze_opportunities(input_data: OpportunityAnalysisInput, use_mock_data: bool = True) -> OpportunityAnalysisOutput:
+def build_analysis_output(llm_results: List[Dict]) -> OpportunityAnalysisOutput:
+    """
+    将大模型解析结果转换为输出模型，取前5个结果，缺失字段使用默认值
+    """
+    return validate_output(llm_results)
+
+
+async def analyze_opportunities(input_data: OpportunityAnalysisInput,
+                                use_mock_data: bool = True,
+                                profile: Optional[float] = None) -> OpportunityAnalysisOutput:
     """
     分析建筑行业新商机
     根据建筑方向、客户类型和商机状态生成5个潜在客户分析
+    :param input_data: 分析输入参数
+    :param use_mock_data: 大模型调用失败时是否允许使用模拟数据
+    :param profile: 本次请求的剖析采样率（0~1，True视为1），为None时使用 PROFILE_ENABLED 全局配置
+    """
+    if (profile is not None or profiler.enabled) and profiler.should_sample(profile):
+        name = f"{input_data.construction_direction}-{input_data.customer_type}-{input_data.business_status}"
+        async with profiler.session(name):
+            return await _analyze_opportunities(input_data, use_mock_data)
+    return await _analyze_opportunities(input_data, use_mock_data)
+
+
+async def _analyze_opportunities(input_data: OpportunityAnalysisInput, use_mock_data: bool) -> OpportunityAnalysisOutput:
+    """
+    商机分析的实际处理流程
     """
     # 使用辅助类获取相关信息
     direction_desc = ConstructionOpportunityHelper.get_construction_direction_description(input_data.construction_direction)
     customer_desc = ConstructionOpportunityHelper.get_customer_type_description(input_data.customer_type)
     status_strategy = ConstructionOpportunityHelper.get_business_status_strategy(input_data.business_status)
     
+    labels, cache_key = analysis_cache_key(input_data)
+    
+    # 命中缓存时直接返回，缓存中保存的是已校验的数据；
+    # 已过期但仍可用的结果同样立即返回，并在后台刷新
+    with metrics.span("cache_lookup", **labels):
+        cached = await _cache_get(cache_key, allow_stale=True)
+        result_cache.record_access(cache_key)
+    if cached is None:
+        # 同一输入正在后台刷新或推测预取时等待其完成，避免重复调用大模型；
+        # 只等待优先级不低于本次请求的任务，交互请求不会排在批处理类别的刷新之后；
+        # 等待不会取消该任务，任务被取消或失败时由本次请求自行生成
+        pending = pending_refresh(cache_key, current_request_class())
+        if pending is not None:
+            await asyncio.wait([pending])
+            cached = await _cache_get(cache_key)
+    if cached is not None:
+        metrics.inc("llm_cache_hits_total", **labels)
+        if result_cache.is_stale(cached):
+            metrics.inc("llm_cache_stale_hits_total", **labels)
+            schedule_refresh(input_data)
+        return output_from_validated(cached.items)
+    
     # 调用大模型生成商机分析
-    llm_results = await opportunity_generator.generate_opportunities(
-        input_data.construction_direction,
-        input_data.customer_type,
-        input_data.business_status
-    )
+    try:
+        output = await _generate_validated(input_data, labels)
+    except Exception as e:
+        # 如果不允许使用模拟数据，直接抛出异常
+        if not use_mock_data:
+            raise Exception("大模型调用失败，且不允许使用模拟数据") from e
+        logger.warning("大模型调用失败: %s，使用模拟数据", e)
+        metrics.inc("llm_mock_fallbacks_total", **labels)
+        with metrics.span("fallback", **labels):
+            llm_results = opportunity_generator._generate_mock_data(
+                input_data.construction_direction,
+                input_data.customer_type,
+                input_data.business_status
+            )
+        return build_analysis_output(llm_results)
     
-    # 如果大模型返回了有效结果，使用它；否则使用原有逻辑
-    if llm_results and len(llm_results) >= 5:
-        opportunities = []
-        for item in llm_results[:5]:  # 取前5个结果
-            opportunities.append(OpportunityInfo(
-                company_name=item.get("company_name", "未知公司"),
-                project_info=item.get("project_info", "暂无项目信息"),
-                proof_info=item.get("proof_info", "暂无证明信息"),
-                inferred_info=item.get("inferred_info", "暂无推断信息"),
-                marketing_plan=item.get("marketing_plan", "暂无营销方案")
-            ))
-        return OpportunityAnalysisOutput(opportunities=opportunities)
+    # 如果大模型返回了有效结果，写入缓存；否则使用原有逻辑
+    if output is not None:
+        await store_output(cache_key, output)
+        return output
     
     # 如果不允许使用模拟数据，直接抛出异常
     if not use_mock_data:
         raise Exception("大模型调用失败，且不允许使用模拟数据")
     
+    metrics.inc("llm_mock_fallbacks_total", **labels)
+    with metrics.span("fallback", **labels):
+        return await _build_fallback_output(input_data, customer_desc, status_strategy)
+
+
+async def _cache_get(cache_key: str, allow_stale: bool = False):
+    """
+    在线程池中查询结果缓存，缓存文件被其他进程锁住时不阻塞事件循环
+    """
+    if not result_cache.enabled:
+        return None
+    return await asyncio.to_thread(result_cache.get, cache_key, allow_stale)
+
+
+def analysis_cache_key(input_data: OpportunityAnalysisInput) -> Tuple[Dict[str, str], str]:
+    """
+    获取当前服务商和模型对应的指标标签和缓存键
+    """
+    labels = opportunity_generator.llm_client.metric_labels()
+    cache_key = result_cache.make_key(
+        labels["provider"], labels["model"],
+        input_data.construction_direction, input_data.customer_type, input_data.business_status
+    )
+    return labels, cache_key
+
+
+async def _generate_validated(input_data: OpportunityAnalysisInput,
+                              labels: Dict[str, str]) -> Optional[OpportunityAnalysisOutput]:
+    """
+    调用大模型并校验结果，结果不足时返回None，调用失败时抛出异常
+    启用微批处理时，短时间内的多个不同组合合并为一次调用
+    """
+    llm_results = await micro_batcher.generate(
+        input_data.construction_direction,
+        input_data.customer_type,
+        input_data.business_status
+    )
+    if llm_results and len(llm_results) >= MIN_OPPORTUNITIES:
+        with metrics.span("validation", **labels):
+            output = build_analysis_output(llm_results)
+        # 去掉重复的公司后不足时视为结果不足
+        if len(output.opportunities) >= MIN_OPPORTUNITIES:
+            return output
+    return None
+
+
+async def refresh_analysis(input_data: OpportunityAnalysisInput, cache: Optional[ResultCache] = None,
+                           tracker: Optional[DependencyTracker] = None) -> bool:
+    """
+    重新调用大模型并覆盖缓存，供后台刷新、预热和增量更新使用
+    :param cache: 结果缓存，默认使用全局实例
+    :param tracker: 结果依赖跟踪器，默认使用全局实例
+    :return: 是否得到有效结果；调用失败时抛出异常，原有缓存保持不变
+    """
+    labels, cache_key = analysis_cache_key(input_data)
+    output = await _generate_validated(input_data, labels)
+    if output is None:
+        return False
+    await store_output(cache_key, output, cache, tracker)
+    return True
+
+
+async def store_output(cache_key: str, output: OpportunityAnalysisOutput, cache: Optional[ResultCache] = None,
+                       tracker: Optional[DependencyTracker] = None) -> None:
+    """
+    写入缓存并记录结果依赖的分类标签和来源文档，供公告入库时增量更新
+    SQLite写入在线程中执行，不阻塞事件循环
+    """
+    # ResultCache 定义了 __len__，空缓存为假值，不能用 or 判断
+    cache = cache if cache is not None else result_cache
+    if not cache.enabled:
+        return
+    items = output.model_dump()["opportunities"]
+    tracker = tracker or dependency_tracker
+
+    def write() -> None:
+        cache.put(cache_key, items)
+        tracker.record(cache_key, items)
+
+    await asyncio.to_thread(write)
+
+
+async def _run_refresh(input_data: OpportunityAnalysisInput, labels: Dict[str, str], request_class: str) -> bool:
+    """后台刷新任务，返回是否得到有效结果并写入缓存；失败时记录日志，不抛出异常"""
+    try:
+        with request_context(request_class=request_class):
+            refreshed = await refresh_analysis(input_data)
+        metrics.inc("llm_background_refreshes_total", outcome="ok" if refreshed else "invalid", **labels)
+        return refreshed
+    except Exception as e:
+        logger.warning("后台刷新失败: %s", e)
+        metrics.inc("llm_background_refreshes_total", outcome="error", **labels)
+        return False
+
+
+def pending_refreshes() -> int:
+    """正在进行的后台刷新任务数"""
+    return sum(1 for task in _refresh_tasks.values() if not task.done())
+
+
+def pending_refresh(cache_key: str, request_class: Optional[str] = None) -> Optional["asyncio.Task"]:
+    """
+    当前事件循环中该缓存键正在进行的后台刷新任务，需要在事件循环中调用
+    :param request_class: 只返回请求类别的优先级不低于该类别的任务，为None时不限
+    :return: 刷新任务，没有时返回None
+    """
+    task = _refresh_tasks.get(cache_key)
+    if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+        return None
+    if request_class is not None and \
+            REQUEST_CLASSES.index(_refresh_classes.get(cache_key, BATCH)) > REQUEST_CLASSES.index(request_class):
+        return None
+    return task
+
+
+def schedule_refresh(input_data: OpportunityAnalysisInput, request_class: str = BATCH) -> Optional["asyncio.Task"]:
+    """
+    在后台刷新一个输入组合的缓存
+    同一缓存键同时只有一个刷新任务；正在进行的后台刷新达到 REFRESH_MAX_INFLIGHT 时不再新增，
+    留待下一次访问或预热调度器处理，避免挤占在线请求
+    :param request_class: 公平调度的请求类别，后台刷新默认按批处理排在交互请求之后，租户沿用当前上下文
+    :return: 刷新任务，未安排时返回None
+    """
+    labels, cache_key = analysis_cache_key(input_data)
+    task = pending_refresh(cache_key)
+    if task is not None:
+        return task
+    loop = asyncio.get_running_loop()
+    # 清理已结束或属于其他事件循环的任务
+    for key, other in list(_refresh_tasks.items()):
+        if other.done() or other.get_loop().is_closed():
+            _refresh_tasks.pop(key, None)
+            _refresh_classes.pop(key, None)
+    if len(_refresh_tasks) >= REFRESH_MAX_INFLIGHT:
+        return None
+    task = loop.create_task(_run_refresh(input_data, labels, request_class))
+    _refresh_tasks[cache_key] = task
+    _refresh_classes[cache_key] = request_class
+
+    def _done(finished: "asyncio.Task") -> None:
+        if _refresh_tasks.get(cache_key) is finished:
+            del _refresh_tasks[cache_key]
+            _refresh_classes.pop(cache_key, None)
+
+    task.add_done_callback(_done)
+    return task
+
+
+async def _build_fallback_output(input_data: OpportunityAnalysisInput,
+                                 customer_desc: str,
+                                 status_strategy: str) -> OpportunityAnalysisOutput:
+    """
+    大模型结果不可用时，基于搜索结果和默认数据生成输出
+    """
     # 如果大模型调用失败或返回结果不足，使用原有逻辑
     # 搜索相关机会
     search_results = await search_for_construction_opportunities(
@@ -178,6 +369,61 @@ async def analyze_opportunities(input_data: OpportunityAnalysisInput, use_mock_d
     return OpportunityAnalysisOutput(opportunities=opportunities)
 
 
+def grid_inputs(construction_directions: Optional[Iterable[str]] = None,
+                customer_types: Optional[Iterable[str]] = None,
+                business_statuses: Optional[Iterable[str]] = None) -> Iterable[OpportunityAnalysisInput]:
+    """
+    生成输入组合的全排列，未指定的维度使用全部预设选项
+    返回惰性迭代器，不会一次性生成全部组合
+    """
+    for direction, customer_type, status in itertools.product(
+        list(construction_directions or CONSTRUCTION_DIRECTIONS),
+        list(customer_types or CUSTOMER_TYPES),
+        list(business_statuses or BUSINESS_STATUSES),
+    ):
+        yield OpportunityAnalysisInput(
+            construction_direction=direction, customer_type=customer_type, business_status=status
+        )
+
+
+async def iter_analyses(inputs: Iterable[OpportunityAnalysisInput],
+                        concurrency: int = 4,
+                        use_mock_data: bool = True,
+                        return_exceptions: bool = False) -> AsyncIterator[Tuple[OpportunityAnalysisInput, OpportunityAnalysisOutput]]:
+    """
+    并发分析多组输入，按完成顺序逐个产出 (输入, 结果)
+    同时进行中的分析不超过concurrency个，输入按需读取，可直接交给导出器流式写出
+    :param return_exceptions: 为True时单个分析失败不会中断迭代，而是以异常对象作为结果产出
+    """
+    source = iter(inputs)
+    pending = {}
+
+    def schedule() -> bool:
+        input_data = next(source, None)
+        if input_data is None:
+            return False
+        task = asyncio.ensure_future(analyze_opportunities(input_data, use_mock_data=use_mock_data))
+        pending[task] = input_data
+        return True
+
+    for _ in range(max(1, concurrency)):
+        if not schedule():
+            break
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                input_data = pending.pop(task)
+                if return_exceptions and task.exception() is not None:
+                    yield input_data, task.exception()
+                else:
+                    yield input_data, task.result()
+                schedule()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
 def main():
     """主函数，用于测试"""
     print("建筑行业新商机分析 Agent Skill")
@@ -0,0 +1,204 @@
+"""
+结果依赖跟踪
+记录每份缓存结果依赖的分类标签（施工方向及其关键词、客户类型）和来源文档（结果中引用的链接），
+新的招标公告入库时只把标签或来源匹配的结果标记为待更新，刷新任务按优先级只重新计算这些结果
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from schemas import CUSTOMER_TYPES
+from utils import DIRECTION_KEYWORDS
+
+# 依赖类型：主题标签、客户类型标签、来源文档
+TOPIC, CUSTOMER, SOURCE = "topic", "customer", "source"
+KINDS = (TOPIC, CUSTOMER, SOURCE)
+
+# 用于从文本中识别主题标签的词表，按长度从长到短匹配
+TOPIC_TERMS: Tuple[str, ...] = tuple(sorted(
+    set(DIRECTION_KEYWORDS) | {keyword for keywords in DIRECTION_KEYWORDS.values() for keyword in keywords},
+    key=len, reverse=True
+))
+
+_URL = re.compile(r"https?://[^\s，。；、)）\"'<>]+")
+
+Dependencies = Set[Tuple[str, str]]
+
+
+def _topic_terms(text: str) -> Set[str]:
+    return {term for term in TOPIC_TERMS if term in text}
+
+
+def report_dependencies(key: str, items: Iterable[Dict[str, Any]]) -> Dependencies:
+    """
+    计算一份结果的依赖
+    主题标签为施工方向及其检索关键词，加上结果项目信息中出现的其他分类词；来源为证明和推断信息中引用的链接
+    :param key: 缓存键，包含服务商、模型和三个输入参数
+    :return: (依赖类型, 值) 集合
+    """
+    _, _, direction, customer_type, _ = json.loads(key)
+    dependencies = {(TOPIC, direction), (CUSTOMER, customer_type)}
+    dependencies.update((TOPIC, keyword) for keyword in DIRECTION_KEYWORDS.get(direction, ()))
+    for item in items:
+        dependencies.update((TOPIC, term) for term in _topic_terms(item.get("project_info", "")))
+        for field in ("proof_info", "inferred_info"):
+            dependencies.update((SOURCE, url.rstrip(".,")) for url in _URL.findall(item.get(field, "")))
+    return dependencies
+
+
+def notice_tags(notice: Dict[str, Any]) -> Dependencies:
+    """
+    计算招标公告的标签
+    公告带有 tags 时直接使用（"customer:国企" 形式指定类型，不带已知类型前缀的视为主题标签，
+    例如 "https://..." 中的冒号不作为分隔符），
+    否则从标题和正文中识别施工方向、关键词和客户类型；公告链接作为来源
+    :param notice: 包含 title、content，可选 url、customer_type、tags 的字典
+    """
+    tags: Dependencies = set()
+    if notice.get("tags"):
+        for tag in notice["tags"]:
+            kind, separator, value = tag.partition(":")
+            if not separator or kind.strip() not in KINDS:
+                kind, value = TOPIC, tag
+            tags.add((kind.strip(), value.strip()))
+    else:
+        text = f"{notice.get('title', '')}\n{notice.get('content', '')}"
+        tags.update((TOPIC, term) for term in _topic_terms(text))
+        tags.update((CUSTOMER, customer_type) for customer_type in CUSTOMER_TYPES if customer_type in text)
+    if notice.get("customer_type"):
+        tags.add((CUSTOMER, notice["customer_type"]))
+    if notice.get("url"):
+        tags.add((SOURCE, notice["url"]))
+    return tags
+
+
+class DependencyTracker:
+    """
+    依赖跟踪器
+    依赖以 (类型, 值) 倒排存储在SQLite中，可与结果缓存使用同一个文件
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        """
+        :param path: SQLite数据库路径，":memory:" 表示仅在进程内记录
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30.0)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dependencies ("
+            " key TEXT NOT NULL,"
+            " kind TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " PRIMARY KEY (key, kind, value))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS dependencies_value ON dependencies (kind, value)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dirty ("
+            " key TEXT PRIMARY KEY,"
+            " notices INTEGER NOT NULL,"
+            " marked_at REAL NOT NULL)"
+        )
+
+    def record(self, key: str, items: Iterable[Dict[str, Any]]) -> None:
+        """
+        结果写入缓存后记录其依赖，并清除待更新标记
+        """
+        rows = [(key, kind, value) for kind, value in report_dependencies(key, items)]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("DELETE FROM dependencies WHERE key = ?", (key,))
+                self._conn.executemany("INSERT OR IGNORE INTO dependencies (key, kind, value) VALUES (?, ?, ?)", rows)
+                self._conn.execute("DELETE FROM dirty WHERE key = ?", (key,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def dependencies(self, key: str) -> Dependencies:
+        with self._lock:
+            rows = self._conn.execute("SELECT kind, value FROM dependencies WHERE key = ?", (key,)).fetchall()
+        return set(rows)
+
+    def _keys_with(self, kind: str, values: Iterable[str]) -> Set[str]:
+        values = list(values)
+        if not values:
+            return set()
+        placeholders = ",".join("?" * len(values))
+        rows = self._conn.execute(
+            f"SELECT DISTINCT key FROM dependencies WHERE kind = ? AND value IN ({placeholders})",
+            (kind, *values)
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    def affected_keys(self, notice: Dict[str, Any]) -> Set[str]:
+        """
+        受一条公告影响的结果：主题标签有交集，且公告指定客户类型时客户类型一致；或者引用了该公告
+        """
+        tags = notice_tags(notice)
+        topics = [value for kind, value in tags if kind == TOPIC]
+        customers = [value for kind, value in tags if kind == CUSTOMER]
+        sources = [value for kind, value in tags if kind == SOURCE]
+        with self._lock:
+            keys = self._keys_with(TOPIC, topics)
+            if keys and customers:
+                keys &= self._keys_with(CUSTOMER, customers)
+            keys |= self._keys_with(SOURCE, sources)
+        return keys
+
+    def ingest(self, notices: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        处理新入库的公告，将受影响的结果标记为待更新
+        :return: 本次标记的缓存键及匹配的公告数
+        """
+        marked: Dict[str, int] = {}
+        for notice in notices:
+            for key in self.affected_keys(notice):
+                marked[key] = marked.get(key, 0) + 1
+        if marked:
+            now = time.time()
+            with self._lock:
+                self._conn.executemany(
+                    "INSERT INTO dirty (key, notices, marked_at) VALUES (?, ?, ?)"
+                    " ON CONFLICT(key) DO UPDATE SET notices = notices + excluded.notices",
+                    [(key, count, now) for key, count in marked.items()]
+                )
+        return marked
+
+    def is_dirty(self, key: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM dirty WHERE key = ?", (key,)).fetchone() is not None
+
+    def dirty_keys(self, limit: Optional[int] = None,
+                   hits: Optional[Dict[str, int]] = None) -> List[Tuple[str, float]]:
+        """
+        待更新的结果，按优先级从高到低排序
+        优先级为 (访问次数 + 1) × 匹配的公告数，相同时先标记的优先
+        :param hits: 各缓存键的访问次数，通常为 result_cache.access_counts()
+        :return: (缓存键, 优先级) 列表
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT key, notices, marked_at FROM dirty").fetchall()
+        hits = hits or {}
+        ranked = sorted(((key, (hits.get(key, 0) + 1) * notices, marked_at) for key, notices, marked_at in rows),
+                        key=lambda row: (-row[1], row[2]))
+        return [(key, priority) for key, priority, _ in ranked[:limit]]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM dependencies")
+            self._conn.execute("DELETE FROM dirty")
+
+
+# 全局实例，默认与结果缓存使用同一个文件
+dependency_tracker = DependencyTracker(
+    path=os.getenv("DEPENDENCY_DB_PATH", os.getenv("RESULT_CACHE_PATH", ":memory:"))
+)
@@ -0,0 +1,424 @@
+"""
+域名信誉索引
+大模型生成的证明信息和推断信息经常引用不存在的域名，逐个联网验证很慢。
+索引由内置的政府、招标和企业网站，本地招标公告中的链接和历史验证结果构建：
+可信域名按反转后的域名标签排序存放（扁平化的后缀字典树），验证失败的域名存入布隆过滤器，两者写入同一个内存映射文件，
+链接在微秒级被分为可信、可疑和未知三类，只有未知的链接需要联网验证。
+新的验证结果追加到结果日志后立即生效，积累到一定数量时合并重建索引文件
+"""
+import array
+import functools
+import hashlib
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+from metrics import get_logger
+from utils import ENTERPRISE_SITES, GOVERNMENT_SITES, TENDER_SITES
+
+logger = get_logger("domain_index")
+
+# 分类结果
+TRUSTED, SUSPECT, UNKNOWN = "trusted", "suspect", "unknown"
+
+_MAGIC = b"DOMIDX01"
+# 条目数、布隆过滤器位数、哈希函数个数、已合并到索引的日志字节数
+_HEADER = struct.Struct("<IIIQ")
+# 可信条目的类型：只信任该域名本身，或同时信任其全部子域名
+_EXACT, _SUBDOMAINS = 0, 1
+
+# 布隆过滤器的目标误判率
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+_MIN_BLOOM_BITS = 1024
+
+# 进程内分类结果缓存的条目上限
+_CACHE_SIZE = 4096
+
+# 链接只由ASCII字符组成，遇到中文、全角标点或【】包裹即结束
+_URL = re.compile(r"https?://[A-Za-z0-9\-._~:/?#@!$&*+,;=%\[\]]+")
+
+
+@functools.lru_cache(maxsize=65536)
+def normalize_host(url: str) -> str:
+    """
+    取链接或域名中的主机名，转为小写并去掉端口和首尾的点
+    :return: 无法解析时返回空字符串
+    """
+    text = url.strip()
+    try:
+        host = urlsplit(text if "://" in text else f"//{text}").hostname or ""
+    except ValueError:
+        return ""
+    return host.strip(".")
+
+
+def extract_urls(text: str) -> List[str]:
+    """提取文本中的链接，去重并保持出现顺序"""
+    return list(dict.fromkeys(url.rstrip(".,") for url in _URL.findall(text)))
+
+
+def _reversed_labels(host: str) -> List[str]:
+    labels = host.split(".")
+    labels.reverse()
+    return labels
+
+
+def _seed_domain(url: str) -> str:
+    # 内置网站去掉 www. 前缀后信任整个域名，例如 www.gov.cn 对应全部 *.gov.cn
+    host = normalize_host(url)
+    return host[4:] if host.startswith("www.") else host
+
+
+SEED_DOMAINS: Tuple[str, ...] = tuple(dict.fromkeys(
+    _seed_domain(url) for url in GOVERNMENT_SITES + TENDER_SITES + ENTERPRISE_SITES
+))
+
+
+def _bloom_positions(host: str, bits: int, hashes: int) -> Iterator[int]:
+    # 双重哈希：由一个128位摘要派生全部位置
+    digest = hashlib.blake2b(host.encode("utf-8"), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:], "little") | 1
+    for i in range(hashes):
+        yield (h1 + i * h2) % bits
+
+
+def _encode(entries: Dict[str, int], bad: Iterable[str], log_offset: int) -> bytes:
+    """
+    索引文件布局：文件头、各条目的起始偏移（比条目数多一个）、条目类型、布隆过滤器、按反转域名排序的条目
+    """
+    keys = sorted((".".join(_reversed_labels(host)).encode("utf-8"), flag) for host, flag in entries.items())
+    offsets = array.array("I", [0])
+    for key, _ in keys:
+        offsets.append(offsets[-1] + len(key))
+    bad = sorted(set(bad))
+    bits = max(_MIN_BLOOM_BITS, math.ceil(-len(bad) * math.log(BLOOM_FALSE_POSITIVE_RATE) / math.log(2) ** 2))
+    bits += -bits % 8
+    hashes = max(1, round(bits / len(bad) * math.log(2))) if bad else 1
+    hashes = min(hashes, 16)
+    bloom = bytearray(bits // 8)
+    for host in bad:
+        for position in _bloom_positions(host, bits, hashes):
+            bloom[position >> 3] |= 1 << (position & 7)
+    return b"".join((
+        _MAGIC,
+        _HEADER.pack(len(keys), bits, hashes, log_offset),
+        offsets.tobytes(),
+        bytes(flag for _, flag in keys),
+        bytes(bloom),
+        b"".join(key for key, _ in keys),
+    ))
+
+
+class DomainIndex:
+    """
+    域名信誉索引
+    索引文件 path 只在重建时整体替换，读取通过内存映射完成；验证结果追加到 path.log（每行 [域名, 是否有效, 是否包含子域名]）。
+    path 为 None 时索引和日志只保存在进程内
+    """
+
+    def __init__(self, path: Optional[str] = None, rebuild_threshold: int = 256):
+        """
+        :param path: 索引文件路径
+        :param rebuild_threshold: 未合并的验证结果达到该数量时重建索引
+        """
+        self.path = path
+        self.log_path = f"{path}.log" if path else None
+        self.rebuild_threshold = max(1, rebuild_threshold)
+        self._lock = threading.RLock()
+        self._memory_log: List[Tuple[str, int, int]] = []
+        # 尚未合并到索引文件的验证结果
+        self._pending_trusted: Dict[str, int] = {}
+        self._pending_bad: Set[str] = set()
+        self._cache: Dict[str, str] = {}
+        self._map: Optional[mmap.mmap] = None
+        self._offsets: Optional[memoryview] = None
+
+        if path and os.path.exists(path):
+            self._load()
+            self._replay(self._log_offset)
+        else:
+            self.rebuild()
+
+    # ------------------------------------------------------------------
+    # 索引文件
+    # ------------------------------------------------------------------
+
+    def _load(self) -> None:
+        with open(self.path, "rb") as f:
+            self._attach(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def _attach(self, mapped: mmap.mmap) -> None:
+        if mapped[:len(_MAGIC)] != _MAGIC:
+            mapped.close()
+            raise ValueError(f"不是有效的域名索引文件: {self.path}")
+        count, bits, hashes, log_offset = _HEADER.unpack_from(mapped, len(_MAGIC))
+        start = len(_MAGIC) + _HEADER.size
+        self._map = mapped
+        self._count = count
+        self._bloom_bits = bits
+        self._bloom_hashes = hashes
+        self._log_offset = log_offset
+        self._offsets = memoryview(mapped)[start:start + 4 * (count + 1)].cast("I")
+        self._flags_start = start + 4 * (count + 1)
+        self._bloom_start = self._flags_start + count
+        self._keys_start = self._bloom_start + bits // 8
+
+    def _detach(self) -> None:
+        if self._offsets is not None:
+            self._offsets.release()
+            self._offsets = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _find(self, key: bytes) -> int:
+        """二分查找反转后的域名，返回条目类型，不存在时返回 -1"""
+        mapped, offsets, base = self._map, self._offsets, self._keys_start
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            probe = mapped[base + offsets[mid]:base + offsets[mid + 1]]
+            if probe < key:
+                lo = mid + 1
+            elif probe > key:
+                hi = mid
+            else:
+                return mapped[self._flags_start + mid]
+        return -1
+
+    def _in_bloom(self, host: str) -> bool:
+        mapped, start = self._map, self._bloom_start
+        return all(mapped[start + (position >> 3)] & (1 << (position & 7))
+                   for position in _bloom_positions(host, self._bloom_bits, self._bloom_hashes))
+
+    # ------------------------------------------------------------------
+    # 验证结果日志
+    # ------------------------------------------------------------------
+
+    def _read_log(self, offset: int = 0) -> Iterator[Tuple[str, int, int]]:
+        if self.log_path is None:
+            yield from self._memory_log
+            return
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    host, ok, subdomains = json.loads(line)
+                except ValueError:
+                    # 写入中断留下的不完整行
+                    continue
+                yield host, ok, subdomains
+
+    def _append_log(self, records: List[Tuple[str, int, int]]) -> None:
+        if self.log_path is None:
+            self._memory_log.extend(records)
+            return
+        data = "".join(json.dumps(list(record), ensure_ascii=False) + "\n" for record in records).encode("utf-8")
+        with open(self.log_path, "a+b") as f:
+            # 上次写入中断时末尾没有换行，新记录另起一行
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    data = b"\n" + data
+            f.write(data)
+
+    def _apply(self, host: str, ok: int, subdomains: int) -> None:
+        if ok:
+            self._pending_bad.discard(host)
+            self._pending_trusted[host] = max(self._pending_trusted.get(host, _EXACT), subdomains)
+        else:
+            self._pending_bad.add(host)
+            self._pending_trusted.pop(host, None)
+
+    def _replay(self, offset: int) -> None:
+        for host, ok, subdomains in self._read_log(offset):
+            self._apply(host, ok, subdomains)
+        if len(self._pending_trusted) + len(self._pending_bad) >= self.rebuild_threshold:
+            self.rebuild()
+
+    # ------------------------------------------------------------------
+    # 分类
+    # ------------------------------------------------------------------
+
+    def _classify(self, host: str) -> str:
+        # 顺序：未合并的验证失败、确切的可信域名、布隆过滤器中的失败记录、可信的上级域名
+        if host in self._pending_bad:
+            return SUSPECT
+        if host in self._pending_trusted:
+            return TRUSTED
+        labels = _reversed_labels(host)
+        if self._find(".".join(labels).encode("utf-8")) >= 0:
+            return TRUSTED
+        if self._in_bloom(host):
+            return SUSPECT
+        for size in range(len(labels) - 1, 0, -1):
+            parent = labels[:size]
+            if self._pending_trusted.get(".".join(reversed(parent))) == _SUBDOMAINS:
+                return TRUSTED
+            if self._find(".".join(parent).encode("utf-8")) == _SUBDOMAINS:
+                return TRUSTED
+        return UNKNOWN
+
+    def classify(self, url: str) -> str:
+        """
+        对链接或域名分类
+        :return: TRUSTED、SUSPECT 或 UNKNOWN；无法解析出主机名的链接视为可疑
+        """
+        host = normalize_host(url)
+        if not host:
+            return SUSPECT
+        verdict = self._cache.get(host)
+        if verdict is None:
+            with self._lock:
+                verdict = self._classify(host)
+                if len(self._cache) >= _CACHE_SIZE:
+                    self._cache.clear()
+                self._cache[host] = verdict
+        return verdict
+
+    def screen(self, text: str) -> Dict[str, List[str]]:
+        """
+        提取文本中的全部链接并分类
+        :return: 各分类下的链接列表
+        """
+        screened: Dict[str, List[str]] = {TRUSTED: [], SUSPECT: [], UNKNOWN: []}
+        for url in extract_urls(text):
+            screened[self.classify(url)].append(url)
+        return screened
+
+    # ------------------------------------------------------------------
+    # 更新
+    # ------------------------------------------------------------------
+
+    def record_many(self, outcomes: Iterable[Tuple[str, bool]], subdomains: bool = False) -> int:
+        """
+        记录一批验证结果，立即生效；未合并的结果达到阈值时重建索引
+        :param outcomes: (链接或域名, 是否有效) 列表
+        :param subdomains: 有效时是否同时信任其全部子域名
+        :return: 记录的域名数
+        """
+        records = []
+        for url, ok in outcomes:
+            host = normalize_host(url)
+            if host:
+                records.append((host, int(bool(ok)), int(bool(ok and subdomains))))
+        if not records:
+            return 0
+        with self._lock:
+            self._append_log(records)
+            for record in records:
+                self._apply(*record)
+            self._cache.clear()
+            if len(self._pending_trusted) + len(self._pending_bad) >= self.rebuild_threshold:
+                self.rebuild()
+        return len(records)
+
+    def record(self, url: str, ok: bool) -> None:
+        """记录一条联网验证结果"""
+        self.record_many([(url, ok)])
+
+    def add_trusted(self, urls: Iterable[str], subdomains: bool = False) -> int:
+        """将链接或域名加入可信域名"""
+        return self.record_many(((url, True) for url in urls), subdomains=subdomains)
+
+    def learn_notices(self, notices: Iterable[Dict[str, Any]]) -> int:
+        """
+        将本地招标公告的链接和正文中引用的链接加入可信域名
+        :param notices: 包含 url、content 的公告字典
+        """
+        urls: List[str] = []
+        for notice in notices:
+            if notice.get("url"):
+                urls.append(notice["url"])
+            urls.extend(extract_urls(notice.get("content", "")))
+        return self.add_trusted(urls)
+
+    def rebuild(self) -> None:
+        """
+        由内置网站和完整的验证结果日志重建索引文件，每个域名以最后一次结果为准，日志同时压缩
+        """
+        with self._lock:
+            state: Dict[str, Tuple[int, int]] = {}
+            for host, ok, subdomains in self._read_log():
+                previous = state.get(host)
+                if ok and previous and previous[0]:
+                    subdomains = max(subdomains, previous[1])
+                state[host] = (ok, subdomains)
+            records = [(host, ok, subdomains) for host, (ok, subdomains) in state.items()]
+            log_offset = self._compact_log(records)
+
+            entries = {domain: _SUBDOMAINS for domain in SEED_DOMAINS}
+            bad = []
+            for host, ok, subdomains in records:
+                if ok:
+                    entries[host] = max(entries.get(host, _EXACT), subdomains)
+                else:
+                    bad.append(host)
+            data = _encode(entries, bad, log_offset)
+
+            self._detach()
+            if self.path is None:
+                mapped = mmap.mmap(-1, len(data))
+                mapped.write(data)
+                self._attach(mapped)
+            else:
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+                self._load()
+            self._pending_trusted.clear()
+            self._pending_bad.clear()
+            self._cache.clear()
+            logger.debug(f"域名索引已重建：可信 {len(entries)}，失败 {len(bad)}")
+
+    def _compact_log(self, records: List[Tuple[str, int, int]]) -> int:
+        """用每个域名的最终结果重写日志，返回日志长度"""
+        if self.log_path is None:
+            self._memory_log = list(records)
+            return len(records)
+        tmp_path = f"{self.log_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(list(record), ensure_ascii=False) + "\n" for record in records))
+        os.replace(tmp_path, self.log_path)
+        return os.path.getsize(self.log_path)
+
+    def stats(self) -> Dict[str, int]:
+        """索引中的条目数和未合并的验证结果数"""
+        with self._lock:
+            return {
+                "entries": self._count,
+                "bloom_bits": self._bloom_bits,
+                "pending_trusted": len(self._pending_trusted),
+                "pending_bad": len(self._pending_bad),
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._detach()
+
+
+def create_domain_index() -> DomainIndex:
+    """
+    根据环境变量创建域名信誉索引
+    DOMAIN_INDEX_PATH 未设置时索引只保存在进程内
+    """
+    return DomainIndex(
+        path=os.getenv("DOMAIN_INDEX_PATH") or None,
+        rebuild_threshold=int(os.getenv("DOMAIN_INDEX_REBUILD_THRESHOLD", "256")),
+    )
+
+
+# 全局实例
+domain_index = create_domain_index()
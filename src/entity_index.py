@@ -0,0 +1,306 @@
+"""
+公司实体索引
+按规范化的公司名称归并同一客户的不同写法（全称、简称、带或不带“集团”等），
+并基于公司名称和项目信息的SimHash指纹发现跨报告的近似重复；单次结果内按规范化名称去重
+"""
+import functools
+import re
+import sys
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+# 常见央企、国企简称与全称前缀，按简称长度从长到短匹配
+ABBREVIATIONS = (
+    ("中建材", "中国建材"),
+    ("中电建", "中国电建"),
+    ("中能建", "中国能建"),
+    ("中化学", "中国化学"),
+    ("中铁建", "中国铁建"),
+    ("中建", "中国建筑"),
+    ("中铁", "中国中铁"),
+    ("中交", "中国交建"),
+    ("中冶", "中国中冶"),
+    ("铁建", "中国铁建"),
+)
+
+# 规范化时去掉的组织形式后缀，按长度从长到短匹配
+LEGAL_SUFFIXES = (
+    "股份有限公司", "有限责任公司", "集团有限公司", "有限公司", "集团公司",
+    "控股集团", "集团", "股份", "公司",
+)
+
+# 指纹近似判定的默认海明距离
+DEFAULT_MAX_DISTANCE = 3
+
+_FINGERPRINT_BITS = 64
+_BAND_COUNT = DEFAULT_MAX_DISTANCE + 1
+_BAND_BITS = _FINGERPRINT_BITS // _BAND_COUNT
+_BAND_MASK = (1 << _BAND_BITS) - 1
+
+# 单个实体最多保留的指纹数，避免高频公司的指纹无限增长
+_MAX_FINGERPRINTS = 8
+
+_PUNCTUATION = re.compile(r"[\s\"'“”‘’·・.,，。、:：;；!！?？\-—_/\\|]+")
+_BRACKETED = re.compile(r"[（(]([^（）()]*)[)）]")
+_BUREAU = re.compile(r"第?([一二三四五六七八九十]+)工程局")
+_ARABIC_NUMBER = re.compile(r"\d+")
+_CHINESE_DIGITS = "〇一二三四五六七八九"
+# 中铁十一局至二十五局属于中国铁建，不能按“中铁”展开为中国中铁
+_CRCC_BUREAU = re.compile(r"中铁(?=(?:十[一二三四五六七八九]|二十[一二三四五]?)局)")
+_SUFFIXES = re.compile("(?:" + "|".join(LEGAL_SUFFIXES) + ")+$")
+
+
+def _chinese_number(match: "re.Match") -> str:
+    """
+    阿拉伯数字转为中文数字：100以内按“十一”“二十”的写法，与“第十一工程局”一致；更长的数字（如年份）逐位转换
+    """
+    digits = match.group()
+    value = int(digits)
+    if value == 0 or value >= 100:
+        return "".join(_CHINESE_DIGITS[int(digit)] for digit in digits)
+    tens, ones = divmod(value, 10)
+    return ((_CHINESE_DIGITS[tens] if tens > 1 else "") + ("十" if tens else "")
+            + (_CHINESE_DIGITS[ones] if ones else ""))
+
+
+@functools.lru_cache(maxsize=65536)
+def normalize_company_name(name: str) -> str:
+    """
+    规范化公司名称
+    去掉标点和括号中的“集团”等说明、组织形式后缀，统一“第X工程局”为“X局”，并将常见简称展开为全称前缀，
+    例如“中国建筑第八工程局有限公司”和“中建八局”都规范化为“中国建筑八局”；
+    中铁十一局至二十五局属于中国铁建，规范化为“中国铁建十一局”等
+    """
+    text = _PUNCTUATION.sub("", name.strip())
+    # 括号中只有组织形式说明时去掉，否则保留括号中的内容
+    text = _BRACKETED.sub(lambda match: "" if match.group(1) in LEGAL_SUFFIXES else match.group(1), text)
+    text = _ARABIC_NUMBER.sub(_chinese_number, text)
+    # 名称只由后缀组成时（如“集团”）保持不变
+    text = _SUFFIXES.sub("", text) or text
+    text = _BUREAU.sub(r"\1局", text)
+    if _CRCC_BUREAU.match(text):
+        return "中国铁建" + text[2:]
+    for short, full in ABBREVIATIONS:
+        if text.startswith(short) and not text.startswith(full):
+            text = full + text[len(short):]
+            break
+    return text
+
+
+def _spread_table() -> List[int]:
+    """每个字节的8个比特分别放入8个16位计数槽"""
+    table = []
+    for byte in range(256):
+        value = 0
+        for bit in range(8):
+            if byte >> bit & 1:
+                value |= 1 << (bit * 16)
+        table.append(value)
+    return table
+
+
+_SPREAD = _spread_table()
+_SHINGLE_CACHE: Dict[str, int] = {}
+_SHINGLE_CACHE_LIMIT = 200000
+
+
+def _shingle_vector(shingle: str) -> int:
+    """
+    将片段的64位哈希展开为64个16位计数槽，累加后即可一次得到每一位的计数
+    常见的二元片段反复出现，结果缓存在内存中
+    """
+    vector = _SHINGLE_CACHE.get(shingle)
+    if vector is None:
+        data = shingle.encode("utf-8")
+        value = zlib.crc32(data) | zlib.crc32(data, 0x9E3779B9) << 32
+        vector = 0
+        for index in range(8):
+            vector |= _SPREAD[value >> (index * 8) & 0xFF] << (index * 128)
+        if len(_SHINGLE_CACHE) >= _SHINGLE_CACHE_LIMIT:
+            _SHINGLE_CACHE.clear()
+        _SHINGLE_CACHE[shingle] = vector
+    return vector
+
+
+def _shingles(text: str) -> List[str]:
+    if len(text) < 2:
+        return [text] if text else []
+    return [text[index:index + 2] for index in range(len(text) - 1)]
+
+
+def simhash(weighted_texts: Iterable[Tuple[str, int]]) -> int:
+    """
+    计算64位SimHash指纹，特征为字符二元片段
+    :param weighted_texts: (文本, 权重) 列表
+    """
+    accumulator = 0
+    total = 0
+    cached = _SHINGLE_CACHE.get
+    for text, weight in weighted_texts:
+        # 每个计数槽为16位，限制文本长度避免溢出
+        shingles = _shingles(text[:2000])
+        accumulator += sum([cached(shingle) or _shingle_vector(shingle) for shingle in shingles]) * weight
+        total += len(shingles) * weight
+    # 一次性取出64个16位计数，多数为1的位置1
+    counts = memoryview(accumulator.to_bytes(_FINGERPRINT_BITS * 2, sys.byteorder)).cast("H")
+    fingerprint = 0
+    for bit, count in enumerate(counts):
+        if count * 2 > total:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def fingerprint(company_name: str, project_info: str = "") -> int:
+    """
+    公司名称和项目信息的指纹，名称使用规范化形式并加倍权重
+    """
+    return _fingerprint(normalize_company_name(company_name), project_info)
+
+
+def _fingerprint(normalized_name: str, project_info: str) -> int:
+    return simhash(((normalized_name, 2), (_PUNCTUATION.sub("", project_info), 1)))
+
+
+def hamming_distance(left: int, right: int) -> int:
+    return bin(left ^ right).count("1")
+
+
+def _bands(value: int) -> Iterator[Tuple[int, int]]:
+    """
+    将指纹分为 _BAND_COUNT 段；海明距离不超过 _BAND_COUNT - 1 的两个指纹至少有一段完全相同
+    """
+    for band in range(_BAND_COUNT):
+        yield band, value >> (band * _BAND_BITS) & _BAND_MASK
+
+
+class Entity:
+    """归并后的公司实体"""
+    __slots__ = ("entity_id", "name", "aliases", "keys", "fingerprints", "mentions", "reports")
+
+    def __init__(self, entity_id: int, name: str):
+        self.entity_id = entity_id
+        self.name = name
+        self.aliases: Set[str] = {name}
+        self.keys: Set[str] = set()
+        self.fingerprints: List[int] = []
+        self.mentions = 0
+        self.reports: Set[Any] = set()
+
+    def __repr__(self) -> str:
+        return f"Entity(entity_id={self.entity_id}, name={self.name!r}, mentions={self.mentions})"
+
+
+class EntityIndex:
+    """
+    公司实体索引
+    规范化名称到实体为字典精确查找；近似查找将64位指纹分段建立倒排表，只比较至少一段相同的候选，
+    新的报告到达时可逐条增量加入
+    """
+
+    def __init__(self, max_distance: int = DEFAULT_MAX_DISTANCE):
+        """
+        :param max_distance: 判定为同一实体的最大海明距离，不超过 DEFAULT_MAX_DISTANCE
+        """
+        if not 0 <= max_distance <= DEFAULT_MAX_DISTANCE:
+            raise ValueError(f"max_distance 应在 0 到 {DEFAULT_MAX_DISTANCE} 之间")
+        self.max_distance = max_distance
+        self.entities: List[Entity] = []
+        self._by_key: Dict[str, Entity] = {}
+        self._bands: List[Dict[int, List[Tuple[int, Entity]]]] = [{} for _ in range(_BAND_COUNT)]
+
+    def __len__(self) -> int:
+        return len(self.entities)
+
+    def __iter__(self) -> Iterator[Entity]:
+        return iter(self.entities)
+
+    def lookup(self, company_name: str) -> Optional[Entity]:
+        """按规范化名称精确查找"""
+        return self._by_key.get(normalize_company_name(company_name))
+
+    def find_similar(self, company_name: str, project_info: str = "",
+                     max_distance: Optional[int] = None) -> List[Tuple[Entity, int]]:
+        """
+        近似查找
+        :return: (实体, 海明距离) 列表，按距离从小到大排序
+        """
+        limit = self.max_distance if max_distance is None else min(max_distance, DEFAULT_MAX_DISTANCE)
+        return self._similar(fingerprint(company_name, project_info), limit)
+
+    def _similar(self, value: int, limit: int) -> List[Tuple[Entity, int]]:
+        best: Dict[int, Tuple[Entity, int]] = {}
+        for band, part in _bands(value):
+            for candidate, entity in self._bands[band].get(part, ()):
+                distance = hamming_distance(value, candidate)
+                if distance <= limit and (entity.entity_id not in best or distance < best[entity.entity_id][1]):
+                    best[entity.entity_id] = (entity, distance)
+        return sorted(best.values(), key=lambda item: item[1])
+
+    def add(self, company_name: str, project_info: str = "", report: Any = None) -> Entity:
+        """
+        加入一条公司信息，返回其所属实体；名称或指纹与已有实体匹配时归并
+        :param report: 报告标识，例如缓存键，用于统计实体出现在哪些报告中
+        """
+        key = normalize_company_name(company_name)
+        value = _fingerprint(key, project_info)
+        entity = self._by_key.get(key)
+        if entity is None:
+            similar = self._similar(value, self.max_distance)
+            if similar:
+                entity = similar[0][0]
+            else:
+                entity = Entity(len(self.entities), company_name)
+                self.entities.append(entity)
+            self._by_key[key] = entity
+            entity.keys.add(key)
+        entity.aliases.add(company_name)
+        entity.mentions += 1
+        if report is not None:
+            entity.reports.add(report)
+        if len(entity.fingerprints) < _MAX_FINGERPRINTS and value not in entity.fingerprints:
+            entity.fingerprints.append(value)
+            for band, part in _bands(value):
+                self._bands[band].setdefault(part, []).append((value, entity))
+        return entity
+
+    def add_output(self, output, report: Any = None) -> List[Entity]:
+        """
+        加入一份分析结果中的全部商机
+        :param output: OpportunityAnalysisOutput 或商机字典列表
+        """
+        items = output.opportunities if hasattr(output, "opportunities") else output
+        entities = []
+        for item in items:
+            if isinstance(item, dict):
+                entities.append(self.add(item.get("company_name", ""), item.get("project_info", ""), report))
+            else:
+                entities.append(self.add(item.company_name, item.project_info, report))
+        return entities
+
+    def most_mentioned(self, count: int = 10) -> List[Entity]:
+        """出现次数最多的实体"""
+        return sorted(self.entities, key=lambda entity: entity.mentions, reverse=True)[:count]
+
+
+def dedupe_opportunities(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    去掉单次结果中重复的公司，判定规则与实体索引的精确查找一致（规范化名称相同）
+    同一结果中名称不同而项目相近的多条，通常是同一项目的不同参建单位，不视为重复
+    保留首次出现的条目并保持原有顺序；去重后数量不足时由调用方判定结果无效，不会补回重复条目
+    :return: 去重后的列表
+    """
+    if len(items) < 2:
+        return list(items)
+    seen: Set[str] = set()
+    unique: List[Dict[str, Any]] = []
+    for item in items:
+        name = item.get("company_name")
+        if not isinstance(name, str) or not name:
+            unique.append(item)
+            continue
+        key = normalize_company_name(name)
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append(item)
+    return unique
@@ -0,0 +1,278 @@
+"""
+分析结果流式导出
+从异步迭代器逐条读取分析结果，以有界批次增量写入NDJSON、CSV（带UTF-8 BOM，Excel可直接打开）和XLSX文件，
+内存占用与导出的总行数无关
+"""
+import asyncio
+import csv
+import io
+import json
+import re
+import zipfile
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, List, Optional, Tuple, Union
+from xml.sax.saxutils import escape
+
+from result_store import INPUT_FIELDS, ColumnarResultStore, RowView
+from schemas import OPPORTUNITY_FIELDS, OpportunityAnalysisInput, OpportunityAnalysisOutput
+
+
+EXPORT_COLUMNS = INPUT_FIELDS + ("position",) + OPPORTUNITY_FIELDS
+
+# 表格文件的列：分析失败的输入导出为一行，只填写输入参数和错误信息
+TABLE_COLUMNS = EXPORT_COLUMNS + ("error",)
+
+# 表格文件使用的中文表头
+COLUMN_TITLES = {
+    "construction_direction": "建筑方向",
+    "customer_type": "客户类型",
+    "business_status": "商机状态",
+    "position": "序号",
+    "company_name": "公司名称",
+    "project_info": "项目信息",
+    "proof_info": "证明信息",
+    "inferred_info": "推断信息",
+    "marketing_plan": "营销方案",
+    "error": "错误信息",
+}
+
+# 默认每累计多少行写入一次文件
+DEFAULT_FLUSH_ROWS = 500
+
+# Excel单元格最多容纳的字符数
+_XLSX_CELL_LIMIT = 32767
+_XML_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+# 以这些字符开头的CSV单元格会被Excel等表格软件当作公式执行；XLSX的内联字符串单元格不会被求值
+_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+ResultItem = Union[
+    Tuple[OpportunityAnalysisInput, OpportunityAnalysisOutput],
+    Tuple[OpportunityAnalysisInput, Exception],
+    OpportunityAnalysisOutput,
+    RowView,
+    Dict[str, Any],
+]
+
+
+async def iter_rows(source: AsyncIterable[ResultItem]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    将分析结果展开为逐行字典，每个商机一行
+    支持 (输入, 输出) 元组、单独的输出模型、结果存储的行视图以及已展开的字典；
+    iter_analyses(return_exceptions=True) 产生的 (输入, 异常) 元组展开为一行，只包含输入参数和 error 字段
+    """
+    async for item in source:
+        if isinstance(item, RowView):
+            row = {name: getattr(item, name) for name in EXPORT_COLUMNS}
+            row["position"] += 1
+            yield row
+        elif isinstance(item, dict):
+            yield item
+        else:
+            if isinstance(item, tuple):
+                input_data, output = item
+                base = {name: getattr(input_data, name) for name in INPUT_FIELDS}
+                if isinstance(output, Exception):
+                    yield dict(base, error=str(output) or repr(output))
+                    continue
+            else:
+                output = item
+                base = dict.fromkeys(INPUT_FIELDS, "")
+            for position, opportunity in enumerate(output.opportunities):
+                row = dict(base, position=position + 1)
+                row.update(opportunity.model_dump())
+                yield row
+
+
+async def aiter_store(store: ColumnarResultStore, chunk_size: int = 1000) -> AsyncIterator[RowView]:
+    """
+    以异步迭代器的形式遍历结果存储，每处理chunk_size行让出一次事件循环
+    """
+    for start in range(0, len(store), chunk_size):
+        for index in range(start, min(start + chunk_size, len(store))):
+            yield store[index]
+        await asyncio.sleep(0)
+
+
+def _cell_text(value: Any) -> Any:
+    """CSV单元格的值：以公式字符开头的文本加单引号前缀，防止被当作公式执行"""
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def _table_values(row: Dict[str, Any]) -> List[Any]:
+    return [row.get(name, "") for name in TABLE_COLUMNS]
+
+
+class _BatchedFileWriter:
+    """
+    有界批量写入器
+    行在内存中累积到flush_rows后，在线程池中写入文件，避免阻塞事件循环
+    """
+
+    def __init__(self, write: Callable[[str], Any], flush_rows: int):
+        self._write = write
+        self._flush_rows = max(1, flush_rows)
+        self._buffer: List[str] = []
+
+    async def add(self, chunk: str) -> None:
+        self._buffer.append(chunk)
+        if len(self._buffer) >= self._flush_rows:
+            await self.flush()
+
+    async def flush(self) -> None:
+        if not self._buffer:
+            return
+        data = "".join(self._buffer)
+        self._buffer = []
+        await asyncio.get_running_loop().run_in_executor(None, self._write, data)
+
+
+async def export_ndjson(source: AsyncIterable[ResultItem], path: str,
+                        flush_rows: int = DEFAULT_FLUSH_ROWS) -> int:
+    """
+    导出为NDJSON，每行一个商机
+    :return: 导出的行数
+    """
+    count = 0
+    with open(path, 'w', encoding='utf-8', newline='\n') as file:
+        writer = _BatchedFileWriter(file.write, flush_rows)
+        async for row in iter_rows(source):
+            await writer.add(json.dumps(row, ensure_ascii=False) + "\n")
+            count += 1
+        await writer.flush()
+    return count
+
+
+async def export_csv(source: AsyncIterable[ResultItem], path: str,
+                     flush_rows: int = DEFAULT_FLUSH_ROWS) -> int:
+    """
+    导出为CSV，使用UTF-8 BOM编码以便Excel正确识别中文；以公式字符开头的文本加单引号前缀
+    :return: 导出的行数（不含表头）
+    """
+    count = 0
+    line = io.StringIO()
+    csv_writer = csv.writer(line)
+
+    def render(values: List[Any]) -> str:
+        line.seek(0)
+        line.truncate()
+        csv_writer.writerow(values)
+        return line.getvalue()
+
+    with open(path, 'w', encoding='utf-8-sig', newline='') as file:
+        writer = _BatchedFileWriter(file.write, flush_rows)
+        await writer.add(render([COLUMN_TITLES[name] for name in TABLE_COLUMNS]))
+        async for row in iter_rows(source):
+            await writer.add(render([_cell_text(value) for value in _table_values(row)]))
+            count += 1
+        await writer.flush()
+    return count
+
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+_SHEET_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<sheetData>'
+)
+
+_SHEET_FOOTER = '</sheetData></worksheet>'
+
+
+def _workbook_xml(sheet_name: str) -> str:
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{escape(sheet_name, {chr(34): "&quot;"})}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    )
+
+
+def _xlsx_cell(value: Any) -> str:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c><v>{value}</v></c>'
+    text = _XML_ILLEGAL.sub("", str(value))[:_XLSX_CELL_LIMIT]
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{escape(text)}</t></is></c>'
+
+
+def _xlsx_row(index: int, values: List[Any]) -> str:
+    return f'<row r="{index}">' + "".join(_xlsx_cell(value) for value in values) + '</row>'
+
+
+async def export_xlsx(source: AsyncIterable[ResultItem], path: str,
+                      flush_rows: int = DEFAULT_FLUSH_ROWS, sheet_name: str = "商机清单") -> int:
+    """
+    导出为XLSX
+    工作表XML在结果到达时逐批压缩写入zip，使用内联字符串而非共享字符串表，无需在内存中保留全部数据
+    :return: 导出的行数（不含表头）
+    """
+    count = 0
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        archive.writestr("_rels/.rels", _ROOT_RELS)
+        archive.writestr("xl/workbook.xml", _workbook_xml(sheet_name))
+        archive.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS)
+
+        with archive.open("xl/worksheets/sheet1.xml", 'w', force_zip64=True) as sheet:
+            writer = _BatchedFileWriter(lambda data: sheet.write(data.encode("utf-8")), flush_rows)
+            await writer.add(_SHEET_HEADER)
+            await writer.add(_xlsx_row(1, [COLUMN_TITLES[name] for name in TABLE_COLUMNS]))
+            async for row in iter_rows(source):
+                count += 1
+                await writer.add(_xlsx_row(count + 1, _table_values(row)))
+            await writer.add(_SHEET_FOOTER)
+            await writer.flush()
+    return count
+
+
+EXPORTERS = {
+    "ndjson": export_ndjson,
+    "jsonl": export_ndjson,
+    "csv": export_csv,
+    "xlsx": export_xlsx,
+}
+
+
+async def export_results(source: AsyncIterable[ResultItem], path: str, fmt: Optional[str] = None,
+                         flush_rows: int = DEFAULT_FLUSH_ROWS) -> int:
+    """
+    按格式导出分析结果
+    :param fmt: ndjson / csv / xlsx，为None时根据文件扩展名判断
+    :return: 导出的行数
+    """
+    fmt = (fmt or path.rsplit(".", 1)[-1]).lower()
+    exporter = EXPORTERS.get(fmt)
+    if exporter is None:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+    return await exporter(source, path, flush_rows=flush_rows)
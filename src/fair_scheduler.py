@@ -0,0 +1,424 @@
+"""
+多租户加权公平调度
+多个业务部门和夜间批处理共用同一份服务商额度。大模型调用在进入服务商限流器之前先经过调度器：
+交互请求严格优先于批处理请求，同一类别内按租户权重做赤字轮询（DRR，以预估token数为开销），
+并限制每个租户的并发数和每分钟token数，记录各租户的排队等待时间
+"""
+import asyncio
+import collections
+import contextlib
+import contextvars
+import math
+import os
+import threading
+import time
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from metrics import metrics
+from rate_limiter import TokenBucket, rate_limiters
+
+INTERACTIVE, BATCH = "interactive", "batch"
+# 按优先级从高到低排列
+REQUEST_CLASSES = (INTERACTIVE, BATCH)
+
+DEFAULT_TENANT = "default"
+
+_tenant: contextvars.ContextVar[str] = contextvars.ContextVar("tenant", default=DEFAULT_TENANT)
+_request_class: contextvars.ContextVar[str] = contextvars.ContextVar("request_class", default=INTERACTIVE)
+
+# 每个租户保留的最近等待时间样本数，用于计算分位数
+_WAIT_SAMPLES = 512
+
+
+def current_tenant() -> str:
+    return _tenant.get()
+
+
+def current_request_class() -> str:
+    return _request_class.get()
+
+
+@contextlib.contextmanager
+def request_context(tenant: Optional[str] = None, request_class: Optional[str] = None) -> Iterator[None]:
+    """
+    设置当前上下文中的租户和请求类别，对其中发起（包括创建的子任务中）的大模型调用生效
+    :param tenant: 租户名称，为None时保持不变
+    :param request_class: INTERACTIVE 或 BATCH，为None时保持不变
+    """
+    if request_class is not None and request_class not in REQUEST_CLASSES:
+        raise ValueError(f"请求类别应为 {'、'.join(REQUEST_CLASSES)} 之一，实际为: {request_class}")
+    tenant_token = _tenant.set(tenant) if tenant is not None else None
+    class_token = _request_class.set(request_class) if request_class is not None else None
+    try:
+        yield
+    finally:
+        if class_token is not None:
+            _request_class.reset(class_token)
+        if tenant_token is not None:
+            _tenant.reset(tenant_token)
+
+
+class _Waiter:
+    __slots__ = ("loop", "future", "tenant", "request_class", "cost", "enqueued")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, future: asyncio.Future, tenant: "_Tenant",
+                 request_class: str, cost: float):
+        self.loop = loop
+        self.future = future
+        self.tenant = tenant
+        self.request_class = request_class
+        self.cost = cost
+        self.enqueued = time.monotonic()
+
+
+class _Tenant:
+    """租户的配额、排队和统计状态"""
+
+    def __init__(self, name: str, weight: float, max_concurrency: int, tpm: float):
+        self.name = name
+        self.weight = max(weight, 0.01)
+        self.max_concurrency = max_concurrency
+        self.tokens = TokenBucket(tpm / 60.0, tpm)
+        self.inflight = 0
+        self.queues: Dict[str, Deque[_Waiter]] = {request_class: collections.deque()
+                                                  for request_class in REQUEST_CLASSES}
+        self.deficits: Dict[str, float] = dict.fromkeys(REQUEST_CLASSES, 0.0)
+        self.waits: Dict[str, Deque[float]] = {request_class: collections.deque(maxlen=_WAIT_SAMPLES)
+                                               for request_class in REQUEST_CLASSES}
+        self.granted = 0
+
+    def token_delay(self, cost: float) -> float:
+        """token配额不足时还需等待的秒数；单次开销超过桶容量时只要求桶满"""
+        if not self.tokens.enabled:
+            return 0.0
+        shortfall = min(cost, self.tokens.capacity) - self.tokens.available()
+        return max(0.0, shortfall / self.tokens.rate)
+
+
+class Ticket:
+    """一次已获准的调用，完成后必须调用 release"""
+
+    __slots__ = ("scheduler", "tenant", "request_class", "cost", "waited")
+
+    def __init__(self, scheduler: "FairScheduler", tenant: _Tenant, request_class: str, cost: float, waited: float):
+        self.scheduler = scheduler
+        self.tenant = tenant
+        self.request_class = request_class
+        self.cost = cost
+        self.waited = waited
+
+    def release(self, used_tokens: Optional[int] = None) -> None:
+        """
+        :param used_tokens: 服务商返回的实际token数，用于修正租户token配额
+        """
+        self.scheduler._release(self, used_tokens)
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class FairScheduler:
+    """
+    加权公平调度器
+    同时放行的调用数不超过 capacity；交互类别有等待者时批处理类别不会被放行，
+    除非交互类别的等待者全部受租户配额限制。等待者可以来自不同的事件循环
+    """
+
+    def __init__(self, capacity: Callable[[], int], quantum: float = 2048.0,
+                 weights: Optional[Dict[str, float]] = None,
+                 max_concurrency: Optional[Dict[str, int]] = None,
+                 tpm: Optional[Dict[str, float]] = None, name: str = ""):
+        """
+        :param capacity: 返回当前可同时放行调用数的函数，通常为服务商自适应并发窗口的大小
+        :param quantum: 权重为1的租户每轮获得的开销额度（token数）
+        :param weights: 各租户的权重，未列出的租户权重为1
+        :param max_concurrency: 各租户的并发上限，未列出或为0时不限制
+        :param tpm: 各租户每分钟token数上限，未列出或为0时不限制
+        :param name: 调度器名称，通常为服务商，用作指标标签
+        """
+        self.capacity = capacity
+        self.quantum = quantum
+        self.name = name
+        self.weights = dict(weights or {})
+        self.max_concurrency = dict(max_concurrency or {})
+        self.tpm = dict(tpm or {})
+        self.inflight = 0
+        self._tenants: Dict[str, _Tenant] = {}
+        self._active: Dict[str, Deque[_Tenant]] = {request_class: collections.deque()
+                                                    for request_class in REQUEST_CLASSES}
+        self._lock = threading.Lock()
+        self._timer_due = 0.0
+
+    def _tenant(self, name: str) -> _Tenant:
+        tenant = self._tenants.get(name)
+        if tenant is None:
+            tenant = self._tenants[name] = _Tenant(
+                name, self.weights.get(name, 1.0), int(self.max_concurrency.get(name, 0)), self.tpm.get(name, 0.0)
+            )
+        return tenant
+
+    def configure_tenant(self, name: str, weight: Optional[float] = None,
+                         max_concurrency: Optional[int] = None, tpm: Optional[float] = None) -> None:
+        """修改租户的权重和配额，对之后的调度生效"""
+        with self._lock:
+            tenant = self._tenant(name)
+            if weight is not None:
+                self.weights[name] = weight
+                tenant.weight = max(weight, 0.01)
+            if max_concurrency is not None:
+                self.max_concurrency[name] = max_concurrency
+                tenant.max_concurrency = max_concurrency
+            if tpm is not None:
+                self.tpm[name] = tpm
+                tenant.tokens = TokenBucket(tpm / 60.0, tpm)
+
+    def _has_capacity(self) -> bool:
+        return self.inflight < max(1, self.capacity())
+
+    def _blocked(self, tenant: _Tenant, cost: float) -> Optional[float]:
+        """
+        租户是否受配额限制
+        :return: None表示可以放行；0表示受并发上限限制；正数表示token配额还需等待的秒数
+        """
+        if tenant.max_concurrency and tenant.inflight >= tenant.max_concurrency:
+            return 0.0
+        delay = tenant.token_delay(cost)
+        return delay if delay > 0 else None
+
+    async def acquire(self, cost: float = 0.0, tenant: Optional[str] = None,
+                      request_class: Optional[str] = None) -> Ticket:
+        """
+        等待调度器放行
+        :param cost: 本次调用预计消耗的token数
+        :param tenant: 租户名称，默认取当前上下文
+        :param request_class: 请求类别，默认取当前上下文
+        """
+        request_class = request_class or current_request_class()
+        with self._lock:
+            state = self._tenant(tenant or current_tenant())
+            if (not any(self._active.values()) and self._has_capacity()
+                    and self._blocked(state, cost) is None):
+                return self._grant(state, request_class, cost, 0.0)
+            loop = asyncio.get_running_loop()
+            waiter = _Waiter(loop, loop.create_future(), state, request_class, cost)
+            queue = state.queues[request_class]
+            if not queue:
+                self._active[request_class].append(state)
+            queue.append(waiter)
+            self._publish_queue(state, request_class)
+        self._dispatch()
+        try:
+            return await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = waiter.future.done() and not waiter.future.cancelled()
+                if not granted:
+                    self._remove(waiter)
+            if granted:
+                # 名额已转交给当前协程，取消时需归还
+                waiter.future.result().release()
+            else:
+                self._dispatch()
+            raise
+
+    def _remove(self, waiter: _Waiter) -> None:
+        queue = waiter.tenant.queues[waiter.request_class]
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            return
+        if not queue:
+            self._deactivate(waiter.tenant, waiter.request_class)
+        self._publish_queue(waiter.tenant, waiter.request_class)
+
+    def _deactivate(self, tenant: _Tenant, request_class: str) -> None:
+        try:
+            self._active[request_class].remove(tenant)
+        except ValueError:
+            pass
+        tenant.deficits[request_class] = 0.0
+
+    def _grant(self, tenant: _Tenant, request_class: str, cost: float, waited: float) -> Ticket:
+        self.inflight += 1
+        tenant.inflight += 1
+        tenant.granted += 1
+        tenant.tokens.reserve(cost)
+        tenant.waits[request_class].append(waited)
+        metrics.observe("llm_scheduler_wait_seconds", waited, scheduler=self.name,
+                        tenant=tenant.name, request_class=request_class)
+        return Ticket(self, tenant, request_class, cost, waited)
+
+    def _pick(self, request_class: str) -> Tuple[Optional[_Waiter], Optional[float]]:
+        """
+        按赤字轮询从一个类别中选出下一个等待者
+        :return: (等待者, 受token配额限制时最短的等待秒数)
+        """
+        active = self._active[request_class]
+        skipped = 0
+        retry_in: Optional[float] = None
+        while active and skipped < len(active):
+            tenant = active[0]
+            waiter = tenant.queues[request_class][0]
+            blocked = self._blocked(tenant, waiter.cost)
+            if blocked is not None:
+                if blocked > 0:
+                    retry_in = blocked if retry_in is None else min(retry_in, blocked)
+                active.rotate(-1)
+                skipped += 1
+                continue
+            if tenant.deficits[request_class] >= waiter.cost:
+                tenant.deficits[request_class] -= waiter.cost
+                queue = tenant.queues[request_class]
+                queue.popleft()
+                if not queue:
+                    active.popleft()
+                    tenant.deficits[request_class] = 0.0
+                self._publish_queue(tenant, request_class)
+                return waiter, retry_in
+            # 本轮额度不足，补充额度后轮到下一个租户
+            tenant.deficits[request_class] += self.quantum * tenant.weight
+            active.rotate(-1)
+            skipped = 0
+        return None, retry_in
+
+    def _dispatch(self) -> None:
+        """在名额允许时依次放行等待者"""
+        retry_in: Optional[float] = None
+        timer_loop: Optional[asyncio.AbstractEventLoop] = None
+        with self._lock:
+            while self._has_capacity():
+                waiter = None
+                for request_class in REQUEST_CLASSES:
+                    waiter, delay = self._pick(request_class)
+                    if delay is not None:
+                        retry_in = delay if retry_in is None else min(retry_in, delay)
+                    if waiter is not None:
+                        break
+                if waiter is None:
+                    break
+                if waiter.future.done():
+                    # 等待者已被取消
+                    continue
+                waited = time.monotonic() - waiter.enqueued
+                ticket = self._grant(waiter.tenant, waiter.request_class, waiter.cost, waited)
+                waiter.loop.call_soon_threadsafe(_deliver, waiter, ticket)
+            if retry_in is not None:
+                due = time.monotonic() + retry_in
+                if self._timer_due <= time.monotonic() or due < self._timer_due:
+                    self._timer_due = due
+                    timer_loop = self._any_waiter_loop()
+        if timer_loop is not None:
+            # token配额恢复后重新调度
+            timer_loop.call_soon_threadsafe(timer_loop.call_later, retry_in, self._dispatch)
+
+    def _any_waiter_loop(self) -> Optional[asyncio.AbstractEventLoop]:
+        for active in self._active.values():
+            for tenant in active:
+                for queue in tenant.queues.values():
+                    for waiter in queue:
+                        if not waiter.loop.is_closed():
+                            return waiter.loop
+        return None
+
+    def _release(self, ticket: Ticket, used_tokens: Optional[int]) -> None:
+        with self._lock:
+            self.inflight -= 1
+            ticket.tenant.inflight -= 1
+            if used_tokens is not None:
+                ticket.tenant.tokens.refund(ticket.cost - used_tokens)
+        self._dispatch()
+
+    def _publish_queue(self, tenant: _Tenant, request_class: str) -> None:
+        metrics.set_gauge("llm_scheduler_queued", len(tenant.queues[request_class]), scheduler=self.name,
+                          tenant=tenant.name, request_class=request_class)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        各租户的权重、配额、并发、排队数和最近的排队等待时间分位数（秒）
+        """
+        with self._lock:
+            result = {}
+            for name, tenant in self._tenants.items():
+                entry: Dict[str, float] = {
+                    "weight": tenant.weight,
+                    "max_concurrency": tenant.max_concurrency,
+                    "tpm": self.tpm.get(name, 0.0),
+                    "inflight": tenant.inflight,
+                    "granted": tenant.granted,
+                }
+                for request_class in REQUEST_CLASSES:
+                    waits = list(tenant.waits[request_class])
+                    entry[f"{request_class}_queued"] = len(tenant.queues[request_class])
+                    entry[f"{request_class}_wait_p50"] = _percentile(waits, 0.5)
+                    entry[f"{request_class}_wait_p99"] = _percentile(waits, 0.99)
+                result[name] = entry
+        return result
+
+
+def _deliver(waiter: _Waiter, ticket: Ticket) -> None:
+    if waiter.future.done():
+        # 等待者在放行前被取消，归还名额
+        ticket.release()
+    else:
+        waiter.future.set_result(ticket)
+
+
+def _env_mapping(name: str) -> Dict[str, float]:
+    """解析 "租户:数值,租户:数值" 形式的环境变量"""
+    mapping = {}
+    for part in os.getenv(name, "").split(","):
+        tenant, _, value = part.partition(":")
+        if tenant.strip() and value.strip():
+            mapping[tenant.strip()] = float(value)
+    return mapping
+
+
+class FairSchedulerRegistry:
+    """
+    按服务商维护调度器，放行数跟随该服务商自适应并发窗口的大小
+    租户配置来自环境变量 TENANT_WEIGHTS、TENANT_MAX_CONCURRENCY、TENANT_TPM，格式为 "租户:数值,租户:数值"
+    """
+
+    def __init__(self):
+        self._schedulers: Dict[str, FairScheduler] = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider: str) -> FairScheduler:
+        scheduler = self._schedulers.get(provider)
+        if scheduler is None:
+            with self._lock:
+                scheduler = self._schedulers.get(provider)
+                if scheduler is None:
+                    scheduler = self._schedulers[provider] = self._create(provider)
+        return scheduler
+
+    @staticmethod
+    def _create(provider: str) -> FairScheduler:
+        return FairScheduler(
+            lambda: math.floor(rate_limiters.get(provider).window.limit),
+            quantum=float(os.getenv("SCHEDULER_QUANTUM", "2048")),
+            weights=_env_mapping("TENANT_WEIGHTS"),
+            max_concurrency={tenant: int(value) for tenant, value in _env_mapping("TENANT_MAX_CONCURRENCY").items()},
+            tpm=_env_mapping("TENANT_TPM"),
+            name=provider,
+        )
+
+    def configure(self, provider: str, **kwargs) -> FairScheduler:
+        """以指定参数替换服务商的调度器，参数同 FairScheduler（capacity 默认跟随自适应并发窗口）"""
+        kwargs.setdefault("capacity", lambda: math.floor(rate_limiters.get(provider).window.limit))
+        kwargs.setdefault("name", provider)
+        with self._lock:
+            scheduler = self._schedulers[provider] = FairScheduler(**kwargs)
+        return scheduler
+
+    def stats(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """全部服务商调度器的租户统计"""
+        return {provider: scheduler.stats() for provider, scheduler in list(self._schedulers.items())}
+
+
+# 全局实例
+fair_schedulers = FairSchedulerRegistry()
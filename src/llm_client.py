@@ -2,13 +2,44 @@
 大模型客户端
 支持国内主流大模型API调用
 """
+import asyncio
 import json
+import os
+import random
+import time
+import weakref
 import httpx
 import re
 from typing import Dict, Any, List, Optional
 from pydantic import BaseModel
 
 from model_config import get_current_model_config, ModelType, model_config
+from metrics import metrics, get_logger
+from fair_scheduler import fair_schedulers
+from rate_limiter import estimate_tokens, rate_limiters
+
+
+logger = get_logger("llm_client")
+
+
+class _ConnectTrace:
+    """
+    httpx连接追踪回调，记录建立TCP连接（含TLS握手）的耗时
+    连接池复用已有连接时不会触发
+    """
+
+    def __init__(self, labels: Dict[str, str], uses_tls: bool):
+        self.labels = labels
+        self.uses_tls = uses_tls
+        self._start = 0.0
+
+    async def __call__(self, event_name: str, info: Dict[str, Any]) -> None:
+        if event_name == "connection.connect_tcp.started":
+            self._start = time.perf_counter()
+        elif (event_name == "connection.start_tls.complete"
+              or (event_name == "connection.connect_tcp.complete" and not self.uses_tls)):
+            metrics.observe("llm_stage_duration_seconds", time.perf_counter() - self._start,
+                            stage="connect", **self.labels)
 
 
 class LLMClient:
@@ -16,6 +47,34 @@ class LLMClient:
     
     def __init__(self):
         self.config = get_current_model_config()
+        # 服务商限流(429)时的最大重试次数
+        self.max_retries = int(os.getenv("LLM_MAX_RETRIES", "3"))
+        # 每个事件循环复用一个HTTP客户端，保持连接池
+        self._http_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+    
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """
+        获取当前事件循环对应的HTTP客户端，不存在时创建
+        httpx客户端不能跨事件循环使用，因此按事件循环分别维护
+        """
+        loop = asyncio.get_running_loop()
+        client = self._http_clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                timeout=60.0,
+                limits=httpx.Limits(
+                    max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "20")),
+                    max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE", "10"))
+                )
+            )
+            self._http_clients[loop] = client
+        return client
+    
+    async def aclose(self) -> None:
+        """关闭当前事件循环对应的HTTP客户端"""
+        client = self._http_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
     
     async def call_llm(self, 
                       messages: List[Dict[str, str]], 
@@ -33,9 +92,10 @@ class LLMClient:
         if not self.config["api_key"]:
             raise ValueError(f"API Key未配置，请设置对应的环境变量")
         
-        # 打印当前使用的大模型信息
+        # 记录当前使用的大模型信息
         current_model = model or self.config["default_model"]
-        print(f"正在使用大模型: {current_model}，API端点: {self.config['base_url']}")
+        labels = self.metric_labels(current_model)
+        logger.info("正在使用大模型: %s，API端点: %s", current_model, self.config['base_url'])
             
         headers = {
             "Authorization": f"Bearer {self.config['api_key']}",
@@ -48,21 +108,68 @@ class LLMClient:
             "temperature": temperature,
             "max_tokens": max_tokens
         }
+        url = f"{self.config['base_url']}/chat/completions"
+        
+        # 先经过多租户公平调度（租户和请求类别取自当前上下文），再经过服务商限流器：
+        # 令牌桶控制RPM/TPM，自适应窗口控制并发
+        scheduler = fair_schedulers.get(labels["provider"])
+        limiter = rate_limiters.get(labels["provider"])
+        estimated_tokens = estimate_tokens(messages) + max_tokens
         
-        # 增加超时时间，因为复杂请求可能需要更多时间
-        async with httpx.AsyncClient(timeout=60.0) as client:
+        # 复用连接池中的连接，超时时间为60秒，因为复杂请求可能需要更多时间
+        client = self._get_http_client()
+        for attempt in range(self.max_retries + 1):
+            ticket = await scheduler.acquire(estimated_tokens)
             try:
-                response = await client.post(
-                    f"{self.config['base_url']}/chat/completions",
-                    headers=headers,
-                    json=data
-                )
+                reservation = await limiter.acquire(estimated_tokens, ticket.request_class)
+            except BaseException:
+                ticket.release()
+                raise
+            released = False
+            used_tokens = None
+            try:
+                extensions = None
+                if metrics.enabled:
+                    extensions = {"trace": _ConnectTrace(labels, url.startswith("https"))}
+                request = client.build_request("POST", url, headers=headers, json=data, extensions=extensions)
+                
+                # 分别记录首字节耗时和读取完整响应的耗时
+                sent_at = time.monotonic()
+                with metrics.span("ttfb", **labels):
+                    response = await client.send(request, stream=True)
+                ttfb = time.monotonic() - sent_at
+                try:
+                    with metrics.span("generation", **labels):
+                        await response.aread()
+                finally:
+                    await response.aclose()
+                
+                if response.status_code == 429:
+                    metrics.inc("llm_requests_total", outcome="http_429", **labels)
+                    retry_after = self._retry_after(response, attempt)
+                    reservation.release(throttled=True, retry_after=retry_after)
+                    released = True
+                    if attempt < self.max_retries:
+                        metrics.inc("llm_retries_total", **labels)
+                        logger.warning("大模型服务限流(429)，%.1f秒后重试（第%d次）", retry_after, attempt + 1)
+                        continue
+                    raise Exception(f"API请求失败: {response.status_code}, {response.text}")
                 
                 if response.status_code != 200:
+                    metrics.inc("llm_requests_total", outcome=f"http_{response.status_code}", **labels)
                     raise Exception(f"API请求失败: {response.status_code}, {response.text}")
                 
                 result = response.json()
+                usage = result.get("usage")
+                self._record_usage(usage, labels)
+                used_tokens = (usage or {}).get("total_tokens")
+                # 非流式响应的首字节时间包含整个生成过程，按生成token数折算后再用于调整并发窗口
+                completion_tokens = (usage or {}).get("completion_tokens")
+                latency = ttfb / completion_tokens if completion_tokens else None
+                reservation.release(latency=latency, used_tokens=used_tokens)
+                released = True
                 content = result["choices"][0]["message"]["content"]
+                metrics.inc("llm_requests_total", outcome="ok", **labels)
                 
                 # 处理URL格式，将URL放在【】符号之间
                 formatted_content = self._format_urls(content)
@@ -70,11 +177,49 @@ class LLMClient:
                 return formatted_content
                 
             except httpx.ConnectError:
+                metrics.inc("llm_requests_total", outcome="connect_error", **labels)
                 raise Exception("连接到API服务器失败，请检查网络连接和API地址")
             except httpx.TimeoutException:
+                metrics.inc("llm_requests_total", outcome="timeout", **labels)
                 raise Exception("API请求超时，请稍后重试")
             except Exception as e:
                 raise e
+            finally:
+                if not released:
+                    reservation.release()
+                ticket.release(used_tokens)
+
+    @staticmethod
+    def _retry_after(response: httpx.Response, attempt: int) -> float:
+        """
+        计算429后的等待时间：优先使用服务商返回的Retry-After，否则按指数退避并加随机抖动
+        """
+        value = response.headers.get("retry-after")
+        if value:
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                pass
+        return min(30.0, 2 ** attempt) * (0.5 + random.random() / 2)
+
+    def metric_labels(self, model: Optional[str] = None) -> Dict[str, str]:
+        """
+        获取指标标签
+        :param model: 模型名称，默认使用配置中的模型
+        """
+        return {
+            "provider": self.config.get("provider", model_config.current_model_type.value),
+            "model": model or self.config["default_model"]
+        }
+
+    def _record_usage(self, usage: Optional[Dict[str, Any]], labels: Dict[str, str]) -> None:
+        """
+        记录服务商返回的token用量
+        """
+        if not usage:
+            return
+        metrics.inc("llm_prompt_tokens_total", usage.get("prompt_tokens") or 0, **labels)
+        metrics.inc("llm_completion_tokens_total", usage.get("completion_tokens") or 0, **labels)
 
     def _format_urls(self, text: str) -> str:
         """
@@ -103,38 +248,51 @@ class ConstructionOpportunityGenerator:
     async def generate_opportunities(self, 
                                    construction_direction: str, 
                                    customer_type: str, 
-                                   business_status: str) -> List[Dict[str, str]]:
+                                   business_status: str,
+                                   allow_mock: bool = True) -> List[Dict[str, str]]:
         """
         生成建筑行业商机分析
         :param construction_direction: 建筑方向
         :param customer_type: 客户类型
         :param business_status: 商机状态
+        :param allow_mock: 大模型调用失败时是否返回模拟数据，为False时直接抛出异常
         :return: 包含5个商机的列表
         """
-        # 构造提示词
-        prompt = self._build_prompt(construction_direction, customer_type, business_status)
+        labels = self.llm_client.metric_labels()
         
-        messages = [
-            {"role": "system", "content": "你是一个专业的建筑行业分析师，擅长发现潜在的商业机会并提供营销策略。"},
-            {"role": "user", "content": prompt}
-        ]
+        # 构造提示词
+        with metrics.span("prompt_build", **labels):
+            messages = self._build_messages(construction_direction, customer_type, business_status)
         
         try:
-            # 打印当前使用的大模型信息
-            current_model = self.llm_client.config["default_model"]
-            print(f"正在调用大模型生成商机分析，当前使用模型: {current_model}")
+            # 记录当前使用的大模型信息
+            logger.info("正在调用大模型生成商机分析，当前使用模型: %s", labels["model"])
             
             # 调用大模型
             response = await self.llm_client.call_llm(messages, temperature=0.7)
             
             # 解析返回结果
-            opportunities = self._parse_response(response)
+            with metrics.span("parse", **labels):
+                opportunities = self._parse_response(response)
             return opportunities
             
         except Exception as e:
+            if not allow_mock:
+                raise
             # 如果大模型调用失败，返回模拟数据
-            print(f"大模型调用失败: {str(e)}，使用模拟数据")
-            return self._generate_mock_data(construction_direction, customer_type, business_status)
+            logger.warning("大模型调用失败: %s，使用模拟数据", e)
+            metrics.inc("llm_mock_fallbacks_total", **labels)
+            with metrics.span("fallback", **labels):
+                return self._generate_mock_data(construction_direction, customer_type, business_status)
+    
+    def _build_messages(self, construction_direction: str, customer_type: str, business_status: str) -> List[Dict[str, str]]:
+        """
+        构造对话消息，在线调用和批量任务共用
+        """
+        return [
+            {"role": "system", "content": "你是一个专业的建筑行业分析师，擅长发现潜在的商业机会并提供营销策略。"},
+            {"role": "user", "content": self._build_prompt(construction_direction, customer_type, business_status)}
+        ]
     
     def _build_prompt(self, construction_direction: str, customer_type: str, business_status: str) -> str:
         """
@@ -148,7 +306,7 @@ class ConstructionOpportunityGenerator:
         商机状态：{business_status}
 
         请按以下要求提供分析：
-        1. 找到5个客户或潜在客户
+        1. 找到5个不同的客户或潜在客户，同一公司的全称和简称视为同一客户，不要重复列出
         2. 每个客户需包含以下信息：
            - 公司名称
            - 项目信息（50字以内）：简述客户将要或正在进行的工程信息
@@ -0,0 +1,329 @@
+"""
+运行指标采集模块
+按阶段记录耗时，统计token用量、重试、模拟数据回退和缓存命中次数，
+支持导出Prometheus文本格式和JSON快照，并提供基于队列的非阻塞日志
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+
+# 请求处理的各个阶段
+STAGES = (
+    "cache_lookup",   # 缓存查询
+    "prompt_build",   # 提示词构造
+    "connect",        # 建立连接（TCP + TLS）
+    "ttfb",           # 发出请求到收到响应头
+    "generation",     # 读取完整响应体
+    "parse",          # 解析响应JSON
+    "validation",     # 构造并校验输出模型
+    "fallback",       # 生成模拟数据
+)
+
+# 阶段耗时直方图的桶边界（秒）
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+STAGE_METRIC = "llm_stage_duration_seconds"
+
+_HELP = {
+    STAGE_METRIC: "各处理阶段耗时（秒）",
+    "llm_requests_total": "大模型请求次数，按结果分类",
+    "llm_prompt_tokens_total": "服务商返回的提示词token数",
+    "llm_completion_tokens_total": "服务商返回的生成token数",
+    "llm_retries_total": "大模型请求重试次数",
+    "llm_mock_fallbacks_total": "回退到模拟数据的次数",
+    "llm_cache_hits_total": "结果缓存命中次数",
+    "llm_cache_stale_hits_total": "返回过期缓存结果并触发后台刷新的次数",
+    "llm_background_refreshes_total": "后台刷新次数，按结果分类",
+    "llm_prefetch_total": "推测预取次数，按结果分类",
+    "llm_throttled_total": "服务商返回429限流的次数",
+    "llm_concurrency_limit": "自适应并发窗口当前大小",
+    "llm_inflight_requests": "正在进行的大模型请求数",
+    "llm_requests_per_minute": "最近一分钟发出的请求数",
+    "llm_tokens_per_minute": "最近一分钟预估消耗的token数",
+    "llm_scheduler_wait_seconds": "调用在公平调度器中的排队等待时间（秒），按租户和请求类别",
+    "llm_scheduler_queued": "公平调度器中排队的调用数，按租户和请求类别",
+    "llm_micro_batch_sections_total": "微批处理的组合数，按合并调用得到结果或改为单独调用分类",
+    "llm_url_screen_total": "证明链接经域名信誉索引筛选的次数，按分类结果",
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _env_flag(name: str, default: str = "0") -> bool:
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes", "on")
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key)
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in pairs) + "}"
+
+
+class _Histogram:
+    """固定桶边界的直方图"""
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class _Span:
+    """阶段计时上下文，退出时将耗时记入直方图"""
+    __slots__ = ("_registry", "_labels", "_start")
+
+    def __init__(self, registry: "MetricsRegistry", labels: Dict[str, object]):
+        self._registry = registry
+        self._labels = labels
+        self._start = 0.0
+
+    def __enter__(self) -> "_Span":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self._registry.observe(STAGE_METRIC, time.perf_counter() - self._start, **self._labels)
+        return False
+
+
+class _NullSpan:
+    """指标关闭时使用的空上下文，不做任何记录"""
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class MetricsRegistry:
+    """指标注册表，关闭时所有记录操作直接返回"""
+
+    def __init__(self, enabled: bool = False, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, LabelKey], float] = {}
+        self._gauges: Dict[Tuple[str, LabelKey], float] = {}
+        self._histograms: Dict[Tuple[str, LabelKey], _Histogram] = {}
+
+    def span(self, stage: str, **labels):
+        """
+        记录一个阶段的耗时
+        :param stage: 阶段名称，见STAGES
+        :param labels: 附加标签，通常为provider和model
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        labels["stage"] = stage
+        return _Span(self, labels)
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        """计数器累加"""
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        """设置瞬时值"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """向直方图记录一个观测值"""
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(self.buckets)
+            histogram.observe(value)
+
+    def reset(self) -> None:
+        """清空所有已记录的指标"""
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def snapshot(self) -> Dict[str, list]:
+        """
+        获取当前指标快照
+        :return: 包含counters、gauges和histograms三个列表的字典
+        """
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(key), "value": value}
+                for (name, key), value in sorted(self._counters.items())
+            ]
+            gauges = [
+                {"name": name, "labels": dict(key), "value": value}
+                for (name, key), value in sorted(self._gauges.items())
+            ]
+            histograms = [
+                {
+                    "name": name,
+                    "labels": dict(key),
+                    "buckets": dict(zip((str(b) for b in h.buckets), h.counts)),
+                    "sum": h.sum,
+                    "count": h.count,
+                }
+                for (name, key), h in sorted(self._histograms.items(), key=lambda item: item[0])
+            ]
+        return {"timestamp": time.time(), "counters": counters, "gauges": gauges, "histograms": histograms}
+
+    def to_json(self) -> str:
+        """导出JSON格式快照"""
+        return json.dumps(self.snapshot(), ensure_ascii=False)
+
+    def render_prometheus(self) -> str:
+        """导出Prometheus文本格式"""
+        lines = []
+        with self._lock:
+            for kind, series in (("counter", self._counters), ("gauge", self._gauges)):
+                for name in sorted({name for name, _ in series}):
+                    lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for (metric, key), value in sorted(series.items()):
+                        if metric == name:
+                            lines.append(f"{name}{_format_labels(key)} {value:g}")
+
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for (metric, key), h in sorted(self._histograms.items(), key=lambda item: item[0]):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(h.buckets, h.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key, ('le', f'{bound:g}'))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key, ('le', '+Inf'))} {h.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {h.sum:.6f}")
+                    lines.append(f"{name}_count{_format_labels(key)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+# 全局实例，通过 METRICS_ENABLED=1 开启
+metrics = MetricsRegistry(enabled=_env_flag("METRICS_ENABLED"))
+
+
+# ---------------------------------------------------------------------------
+# 非阻塞日志
+# ---------------------------------------------------------------------------
+
+LOGGER_NAME = "construction_opportunity"
+
+_log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_listener: Optional[logging.handlers.QueueListener] = None
+_listener_lock = threading.Lock()
+
+
+def _ensure_log_listener() -> None:
+    """启动后台日志线程，日志记录只写入队列，由后台线程负责输出"""
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            return
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        _listener = logging.handlers.QueueListener(_log_queue, handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+        root = logging.getLogger(LOGGER_NAME)
+        root.addHandler(logging.handlers.QueueHandler(_log_queue))
+        root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+        root.propagate = False
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    获取项目日志记录器
+    :param name: 模块名称
+    """
+    _ensure_log_listener()
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+# ---------------------------------------------------------------------------
+# 抓取端点
+# ---------------------------------------------------------------------------
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """提供 /metrics（Prometheus文本）和 /metrics.json（JSON快照）两个端点"""
+    registry: MetricsRegistry = metrics
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = self.registry.render_prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path == "/metrics.json":
+            body = self.registry.to_json().encode("utf-8")
+            content_type = "application/json; charset=utf-8"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 抓取请求频繁，不输出访问日志
+        pass
+
+
+def start_metrics_server(port: int = 9464, host: str = "127.0.0.1",
+                         registry: Optional[MetricsRegistry] = None) -> ThreadingHTTPServer:
+    """
+    在后台线程中启动指标抓取HTTP服务
+    :param port: 监听端口，传0时由系统分配
+    :param host: 监听地址
+    :param registry: 指标注册表，默认使用全局实例
+    :return: HTTP服务对象，调用shutdown()停止
+    """
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry or metrics})
+    server = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    return server
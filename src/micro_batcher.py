@@ -0,0 +1,237 @@
+"""
+分析请求微批处理
+每次生成商机都要重复发送相同的系统提示词和说明，短时间内的多个不同组合各占一次调用和一个限流名额。
+微批处理器在很短的时间窗口内收集待处理的不同组合，达到数量或token上限时提前发出，
+合并为一次多段提示词的调用并要求按编号返回JSON，解析后分发给各个等待的调用方；
+未能从合并结果中得到有效结果的组合改为单独调用
+"""
+import asyncio
+import json
+import os
+from typing import Dict, List, Optional, Set, Tuple
+
+from fair_scheduler import current_request_class, current_tenant, request_context
+from llm_client import ConstructionOpportunityGenerator, opportunity_generator
+from metrics import get_logger, metrics
+from rate_limiter import estimate_tokens
+from schemas import MIN_OPPORTUNITIES
+
+logger = get_logger("micro_batcher")
+
+# (施工方向, 客户类型, 商机状态)
+Request = Tuple[str, str, str]
+
+_BATCH_PROMPT_HEADER = """
+作为一名资深的建筑行业分析师，请分别针对下面编号的每组条件，各生成5个潜在客户或合作伙伴的详细分析报告：
+
+{sections}
+
+对每组条件，请按以下要求提供分析：
+1. 找到5个不同的客户或潜在客户，同一公司的全称和简称视为同一客户，不要重复列出
+2. 每个客户需包含以下信息：
+   - 公司名称
+   - 项目信息（50字以内）：简述客户将要或正在进行的工程信息
+   - 证明信息（255字以内）：提供真实的网站公告、招标信息、在线公文等作为实际证明，并附上网址
+   - 推断信息（255字以内）：如果根据网络信息推断出商机，需给出文字证明和网址证明
+   - 营销方案（255字以内）：针对该客户的营销方案
+
+请注意：所有信息必须真实可靠，特别是证明信息中的网址必须是真实存在的；各组条件的结果互相独立。
+请以JSON格式返回结果，results 的键为条件编号，格式如下：
+{{
+  "results": {{
+    "1": {{
+      "opportunities": [
+        {{
+          "company_name": "...",
+          "project_info": "...",
+          "proof_info": "...",
+          "inferred_info": "...",
+          "marketing_plan": "..."
+        }}
+      ]
+    }}
+  }}
+}}
+"""
+
+
+def _section(number: int, request: Request) -> str:
+    construction_direction, customer_type, business_status = request
+    return f"【{number}】建筑方向：{construction_direction}；客户类型：{customer_type}；商机状态：{business_status}"
+
+
+def build_batch_messages(requests: List[Request]) -> List[Dict[str, str]]:
+    """
+    构造合并多组条件的对话消息，条件从1开始编号
+    """
+    sections = "\n".join(_section(number, request) for number, request in enumerate(requests, 1))
+    return [
+        {"role": "system", "content": "你是一个专业的建筑行业分析师，擅长发现潜在的商业机会并提供营销策略。"},
+        {"role": "user", "content": _BATCH_PROMPT_HEADER.format(sections=sections)},
+    ]
+
+
+def parse_batch_response(response: str) -> Dict[str, List[Dict[str, str]]]:
+    """
+    解析合并调用的返回结果
+    :return: 条件编号到商机列表的映射，无法解析时返回空字典
+    """
+    start_idx = response.find('{')
+    end_idx = response.rfind('}') + 1
+    if start_idx == -1 or end_idx == 0:
+        return {}
+    try:
+        data = json.loads(response[start_idx:end_idx])
+    except json.JSONDecodeError:
+        return {}
+    results = data.get("results") if isinstance(data, dict) else None
+    if not isinstance(results, dict):
+        return {}
+    parsed: Dict[str, List[Dict[str, str]]] = {}
+    for number, section in results.items():
+        if isinstance(section, dict):
+            section = section.get("opportunities")
+        if isinstance(section, list):
+            parsed[str(number)] = section
+    return parsed
+
+
+class _Batch:
+    """一个正在收集的批次"""
+
+    def __init__(self):
+        self.futures: Dict[Request, asyncio.Future] = {}
+        self.tokens = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class MicroBatcher:
+    """
+    微批处理器
+    批次按事件循环、租户和请求类别分组，合并调用计入发起批次的租户；相同组合在同一批次中只出现一次
+    """
+
+    def __init__(self, generator: Optional[ConstructionOpportunityGenerator] = None, window: float = 0.0,
+                 max_batch: int = 4, max_tokens: int = 12288, section_output_tokens: int = 2048,
+                 max_output_tokens: int = 8192):
+        """
+        :param generator: 商机生成器，默认使用全局实例
+        :param window: 收集窗口（秒），为0时不合并，直接单独调用
+        :param max_batch: 每批最多合并的组合数，同时受 max_output_tokens 限制
+        :param max_tokens: 每批预估的提示词与生成token之和的上限
+        :param section_output_tokens: 每个组合预留的生成token数
+        :param max_output_tokens: 服务商单次调用允许的最大生成token数，合并调用的 max_tokens 不超过该值
+        """
+        self.generator = generator if generator is not None else opportunity_generator
+        self.window = window
+        self.max_tokens = max_tokens
+        self.section_output_tokens = section_output_tokens
+        self.max_output_tokens = max_output_tokens
+        # 每个组合都要留足生成token，超出服务商上限的部分会被截断，导致结果无法解析
+        self.max_batch = max(1, min(max_batch, max_output_tokens // max(1, section_output_tokens)))
+        self._batches: Dict[Tuple[asyncio.AbstractEventLoop, str, str], _Batch] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        # 一次合并调用的固定开销：系统提示词与说明
+        self._header_tokens = estimate_tokens(build_batch_messages([]))
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0 and self.max_batch > 1
+
+    async def generate(self, construction_direction: str, customer_type: str,
+                       business_status: str) -> List[Dict[str, str]]:
+        """
+        生成一个组合的商机分析，调用失败时抛出异常
+        :return: 商机列表
+        """
+        request = (construction_direction, customer_type, business_status)
+        if not self.enabled:
+            return await self.generator.generate_opportunities(*request, allow_mock=False)
+
+        loop = asyncio.get_running_loop()
+        group = (loop, current_tenant(), current_request_class())
+        batch = self._batches.get(group)
+        future = batch.futures.get(request) if batch is not None else None
+        if future is None:
+            cost = estimate_tokens([{"content": _section(1, request)}]) + self.section_output_tokens
+            if batch is not None and batch.tokens + cost > self.max_tokens:
+                self._flush(group)
+                batch = None
+            if batch is None:
+                batch = self._batches[group] = _Batch()
+                batch.tokens = self._header_tokens
+                batch.timer = loop.call_later(self.window, self._flush, group)
+            future = batch.futures[request] = loop.create_future()
+            batch.tokens += cost
+            if len(batch.futures) >= self.max_batch:
+                self._flush(group)
+        # 调用方被取消时不影响同一批次中的其他组合
+        return await asyncio.shield(future)
+
+    def _flush(self, group: Tuple[asyncio.AbstractEventLoop, str, str]) -> None:
+        batch = self._batches.pop(group, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        loop, tenant, request_class = group
+        with request_context(tenant=tenant, request_class=request_class):
+            task = loop.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: _Batch) -> None:
+        requests = list(batch.futures.items())
+        sections: Dict[str, List[Dict[str, str]]] = {}
+        if len(requests) > 1:
+            messages = build_batch_messages([request for request, _ in requests])
+            llm_client = self.generator.llm_client
+            try:
+                max_tokens = min(self.max_output_tokens, self.section_output_tokens * len(requests))
+                response = await llm_client.call_llm(messages, temperature=0.7, max_tokens=max_tokens)
+                with metrics.span("parse", **llm_client.metric_labels()):
+                    sections = parse_batch_response(response)
+            except Exception as e:
+                logger.warning("合并 %d 个组合的大模型调用失败: %s，改为单独调用", len(requests), e)
+
+        labels = self.generator.llm_client.metric_labels()
+        fallback = []
+        for number, (request, future) in enumerate(requests, 1):
+            items = sections.get(str(number))
+            if items is not None and len(items) >= MIN_OPPORTUNITIES:
+                metrics.inc("llm_micro_batch_sections_total", outcome="batched", **labels)
+                if not future.done():
+                    future.set_result(items)
+            else:
+                fallback.append((request, future))
+        if not fallback:
+            return
+        metrics.inc("llm_micro_batch_sections_total", len(fallback), outcome="individual", **labels)
+        results = await asyncio.gather(
+            *(self.generator.generate_opportunities(*request, allow_mock=False) for request, _ in fallback),
+            return_exceptions=True
+        )
+        for (_, future), result in zip(fallback, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+def create_micro_batcher() -> MicroBatcher:
+    """
+    根据环境变量创建微批处理器
+    MICRO_BATCH_WINDOW_MS 未设置或为0时不合并
+    """
+    return MicroBatcher(
+        window=float(os.getenv("MICRO_BATCH_WINDOW_MS", "0")) / 1000,
+        max_batch=int(os.getenv("MICRO_BATCH_MAX_SIZE", "4")),
+        max_tokens=int(os.getenv("MICRO_BATCH_MAX_TOKENS", "12288")),
+        max_output_tokens=int(os.getenv("MICRO_BATCH_MAX_OUTPUT_TOKENS", "8192")),
+    )
+
+
+# 全局实例
+micro_batcher = create_micro_batcher()
@@ -68,30 +68,35 @@ class ModelConfig:
             
         if model_type == ModelType.QWEN:
             return {
+                "provider": "qwen",
                 "api_key": self.qwen_api_key,
                 "base_url": self.qwen_base_url,
                 "default_model": self.default_model
             }
         elif model_type == ModelType.ZHIPU:
             return {
+                "provider": "zhipu",
                 "api_key": self.zhipu_api_key,
                 "base_url": self.zhipu_base_url,
                 "default_model": self.default_model
             }
         elif model_type == ModelType.DOUBAO:
             return {
+                "provider": "doubao",
                 "api_key": self.doubao_api_key,
                 "base_url": self.doubao_base_url,
                 "default_model": self.default_model
             }
         elif model_type == ModelType.MOONSHOT:
             return {
+                "provider": "moonshot",
                 "api_key": self.moonshot_api_key,
                 "base_url": self.moonshot_base_url,
                 "default_model": self.default_model
             }
         elif model_type == ModelType.MINIMAX:
             return {
+                "provider": "minimax",
                 "api_key": self.minimax_api_key,
                 "base_url": self.minimax_base_url,
                 "default_model": self.default_model
@@ -99,6 +104,7 @@ class ModelConfig:
         else:
             # 默认使用通义千问配置
             return {
+                "provider": "qwen",
                 "api_key": self.qwen_api_key,
                 "base_url": self.qwen_base_url,
                 "default_model": self.default_model
@@ -0,0 +1,198 @@
+"""
+推测预取
+交互式流程中用户先选择施工方向和客户类型，最后选择商机状态。两者确定后，按历史选择频率推测最可能的商机状态，
+提前在后台生成结果并写入缓存；用户选定后保留猜中的任务，其余任务取消。
+预取任务与过期结果的后台刷新共用去重机制，正式请求到达时直接等待已开始的任务
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from core import analysis_cache_key, pending_refresh, schedule_refresh
+from fair_scheduler import current_request_class
+from metrics import get_logger, metrics
+from rate_limiter import TokenBucket
+from result_cache import result_cache
+from schemas import OpportunityAnalysisInput
+
+
+logger = get_logger("prefetch")
+
+
+class Speculation:
+    """
+    一次推测预取，由 Prefetcher.speculate 返回
+    用户选定商机状态后调用 resolve，放弃本次流程时调用 cancel；方法可在任意线程中调用
+    """
+
+    def __init__(self, prefetcher: "Prefetcher", construction_direction: str, customer_type: str,
+                 tasks: Dict[str, "asyncio.Task"]):
+        self._prefetcher = prefetcher
+        self.construction_direction = construction_direction
+        self.customer_type = customer_type
+        self.tasks = tasks
+        self._resolved = False
+
+    @property
+    def statuses(self) -> List[str]:
+        """已开始预取的商机状态，按可能性从高到低排序"""
+        return list(self.tasks)
+
+    def resolve(self, business_status: str) -> bool:
+        """
+        用户选定商机状态，取消其余预取任务
+        :return: 是否猜中
+        """
+        if self._resolved:
+            return False
+        self._resolved = True
+        hit = business_status in self.tasks
+        for status, task in self.tasks.items():
+            self._prefetcher._release(task, keep=status == business_status)
+        if self.tasks:
+            metrics.inc("llm_prefetch_total", outcome="hit" if hit else "miss")
+        return hit
+
+    def cancel(self) -> None:
+        """放弃本次推测，取消全部预取任务"""
+        if self._resolved:
+            return
+        self._resolved = True
+        for task in self.tasks.values():
+            self._prefetcher._release(task, keep=False)
+
+
+class Prefetcher:
+    """
+    推测预取器
+    历史选择频率取自结果缓存的访问计数；预取任务被多个推测共用时按引用计数管理，只有都未猜中才会取消；
+    共用其他流程已开始的刷新任务时不计入引用，也从不取消
+    """
+
+    def __init__(self, top_k: int = 2, min_share: float = 0.2, per_minute: float = 20.0,
+                 lookback: float = 30 * 86400.0):
+        """
+        :param top_k: 每次最多预取的商机状态数，为0时关闭预取
+        :param min_share: 商机状态在历史选择中的占比低于该值时不预取
+        :param per_minute: 每分钟最多发起的预取数，限制推测带来的额外开销
+        :param lookback: 只统计最近多少秒内的选择
+        """
+        self.top_k = top_k
+        self.min_share = min_share
+        self.bucket = TokenBucket(per_minute / 60.0, max(1.0, float(top_k)))
+        self.lookback = lookback
+        self._lock = threading.Lock()
+        self._refs: Dict["asyncio.Task", int] = {}
+        self._by_key: Dict[str, "asyncio.Task"] = {}
+
+    async def rank_statuses(self, construction_direction: str, customer_type: str) -> List[Tuple[str, float]]:
+        """
+        按历史选择频率对商机状态排序，访问计数在线程中读取，不阻塞事件循环
+        同一施工方向和客户类型下没有历史记录时，使用当前服务商和模型下全部组合的商机状态分布
+        :return: (商机状态, 占比) 列表，占比从高到低
+        """
+        labels = analysis_cache_key(OpportunityAnalysisInput(
+            construction_direction=construction_direction, customer_type=customer_type, business_status="-"
+        ))[0]
+        exact: Counter = Counter()
+        overall: Counter = Counter()
+        access_counts = await asyncio.to_thread(result_cache.access_counts, time.time() - self.lookback)
+        for key, hits in access_counts.items():
+            try:
+                provider, model, direction, ctype, status = json.loads(key)
+            except ValueError:
+                continue
+            if provider != labels["provider"] or model != labels["model"]:
+                continue
+            overall[status] += hits
+            if direction == construction_direction and ctype == customer_type:
+                exact[status] += hits
+        counts = exact or overall
+        total = sum(counts.values())
+        return [(status, hits / total) for status, hits in counts.most_common()]
+
+    async def speculate(self, construction_direction: str, customer_type: str) -> Speculation:
+        """
+        为最可能的商机状态开始后台生成，返回时预取任务已经开始
+        已有可用缓存的状态不预取；超出速率限制或后台任务数达到上限时少预取或不预取；缓存读取在线程中进行
+        """
+        tasks: Dict[str, asyncio.Task] = {}
+        if self.top_k <= 0:
+            return Speculation(self, construction_direction, customer_type, tasks)
+        for status, share in await self.rank_statuses(construction_direction, customer_type):
+            if len(tasks) >= self.top_k or share < self.min_share:
+                break
+            input_data = OpportunityAnalysisInput(
+                construction_direction=construction_direction, customer_type=customer_type,
+                business_status=status
+            )
+            _, cache_key = analysis_cache_key(input_data)
+            if await asyncio.to_thread(result_cache.get, cache_key, True) is not None:
+                continue
+            with self._lock:
+                task = self._by_key.get(cache_key)
+                if task is not None and not task.done() and task in self._refs:
+                    # 其他推测已在预取同一组合，共用任务且不重复计入开销
+                    self._refs[task] += 1
+                    tasks[status] = task
+                    continue
+            task = pending_refresh(cache_key)
+            if task is not None:
+                # 过期结果的后台刷新等其他流程已在生成该组合，直接共用；任务不属于预取器，不会被取消
+                tasks[status] = task
+                continue
+            if self.bucket.reserve() > 0:
+                self.bucket.refund(1.0)
+                metrics.inc("llm_prefetch_total", outcome="throttled")
+                break
+            # 预取是为当前用户进行的，沿用其请求类别，正式请求等待预取任务时不会排在批处理之后
+            task = schedule_refresh(input_data, current_request_class())
+            if task is None:
+                self.bucket.refund(1.0)
+                metrics.inc("llm_prefetch_total", outcome="throttled")
+                break
+            with self._lock:
+                self._refs[task] = self._refs.get(task, 0) + 1
+                self._by_key[cache_key] = task
+            tasks[status] = task
+            metrics.inc("llm_prefetch_total", outcome="started")
+        if tasks:
+            logger.debug("预取 %s/%s: %s", construction_direction, customer_type, "、".join(tasks))
+        return Speculation(self, construction_direction, customer_type, tasks)
+
+    def _release(self, task: "asyncio.Task", keep: bool) -> None:
+        """释放一次引用；由预取器创建、不再被任何推测需要且未猜中的任务被取消"""
+        with self._lock:
+            if task not in self._refs:
+                # 共用的其他流程的任务，或已猜中不再管理的任务
+                return
+            count = self._refs[task] - 1
+            if count > 0 and not keep:
+                self._refs[task] = count
+                return
+            # 猜中的任务不再被取消，之后的推测也不再共用它
+            self._refs.pop(task, None)
+            for key in [key for key, other in self._by_key.items() if other is task or other.done()]:
+                del self._by_key[key]
+        if not keep and count == 0 and not task.done():
+            task.get_loop().call_soon_threadsafe(task.cancel)
+            metrics.inc("llm_prefetch_total", outcome="cancelled")
+
+
+def create_prefetcher() -> Prefetcher:
+    """
+    按环境变量创建预取器：PREFETCH_TOP_K、PREFETCH_MIN_SHARE、PREFETCH_PER_MINUTE
+    """
+    return Prefetcher(
+        top_k=int(os.getenv("PREFETCH_TOP_K", "2")),
+        min_share=float(os.getenv("PREFETCH_MIN_SHARE", "0.2")),
+        per_minute=float(os.getenv("PREFETCH_PER_MINUTE", "20")),
+    )
+
+
+# 全局实例
+prefetcher = create_prefetcher()
@@ -0,0 +1,283 @@
+"""
+按需性能剖析模块
+对采样到的商机分析请求采集cProfile数据、折叠调用栈、tracemalloc内存峰值和事件循环阻塞信息，
+结果写入本地目录并按数量滚动清理。未开启时不产生任何额外开销
+"""
+import asyncio
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import shutil
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional
+
+from metrics import get_logger
+
+
+logger = get_logger("profiling")
+
+# cProfile和tracemalloc都是进程级的，同一时间只允许一个会话采集，其余并发会话只记录调用栈和事件循环阻塞
+_collector_lock = threading.Lock()
+
+
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, "0").strip().lower() in ("1", "true", "yes", "on")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _collapse_stack(frame) -> str:
+    """将帧链转换为折叠栈格式（根在前，以分号分隔）"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class StackSampler:
+    """
+    调用栈采样器
+    在后台线程中按固定间隔采样目标线程的调用栈，输出可直接用于火焰图的折叠栈文本
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[_collapse_stack(frame)] += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+class LoopStallDetector:
+    """
+    事件循环阻塞检测器
+    后台线程定期向事件循环投递心跳，心跳超过阈值仍未执行时判定为阻塞，
+    记录阻塞时长、当时正在运行的协程以及事件循环线程的调用栈
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, threshold: float = 0.1):
+        self.loop = loop
+        self.threshold = threshold
+        self.loop_thread_id = threading.get_ident()
+        self.stalls: List[Dict] = []
+        self._beat = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="loop-stall-detector", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._beat.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._beat.clear()
+            sent = time.perf_counter()
+            try:
+                self.loop.call_soon_threadsafe(self._beat.set)
+            except RuntimeError:
+                # 事件循环已关闭
+                return
+            if self._beat.wait(self.threshold):
+                self._stop.wait(self.threshold / 2)
+                continue
+
+            # 心跳超时，记录阻塞现场，然后等待事件循环恢复以得到完整阻塞时长
+            stall = self._capture()
+            self._beat.wait()
+            if self._stop.is_set():
+                return
+            stall["duration_ms"] = round((time.perf_counter() - sent) * 1000, 2)
+            self.stalls.append(stall)
+            logger.warning("事件循环阻塞 %.0fms，当前协程: %s", stall["duration_ms"], stall["coroutine"])
+
+    def _capture(self) -> Dict:
+        task = asyncio.current_task(self.loop)
+        coroutine = None
+        if task is not None:
+            coro = task.get_coro()
+            coroutine = getattr(coro, "__qualname__", repr(coro))
+        frame = sys._current_frames().get(self.loop_thread_id)
+        return {
+            "at": time.time(),
+            "task": task.get_name() if task is not None else None,
+            "coroutine": coroutine,
+            "stack": _collapse_stack(frame) if frame is not None else None,
+        }
+
+
+class ProfileSession:
+    """
+    单个请求的剖析会话，作为异步上下文管理器使用
+    与其他会话重叠时不采集cProfile和内存数据，汇总信息中没有 memory_* 字段
+    """
+
+    def __init__(self, profiler: "AnalysisProfiler", name: str):
+        self.profiler = profiler
+        self.name = name
+        self.summary: Dict = {"name": name}
+        self._cprofile: Optional[cProfile.Profile] = None
+        self._sampler: Optional[StackSampler] = None
+        self._stall_detector: Optional[LoopStallDetector] = None
+        self._started_tracemalloc = False
+        self._start = 0.0
+
+    async def __aenter__(self) -> "ProfileSession":
+        if _collector_lock.acquire(blocking=False):
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+            tracemalloc.reset_peak()
+            self.summary["memory_before_bytes"] = tracemalloc.get_traced_memory()[0]
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+        self._sampler = StackSampler(threading.get_ident(), self.profiler.sample_interval)
+        self._sampler.start()
+        self._stall_detector = LoopStallDetector(asyncio.get_running_loop(), self.profiler.stall_threshold)
+        self._stall_detector.start()
+        self._start = time.perf_counter()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        self.summary["duration_ms"] = round((time.perf_counter() - self._start) * 1000, 2)
+        self.summary["error"] = repr(exc) if exc is not None else None
+
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            current, peak = tracemalloc.get_traced_memory()
+            self.summary["memory_peak_bytes"] = peak - self.summary["memory_before_bytes"]
+            self.summary["memory_retained_bytes"] = current - self.summary["memory_before_bytes"]
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+            _collector_lock.release()
+        self._sampler.stop()
+        self._stall_detector.stop()
+        self.summary["loop_stalls"] = self._stall_detector.stalls
+
+        await asyncio.get_running_loop().run_in_executor(None, self._write_artifacts)
+        return False
+
+    def _write_artifacts(self) -> None:
+        directory = self.profiler.new_artifact_dir(self.name)
+        self.summary["artifact_dir"] = directory
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(os.path.join(directory, "profile.prof"))
+            text = io.StringIO()
+            pstats.Stats(self._cprofile, stream=text).sort_stats("cumulative").print_stats(40)
+            with open(os.path.join(directory, "profile.txt"), 'w', encoding='utf-8') as file:
+                file.write(text.getvalue())
+        with open(os.path.join(directory, "stacks.collapsed"), 'w', encoding='utf-8') as file:
+            file.write(self._sampler.collapsed())
+        with open(os.path.join(directory, "summary.json"), 'w', encoding='utf-8') as file:
+            json.dump(self.summary, file, ensure_ascii=False, indent=2)
+        self.profiler.rotate()
+        logger.info("剖析结果已写入: %s（耗时 %.0fms）", directory, self.summary["duration_ms"])
+
+
+class AnalysisProfiler:
+    """
+    商机分析剖析器
+    通过环境变量全局开启，或由单个请求指定采样率开启
+    """
+
+    def __init__(self,
+                 enabled: bool = False,
+                 sample_rate: float = 1.0,
+                 output_dir: str = "profiles",
+                 max_artifacts: int = 50,
+                 stall_threshold: float = 0.1,
+                 sample_interval: float = 0.005):
+        """
+        :param enabled: 是否全局开启
+        :param sample_rate: 全局开启时的采样率（0~1）
+        :param output_dir: 剖析结果输出目录
+        :param max_artifacts: 最多保留的剖析结果数量，超出后删除最旧的
+        :param stall_threshold: 事件循环阻塞判定阈值（秒）
+        :param sample_interval: 调用栈采样间隔（秒）
+        """
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.output_dir = output_dir
+        self.max_artifacts = max_artifacts
+        self.stall_threshold = stall_threshold
+        self.sample_interval = sample_interval
+
+    def should_sample(self, request_rate: Optional[float] = None) -> bool:
+        """
+        判断本次请求是否采样
+        :param request_rate: 请求级采样率，True视为1.0；为None时使用全局配置
+        """
+        if request_rate is None:
+            if not self.enabled:
+                return False
+            request_rate = self.sample_rate
+        return random.random() < float(request_rate)
+
+    def session(self, name: str) -> ProfileSession:
+        """创建剖析会话"""
+        return ProfileSession(self, name)
+
+    def new_artifact_dir(self, name: str) -> str:
+        safe_name = "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in name)[:60]
+        directory = os.path.join(
+            self.output_dir,
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{safe_name}-{uuid.uuid4().hex[:8]}"
+        )
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def rotate(self) -> None:
+        """删除超出保留数量的旧剖析结果"""
+        try:
+            entries = [os.path.join(self.output_dir, name) for name in os.listdir(self.output_dir)]
+        except FileNotFoundError:
+            return
+        entries = sorted((p for p in entries if os.path.isdir(p)), key=os.path.getmtime)
+        for path in entries[:max(0, len(entries) - self.max_artifacts)]:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+# 全局实例，通过 PROFILE_ENABLED=1 开启
+profiler = AnalysisProfiler(
+    enabled=_env_flag("PROFILE_ENABLED"),
+    sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "1.0")),
+    output_dir=os.getenv("PROFILE_DIR", "profiles"),
+    max_artifacts=int(os.getenv("PROFILE_MAX_ARTIFACTS", "50")),
+    stall_threshold=float(os.getenv("PROFILE_STALL_THRESHOLD_MS", "100")) / 1000,
+)
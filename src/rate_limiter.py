@@ -0,0 +1,388 @@
+"""
+大模型调用限流
+每个服务商一个限流器：请求数和估算token数各用一个令牌桶限制速率（RPM/TPM），
+并发数由AIMD自适应窗口控制，遇到429或延迟明显升高时缩小窗口，运行正常时逐步扩大
+"""
+import asyncio
+import collections
+import math
+import os
+import threading
+import time
+from typing import Deque, Dict, List, Optional, Tuple
+
+from metrics import metrics
+
+
+def _env_number(name: str, default: float) -> float:
+    value = os.getenv(name, "").strip()
+    return float(value) if value else default
+
+
+def estimate_tokens(messages: List[Dict[str, str]]) -> int:
+    """
+    粗略估算提示词的token数
+    中文约每个字一个token，其余字符约每4个一个token；只用于限流，无需精确
+    """
+    total = 0
+    for message in messages:
+        content = message.get("content") or ""
+        wide = sum(1 for char in content if ord(char) > 0x2E7F)
+        total += wide + (len(content) - wide + 3) // 4 + 4
+    return total
+
+
+class TokenBucket:
+    """
+    令牌桶
+    采用预约方式：取令牌时允许余额为负，并返回需要等待的时间，调用方在锁外等待，
+    因此无需异步锁，可以被多个事件循环和线程共享；单次取用量大于桶容量时同样按速率折算等待时间
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        :param rate: 每秒补充的令牌数，小于等于0表示不限制
+        :param capacity: 桶容量，即允许的突发量
+        """
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float = 1.0) -> float:
+        """
+        预约令牌
+        :return: 需要等待的秒数
+        """
+        if not self.enabled:
+            return 0.0
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= amount
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def available(self) -> float:
+        """当前可用的令牌数（预约后可能为负）"""
+        if not self.enabled:
+            return float("inf")
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+    def refund(self, amount: float) -> None:
+        """归还令牌（为负时表示补扣），用于按实际用量修正预估值"""
+        if not self.enabled or not amount:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+    def ensure_capacity(self, amount: float) -> None:
+        """将桶容量扩大到至少能容纳一次 amount 的取用，空闲后单次最大的调用无需等待"""
+        if not self.enabled or amount <= self.capacity:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            full = self._tokens >= self.capacity
+            self.capacity = max(self.capacity, amount)
+            if full:
+                # 桶已满说明处于空闲状态，按新容量视为已满
+                self._tokens = self.capacity
+
+    def drain(self) -> None:
+        """清空令牌，服务商返回429时使用"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, 0.0)
+
+
+class AdaptiveWindow:
+    """
+    AIMD自适应并发窗口
+    正常完成时每轮窗口加1（每个请求加1/窗口），遇到限流或延迟超过基线的latency_tolerance倍时乘以backoff，
+    延迟应当与生成长度无关（例如按生成token数折算的耗时），否则长短不一的请求会被误判为服务商变慢；
+    每个冷却期内最多缩小一次，避免同一批429把窗口缩到最小
+    等待者按先后顺序唤醒，且可以来自不同的事件循环
+    """
+
+    def __init__(self, initial: float = 4, min_limit: float = 1, max_limit: float = 64,
+                 backoff: float = 0.5, latency_tolerance: float = 2.0, cooldown: float = 1.0):
+        self.min_limit = max(1.0, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = min(self.max_limit, max(self.min_limit, initial))
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.cooldown = cooldown
+        self.inflight = 0
+        self.baseline_latency: Optional[float] = None
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._waiters: Deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = collections.deque()
+
+    def _has_capacity(self) -> bool:
+        return self.inflight < math.floor(self.limit)
+
+    async def acquire(self) -> None:
+        """占用一个并发名额，窗口已满时排队等待"""
+        with self._lock:
+            if not self._waiters and self._has_capacity():
+                self.inflight += 1
+                return
+            loop = asyncio.get_running_loop()
+            waiter = loop.create_future()
+            self._waiters.append((loop, waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            with self._lock:
+                try:
+                    self._waiters.remove((loop, waiter))
+                    granted = False
+                except ValueError:
+                    granted = True
+            if granted:
+                # 名额已转交给当前协程，取消时需归还
+                self._release_slot()
+            raise
+
+    def release(self, latency: Optional[float] = None, throttled: bool = False) -> None:
+        """
+        释放名额并调整窗口
+        :param latency: 本次请求的延迟（秒），为None时不参与调整
+        :param throttled: 是否被服务商限流
+        """
+        now = time.monotonic()
+        with self._lock:
+            if throttled:
+                self._decrease(now)
+            elif latency is not None:
+                if self.baseline_latency is None or latency < self.baseline_latency:
+                    self.baseline_latency = latency
+                else:
+                    # 基线缓慢上浮，以适应服务商整体变慢的情况
+                    self.baseline_latency += (latency - self.baseline_latency) * 0.01
+                if latency > self.baseline_latency * self.latency_tolerance:
+                    self._decrease(now)
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+        self._release_slot()
+
+    def _decrease(self, now: float) -> None:
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+
+    def _release_slot(self) -> None:
+        with self._lock:
+            self.inflight -= 1
+            while self._waiters and self._has_capacity():
+                # 出队即视为获得名额；若等待者恰好被取消，由其取消处理逻辑归还
+                loop, waiter = self._waiters.popleft()
+                self.inflight += 1
+                loop.call_soon_threadsafe(_grant, waiter)
+
+
+def _grant(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class Reservation:
+    """一次已获准的调用，完成后必须调用 release"""
+
+    __slots__ = ("limiter", "tokens", "request_class", "started")
+
+    def __init__(self, limiter: "ProviderLimiter", tokens: int, request_class: Optional[str] = None):
+        self.limiter = limiter
+        self.tokens = tokens
+        self.request_class = request_class
+        self.started = time.monotonic()
+
+    def release(self, latency: Optional[float] = None, throttled: bool = False,
+                used_tokens: Optional[int] = None, retry_after: Optional[float] = None) -> None:
+        """
+        :param latency: 按生成token数折算的请求耗时（秒/token），为None时只按是否限流调整窗口
+        :param throttled: 是否被服务商限流（HTTP 429）
+        :param used_tokens: 服务商返回的实际token数，用于修正预估
+        :param retry_after: 服务商要求的等待时间（秒）
+        """
+        self.limiter._finish(self, latency, throttled, used_tokens, retry_after)
+
+
+class ProviderLimiter:
+    """单个服务商的限流器"""
+
+    def __init__(self, provider: str, rpm: float = 0, tpm: float = 0,
+                 max_concurrency: float = 16, min_concurrency: float = 1,
+                 initial_concurrency: Optional[float] = None, burst_seconds: float = 60.0):
+        """
+        :param provider: 服务商名称
+        :param rpm: 每分钟请求数上限，0表示不限制
+        :param tpm: 每分钟token数上限（提示词估算值加max_tokens），0表示不限制
+        :param max_concurrency: 并发窗口上限
+        :param min_concurrency: 并发窗口下限
+        :param initial_concurrency: 并发窗口初始值，默认为上限的四分之一
+        :param burst_seconds: 令牌桶允许的突发量，以多少秒的额度计，默认与公平调度的租户配额一致为一整分钟
+        """
+        self.provider = provider
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = TokenBucket(rpm / 60.0, rpm / 60.0 * burst_seconds)
+        self.tokens = TokenBucket(tpm / 60.0, tpm / 60.0 * burst_seconds)
+        self.window = AdaptiveWindow(
+            initial=initial_concurrency or max(min_concurrency, max_concurrency / 4),
+            min_limit=min_concurrency,
+            max_limit=max_concurrency,
+        )
+        self.throttled = 0
+        self._blocked_until = 0.0
+        self._recent: Deque[Tuple[float, int]] = collections.deque()
+        # 各请求类别当前占用的并发名额
+        self._inflight_by_class: Dict[Optional[str], int] = collections.Counter()
+        self._lock = threading.Lock()
+
+    async def acquire(self, tokens: int = 0, request_class: Optional[str] = None) -> Reservation:
+        """
+        等待直到允许发出请求
+        :param tokens: 本次请求预计消耗的token数
+        :param request_class: 公平调度的请求类别，用于按类别统计占用的并发名额
+        """
+        await self.window.acquire()
+        # 桶容量至少能容纳一次最大的调用，否则即使空闲也要等待
+        self.tokens.ensure_capacity(tokens)
+        delay = max(self.requests.reserve(1), self.tokens.reserve(tokens),
+                    self._blocked_until - time.monotonic())
+        try:
+            if delay > 0:
+                await asyncio.sleep(delay)
+        except BaseException:
+            # 等待期间被取消，预约的令牌没有使用，归还给后续调用
+            self.requests.refund(1)
+            self.tokens.refund(tokens)
+            self.window.release()
+            raise
+        reservation = Reservation(self, tokens, request_class)
+        with self._lock:
+            self._recent.append((reservation.started, tokens))
+            self._inflight_by_class[request_class] += 1
+        self._publish()
+        return reservation
+
+    def _finish(self, reservation: Reservation, latency: Optional[float], throttled: bool,
+                used_tokens: Optional[int], retry_after: Optional[float]) -> None:
+        if throttled:
+            self.throttled += 1
+            self.requests.drain()
+            self.tokens.drain()
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+            metrics.inc("llm_throttled_total", provider=self.provider)
+        elif used_tokens is not None:
+            self.tokens.refund(reservation.tokens - used_tokens)
+        with self._lock:
+            self._inflight_by_class[reservation.request_class] -= 1
+        self.window.release(latency, throttled)
+        self._publish()
+
+    def inflight(self, request_class: Optional[str] = None) -> int:
+        """
+        已获准、尚未完成的调用数
+        :param request_class: 只统计该请求类别，为None时统计全部
+        """
+        if request_class is None:
+            return self.window.inflight
+        with self._lock:
+            return self._inflight_by_class[request_class]
+
+    def _trim_recent(self, now: float) -> None:
+        while self._recent and now - self._recent[0][0] > 60.0:
+            self._recent.popleft()
+
+    def effective_rates(self) -> Dict[str, float]:
+        """
+        当前生效的限流参数和最近一分钟的实际速率
+        """
+        with self._lock:
+            self._trim_recent(time.monotonic())
+            recent_requests = len(self._recent)
+            recent_tokens = sum(tokens for _, tokens in self._recent)
+        return {
+            "concurrency_limit": math.floor(self.window.limit),
+            "inflight": self.window.inflight,
+            "rpm_limit": self.rpm,
+            "tpm_limit": self.tpm,
+            "rpm": recent_requests,
+            "tpm": recent_tokens,
+            "throttled": self.throttled,
+        }
+
+    def _publish(self) -> None:
+        if not metrics.enabled:
+            return
+        rates = self.effective_rates()
+        metrics.set_gauge("llm_concurrency_limit", rates["concurrency_limit"], provider=self.provider)
+        metrics.set_gauge("llm_inflight_requests", rates["inflight"], provider=self.provider)
+        metrics.set_gauge("llm_requests_per_minute", rates["rpm"], provider=self.provider)
+        metrics.set_gauge("llm_tokens_per_minute", rates["tpm"], provider=self.provider)
+
+
+class RateLimiterRegistry:
+    """
+    按服务商维护限流器
+    配置来自环境变量 <PROVIDER>_RPM、<PROVIDER>_TPM、<PROVIDER>_MAX_CONCURRENCY，
+    未设置时使用 LLM_RPM、LLM_TPM、LLM_MAX_CONCURRENCY
+    """
+
+    def __init__(self):
+        self._limiters: Dict[str, ProviderLimiter] = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider: str) -> ProviderLimiter:
+        limiter = self._limiters.get(provider)
+        if limiter is None:
+            with self._lock:
+                limiter = self._limiters.get(provider)
+                if limiter is None:
+                    limiter = self._limiters[provider] = self._create(provider)
+        return limiter
+
+    @staticmethod
+    def _create(provider: str) -> ProviderLimiter:
+        prefix = provider.upper()
+
+        def setting(name: str, default: float) -> float:
+            return _env_number(f"{prefix}_{name}", _env_number(f"LLM_{name}", default))
+
+        return ProviderLimiter(
+            provider,
+            rpm=setting("RPM", 0),
+            tpm=setting("TPM", 0),
+            max_concurrency=setting("MAX_CONCURRENCY", 16),
+            min_concurrency=setting("MIN_CONCURRENCY", 1),
+        )
+
+    def configure(self, provider: str, **kwargs) -> ProviderLimiter:
+        """以指定参数替换服务商的限流器，参数同 ProviderLimiter"""
+        with self._lock:
+            limiter = self._limiters[provider] = ProviderLimiter(provider, **kwargs)
+        return limiter
+
+    def effective_rates(self) -> Dict[str, Dict[str, float]]:
+        """全部服务商当前的限流参数和实际速率"""
+        return {provider: limiter.effective_rates() for provider, limiter in list(self._limiters.items())}
+
+
+# 全局实例
+rate_limiters = RateLimiterRegistry()
@@ -0,0 +1,220 @@
+"""
+缓存预热调度器
+在低峰时段按访问次数和条目年龄挑选高频的输入组合，提前重新生成分析结果，
+刷新速率受令牌桶限制，在线请求较多时主动让出，不会挤占交互流量；
+被新入库的招标公告标记为待更新的结果优先刷新
+"""
+import asyncio
+import datetime
+import json
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from core import analysis_cache_key, refresh_analysis, schedule_refresh
+from dependency_tracker import DependencyTracker, dependency_tracker
+from fair_scheduler import BATCH, INTERACTIVE, request_context
+from metrics import get_logger
+from rate_limiter import TokenBucket, rate_limiters
+from result_cache import ResultCache, result_cache
+from schemas import OpportunityAnalysisInput
+
+
+logger = get_logger("refresh_scheduler")
+
+
+def parse_window(spec: str) -> Optional[Tuple[datetime.time, datetime.time]]:
+    """
+    解析 "HH:MM-HH:MM" 形式的时间段，允许跨越午夜；空字符串表示不限制
+    """
+    spec = spec.strip()
+    if not spec:
+        return None
+    try:
+        start, end = (datetime.time.fromisoformat(part.strip()) for part in spec.split("-", 1))
+    except ValueError:
+        raise ValueError(f"时间段格式应为 HH:MM-HH:MM，例如 01:00-06:00，实际为: {spec}")
+    return start, end
+
+
+def _input_for_key(key: str) -> Optional[OpportunityAnalysisInput]:
+    """
+    由缓存键还原输入参数；其他服务商或模型的缓存条目不在当前进程刷新，返回None
+    """
+    provider, model, direction, customer_type, status = json.loads(key)
+    input_data = OpportunityAnalysisInput(
+        construction_direction=direction, customer_type=customer_type, business_status=status
+    )
+    _, current_key = analysis_cache_key(input_data)
+    return input_data if current_key == key else None
+
+
+class RefreshScheduler:
+    """
+    缓存预热调度器
+    每轮挑选 访问次数 × 条目年龄 最高的若干组合依次刷新，刷新与过期请求触发的后台刷新共用去重和并发上限
+    """
+
+    def __init__(self, per_minute: float = 6.0,
+                 window: Optional[str] = "01:00-06:00", min_age: Optional[float] = None,
+                 batch_size: int = 20, interval: float = 60.0, lookback: float = 7 * 86400.0,
+                 busy_ratio: float = 0.5):
+        """
+        :param per_minute: 每分钟最多刷新的组合数
+        :param window: 允许预热的时间段（本地时间），如 "01:00-06:00"，为空时不限制
+        :param min_age: 条目存在超过多少秒才刷新，默认为缓存有效期的一半
+        :param batch_size: 每轮最多刷新的组合数
+        :param interval: 两轮之间的间隔（秒）
+        :param lookback: 只考虑最近多少秒内被访问过的组合
+        :param busy_ratio: 在线请求占用服务商并发窗口超过该比例时暂停预热
+        """
+        self.bucket = TokenBucket(per_minute / 60.0, 1.0)
+        self.window = parse_window(window or "")
+        self.min_age = result_cache.ttl / 2 if min_age is None else min_age
+        self.batch_size = batch_size
+        self.interval = interval
+        self.lookback = lookback
+        self.busy_ratio = busy_ratio
+        self._task: Optional[asyncio.Task] = None
+
+    def in_window(self, now: Optional[datetime.datetime] = None) -> bool:
+        """当前是否处于允许预热的时间段"""
+        if self.window is None:
+            return True
+        current = (now or datetime.datetime.now()).time()
+        start, end = self.window
+        if start <= end:
+            return start <= current < end
+        return current >= start or current < end
+
+    def _interactive_busy(self, provider: str) -> bool:
+        """
+        在线请求是否已占用服务商并发窗口的较大比例
+        只统计已获准的交互类调用，排队中的后台刷新和批处理不计入
+        """
+        limiter = rate_limiters.get(provider)
+        return limiter.inflight(INTERACTIVE) >= limiter.window.limit * self.busy_ratio
+
+    async def run_once(self) -> Dict[str, int]:
+        """
+        执行一轮预热，挑选候选的SQLite查询在线程中执行，不阻塞在线请求所在的事件循环
+        :return: 刷新、失败、跳过和推迟的组合数；任务被取消时记为跳过，调用失败或结果无效时记为失败
+        """
+        stats = {"refreshed": 0, "failed": 0, "skipped": 0, "deferred": 0}
+        # 待更新的结果优先，其余名额按访问次数和条目年龄挑选
+        hits = await asyncio.to_thread(result_cache.access_counts)
+        dirty = await asyncio.to_thread(dependency_tracker.dirty_keys, self.batch_size, hits)
+        aged = await asyncio.to_thread(result_cache.refresh_candidates, self.min_age, self.batch_size,
+                                       time.time() - self.lookback)
+        candidates = [key for key, _ in dirty]
+        candidates += [key for key, _, _ in aged if key not in candidates]
+        candidates = candidates[:self.batch_size]
+        for index, key in enumerate(candidates):
+            input_data = _input_for_key(key)
+            if input_data is None:
+                stats["skipped"] += 1
+                continue
+            if self._interactive_busy(json.loads(key)[0]):
+                stats["deferred"] += len(candidates) - index
+                break
+            delay = self.bucket.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = schedule_refresh(input_data)
+            if task is None:
+                stats["deferred"] += len(candidates) - index
+                break
+            # 任务可能与推测预取共用，被取消时不影响调度器本身
+            await asyncio.wait([task])
+            if task.cancelled():
+                stats["skipped"] += 1
+            elif task.exception() is not None or not task.result():
+                stats["failed"] += 1
+            else:
+                stats["refreshed"] += 1
+        if stats["refreshed"] or stats["failed"] or stats["deferred"]:
+            logger.info("缓存预热：刷新 %d，失败 %d，跳过 %d，推迟 %d",
+                        stats["refreshed"], stats["failed"], stats["skipped"], stats["deferred"])
+        return stats
+
+    async def run_forever(self) -> None:
+        """在允许的时间段内循环预热，直到被取消"""
+        while True:
+            if self.in_window():
+                try:
+                    await self.run_once()
+                except Exception as e:
+                    logger.warning("缓存预热失败: %s", e)
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> asyncio.Task:
+        """在当前事件循环中启动调度器"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run_forever())
+        return self._task
+
+    async def stop(self) -> None:
+        """停止调度器，已开始的刷新任务会继续完成"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+async def recompute_dirty(limit: Optional[int] = None, concurrency: int = 2,
+                          cache: Optional[ResultCache] = None,
+                          tracker: Optional[DependencyTracker] = None) -> Dict[str, int]:
+    """
+    只重新计算被公告标记为待更新的结果，按优先级顺序开始
+    :param limit: 最多重新计算的结果数，默认全部
+    :param concurrency: 同时进行的重新计算数
+    :param cache: 结果缓存，默认使用全局实例
+    :param tracker: 结果依赖跟踪器，默认使用全局实例
+    :return: 更新、失败和跳过的结果数；失败的结果保持待更新，下次继续处理
+    """
+    # ResultCache 定义了 __len__，空缓存为假值，不能用 or 判断
+    cache = cache if cache is not None else result_cache
+    tracker = tracker or dependency_tracker
+    stats = {"refreshed": 0, "failed": 0, "skipped": 0}
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def recompute(input_data: OpportunityAnalysisInput) -> None:
+        async with semaphore:
+            try:
+                with request_context(request_class=BATCH):
+                    refreshed = await refresh_analysis(input_data, cache, tracker)
+            except Exception as e:
+                logger.warning("增量更新失败: %s", e)
+                refreshed = False
+            stats["refreshed" if refreshed else "failed"] += 1
+
+    inputs = []
+    hits = await asyncio.to_thread(cache.access_counts)
+    for key, _ in await asyncio.to_thread(tracker.dirty_keys, limit, hits):
+        input_data = _input_for_key(key)
+        if input_data is None:
+            stats["skipped"] += 1
+        else:
+            inputs.append(input_data)
+    await asyncio.gather(*(recompute(input_data) for input_data in inputs))
+    if inputs:
+        logger.info("增量更新：更新 %d，失败 %d，跳过 %d", stats["refreshed"], stats["failed"], stats["skipped"])
+    return stats
+
+
+def create_refresh_scheduler() -> RefreshScheduler:
+    """
+    按环境变量创建调度器：REFRESH_PER_MINUTE、REFRESH_WINDOW、REFRESH_MIN_AGE、REFRESH_BATCH_SIZE、REFRESH_INTERVAL
+    """
+    min_age = os.getenv("REFRESH_MIN_AGE", "").strip()
+    return RefreshScheduler(
+        per_minute=float(os.getenv("REFRESH_PER_MINUTE", "6")),
+        window=os.getenv("REFRESH_WINDOW", "01:00-06:00"),
+        min_age=float(min_age) if min_age else None,
+        batch_size=int(os.getenv("REFRESH_BATCH_SIZE", "20")),
+        interval=float(os.getenv("REFRESH_INTERVAL", "60")),
+    )
@@ -0,0 +1,337 @@
+"""
+历史报告归档
+以追加方式保存每一份生成的分析报告，供审计和趋势分析使用。
+报告按块压缩，所有块共用一个由最初若干份报告训练的zlib预置字典，字段名、固定话术等重复内容在小块中也能被压缩；
+每个块可以独立解压，旁路索引按日期和输入键记录报告所在的块，按键或日期查找只需解压一个块
+"""
+import collections
+import datetime
+import json
+import os
+import re
+import struct
+import time
+import zlib
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from batch_runner import record_key
+from schemas import OPPORTUNITY_FIELDS, OpportunityAnalysisInput, OpportunityAnalysisOutput, output_from_validated
+
+_MAGIC = b"CDARCHV1"
+# 块头为压缩数据的长度，最高位表示该块未使用预置字典（字典训练完成之前写入的块）
+_BLOCK_HEADER = struct.Struct("<I")
+_PLAIN_BLOCK = 0x80000000
+
+# zlib的滑动窗口为32KB，预置字典超过该长度的部分不会被使用
+MAX_DICTIONARY_SIZE = 32768
+
+# 训练字典时切分文本片段使用的分隔符
+_FRAGMENT_SPLIT = re.compile(r'(?<=[，。；：、,;:\]】"])')
+
+
+class ArchivedReport(NamedTuple):
+    """归档中的一份报告"""
+    key: str
+    input: OpportunityAnalysisInput
+    output: OpportunityAnalysisOutput
+    created_at: float
+
+
+class IndexEntry(NamedTuple):
+    """旁路索引中的一条记录"""
+    key: str
+    date: str
+    created_at: float
+    offset: int
+    length: int
+    slot: int
+
+
+def _serialize(key: str, input_data: OpportunityAnalysisInput, output: OpportunityAnalysisOutput,
+               created_at: float) -> bytes:
+    # 字段顺序固定，重复的JSON结构可以被字典和块内压缩充分利用
+    return json.dumps({
+        "key": key,
+        "created_at": created_at,
+        "input": input_data.model_dump(),
+        "opportunities": [[getattr(item, name) for name in OPPORTUNITY_FIELDS] for item in output.opportunities],
+    }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _deserialize(line: bytes) -> ArchivedReport:
+    record = json.loads(line)
+    output = output_from_validated([dict(zip(OPPORTUNITY_FIELDS, values)) for values in record["opportunities"]])
+    return ArchivedReport(record["key"], OpportunityAnalysisInput(**record["input"]), output, record["created_at"])
+
+
+def train_dictionary(samples: Iterable[bytes], size: int = MAX_DICTIONARY_SIZE) -> bytes:
+    """
+    由样本训练预置字典
+    将样本切分为以标点结尾的片段，按 出现次数 × 长度 选出最常见的片段拼接；
+    zlib优先匹配距离较近的内容，因此最常见的片段放在字典末尾
+    :param samples: 序列化后的样本报告
+    :param size: 字典的最大字节数
+    """
+    counts: collections.Counter = collections.Counter()
+    for sample in samples:
+        text = sample.decode("utf-8")
+        counts.update(fragment for fragment in _FRAGMENT_SPLIT.split(text) if len(fragment) > 1)
+    scored = sorted(((count * len(fragment.encode("utf-8")), fragment)
+                     for fragment, count in counts.items() if count > 1), reverse=True)
+    chosen: List[bytes] = []
+    total = 0
+    for _, fragment in scored:
+        data = fragment.encode("utf-8")
+        if total + len(data) > size:
+            continue
+        chosen.append(data)
+        total += len(data)
+    return b"".join(reversed(chosen))
+
+
+def _day(created_at: float) -> str:
+    return datetime.date.fromtimestamp(created_at).isoformat()
+
+
+class ReportArchive:
+    """
+    历史报告归档
+    数据文件 path 只追加压缩块；预置字典保存在 path.dict，旁路索引保存在 path.idx（每份报告一行JSON）。
+    未指定字典且字典文件不存在时，积累到 train_samples 份报告后用这些报告训练字典，之前的块不使用字典；
+    未满的块只在 flush 或 close 时写入，读取时直接使用内存中的报告
+    """
+
+    def __init__(self, path: str, block_size: int = 32, level: int = 9, dictionary: Optional[bytes] = None,
+                 train_samples: int = 64):
+        """
+        :param path: 数据文件路径
+        :param block_size: 每个块包含的报告数，越大压缩率越高，单次查找需要解压的数据也越多
+        :param level: zlib压缩级别
+        :param dictionary: 预置字典，仅在创建新归档时使用；传入空字节串时不使用字典
+        :param train_samples: 未指定字典时，用最初多少份报告训练字典
+        """
+        self.path = path
+        self.block_size = max(1, block_size)
+        self.level = level
+        self.dictionary_path = f"{path}.dict"
+        self.index_path = f"{path}.idx"
+        self._pending: List[Tuple[str, float, bytes]] = []
+        self._entries: List[IndexEntry] = []
+        self._by_key: Dict[str, List[int]] = collections.defaultdict(list)
+        self._by_date: Dict[str, List[int]] = collections.defaultdict(list)
+        self._cached_block: Optional[Tuple[int, List[bytes]]] = None
+        self.dictionary: Optional[bytes] = None
+        self.train_samples = max(1, train_samples)
+        # 尚未训练字典时收集的样本报告
+        self._samples: List[bytes] = []
+
+        if os.path.exists(self.dictionary_path):
+            with open(self.dictionary_path, "rb") as f:
+                self.dictionary = f.read()
+        elif dictionary is not None:
+            self._save_dictionary(dictionary[-MAX_DICTIONARY_SIZE:])
+        self._load_index()
+        self._file = open(path, "r+b" if os.path.exists(path) else "w+b")
+        self._recover()
+        if self.dictionary is None:
+            # 重新打开尚未训练字典的归档时，从已写入的块中取回样本
+            for entry in self._entries[:self.train_samples]:
+                self._samples.append(self._block(entry.offset, entry.length)[entry.slot])
+
+    # ------------------------------------------------------------------
+    # 索引
+    # ------------------------------------------------------------------
+
+    def _save_dictionary(self, dictionary: bytes) -> None:
+        tmp_path = f"{self.dictionary_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(dictionary)
+        os.replace(tmp_path, self.dictionary_path)
+        self.dictionary = dictionary
+
+    def _load_index(self) -> None:
+        if not os.path.exists(self.index_path):
+            return
+        broken = False
+        with open(self.index_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = IndexEntry(*json.loads(line))
+                except (ValueError, TypeError):
+                    broken = True
+                    continue
+                self._add_entry(entry)
+        if broken:
+            # 写入中断留下了不完整的行，重写索引，避免后续追加的记录接在残行之后
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write("".join(json.dumps(list(entry), ensure_ascii=False) + "\n" for entry in self._entries))
+            os.replace(tmp_path, self.index_path)
+
+    def _add_entry(self, entry: IndexEntry) -> None:
+        position = len(self._entries)
+        self._entries.append(entry)
+        self._by_key[entry.key].append(position)
+        self._by_date[entry.date].append(position)
+
+    def _recover(self) -> None:
+        """
+        写入新归档的文件头；数据文件中索引之后的部分是写入中断留下的块，截断以保持两者一致
+        """
+        self._file.seek(0, os.SEEK_END)
+        size = self._file.tell()
+        if size == 0:
+            self._file.write(_MAGIC)
+            self._file.flush()
+            return
+        self._file.seek(0)
+        if self._file.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError(f"不是有效的报告归档文件: {self.path}")
+        end = max((entry.offset + _BLOCK_HEADER.size + entry.length for entry in self._entries), default=len(_MAGIC))
+        if size > end:
+            self._file.truncate(end)
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+
+    def append(self, input_data: OpportunityAnalysisInput, output: OpportunityAnalysisOutput,
+               created_at: Optional[float] = None) -> str:
+        """
+        追加一份报告，积累到 block_size 份时写入一个块
+        :param created_at: 生成时间（秒），默认为当前时间
+        :return: 报告的输入键
+        """
+        key = record_key(input_data)
+        created_at = created_at if created_at is not None else time.time()
+        record = _serialize(key, input_data, output, created_at)
+        self._pending.append((key, created_at, record))
+        if self.dictionary is None and len(self._samples) < self.train_samples:
+            self._samples.append(record)
+        if len(self._pending) >= self.block_size:
+            self.flush()
+        return key
+
+    def flush(self) -> None:
+        """将未满的块写入文件"""
+        if not self._pending:
+            return
+        if self.dictionary is None and len(self._samples) >= self.train_samples:
+            self._save_dictionary(train_dictionary(self._samples))
+            self._samples = []
+        if self.dictionary:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, zlib.MAX_WBITS, 9, zlib.Z_DEFAULT_STRATEGY,
+                                          self.dictionary)
+            header = 0
+        else:
+            compressor = zlib.compressobj(self.level)
+            header = _PLAIN_BLOCK
+        block = compressor.compress(b"\n".join(record for _, _, record in self._pending)) + compressor.flush()
+        self._file.seek(0, os.SEEK_END)
+        offset = self._file.tell()
+        self._file.write(_BLOCK_HEADER.pack(len(block) | header) + block)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        # 先写数据再写索引，中断时多出的块会在下次打开时截断
+        entries = [IndexEntry(key, _day(created_at), created_at, offset, len(block), slot)
+                   for slot, (key, created_at, _) in enumerate(self._pending)]
+        with open(self.index_path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(list(entry), ensure_ascii=False) + "\n" for entry in entries))
+        for entry in entries:
+            self._add_entry(entry)
+        self._pending = []
+
+    # ------------------------------------------------------------------
+    # 读取
+    # ------------------------------------------------------------------
+
+    def _block(self, offset: int, length: int) -> List[bytes]:
+        if self._cached_block is not None and self._cached_block[0] == offset:
+            return self._cached_block[1]
+        self._file.seek(offset)
+        header, = _BLOCK_HEADER.unpack(self._file.read(_BLOCK_HEADER.size))
+        data = self._file.read(length)
+        if self.dictionary and not header & _PLAIN_BLOCK:
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS, self.dictionary)
+        else:
+            decompressor = zlib.decompressobj()
+        records = (decompressor.decompress(data) + decompressor.flush()).split(b"\n")
+        self._cached_block = (offset, records)
+        return records
+
+    def _read(self, entry: IndexEntry) -> ArchivedReport:
+        return _deserialize(self._block(entry.offset, entry.length)[entry.slot])
+
+    def __len__(self) -> int:
+        return len(self._entries) + len(self._pending)
+
+    def _unflushed(self, key: Optional[str] = None) -> Iterator[Tuple[int, str, float, bytes]]:
+        """尚未写入文件的报告：(序号, 输入键, 生成时间, 序列化数据)"""
+        for position, (pending_key, created_at, record) in enumerate(self._pending):
+            if key is None or pending_key == key:
+                yield position, pending_key, created_at, record
+
+    def latest(self, input_data: OpportunityAnalysisInput) -> Optional[ArchivedReport]:
+        """某个输入组合最近一次的报告，最多解压一个块"""
+        key = record_key(input_data)
+        entries = [self._entries[p] for p in self._by_key.get(key, ())]
+        entry = max(entries, key=lambda entry: entry.created_at, default=None)
+        pending = max(self._unflushed(key), key=lambda item: item[2], default=None)
+        if pending is not None and (entry is None or pending[2] >= entry.created_at):
+            return _deserialize(pending[3])
+        return self._read(entry) if entry is not None else None
+
+    def history(self, input_data: OpportunityAnalysisInput) -> List[ArchivedReport]:
+        """某个输入组合的全部报告，按生成时间排序"""
+        key = record_key(input_data)
+        reports = [((entry.created_at, 0, entry.offset, entry.slot), entry)
+                   for entry in (self._entries[p] for p in self._by_key.get(key, ()))]
+        reports += [((created_at, 1, position, 0), record) for position, _, created_at, record in self._unflushed(key)]
+        reports.sort(key=lambda item: item[0])
+        return [_deserialize(item) if isinstance(item, bytes) else self._read(item) for _, item in reports]
+
+    def by_date(self, start: str, end: Optional[str] = None) -> Iterator[ArchivedReport]:
+        """
+        按日期范围读取报告，日期格式为 YYYY-MM-DD，包含两端
+        同一个块中的报告连续读取，每个块只解压一次
+        """
+        end = end or start
+        entries = [self._entries[p] for date, positions in self._by_date.items()
+                   if start <= date <= end for p in positions]
+        for entry in sorted(entries, key=lambda entry: (entry.offset, entry.slot)):
+            yield self._read(entry)
+        for _, _, created_at, record in list(self._unflushed()):
+            if start <= _day(created_at) <= end:
+                yield _deserialize(record)
+
+    def __iter__(self) -> Iterator[ArchivedReport]:
+        for entry in self._entries:
+            yield self._read(entry)
+        for _, _, _, record in list(self._unflushed()):
+            yield _deserialize(record)
+
+    def dates(self) -> Dict[str, int]:
+        """各日期的报告数"""
+        counts = collections.Counter({date: len(positions) for date, positions in self._by_date.items()})
+        counts.update(_day(created_at) for _, _, created_at, _ in self._unflushed())
+        return dict(sorted(counts.items()))
+
+    def storage_size(self) -> int:
+        """数据文件、字典和索引的总字节数，不含尚未写入的报告"""
+        return sum(os.path.getsize(path) for path in (self.path, self.dictionary_path, self.index_path)
+                   if os.path.exists(path))
+
+    # ------------------------------------------------------------------
+
+    def close(self) -> None:
+        """写入未满的块并关闭文件"""
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+    def __enter__(self) -> "ReportArchive":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
@@ -0,0 +1,212 @@
+"""
+商机分析结果缓存
+以SQLite存储已校验的大模型结果，键由服务商、模型和三个输入参数组成
+"""
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+
+class CacheEntry(NamedTuple):
+    """缓存条目"""
+    key: str
+    items: List[Dict[str, Any]]
+    created_at: float
+
+
+class ResultCache:
+    """
+    结果缓存
+    默认使用内存数据库；指定文件路径时使用WAL模式，可被多个进程共享
+    """
+
+    def __init__(self, path: str = ":memory:", ttl: float = 86400.0, stale_ttl: float = 0.0,
+                 access_flush_interval: float = 5.0):
+        """
+        :param path: SQLite数据库路径，":memory:" 表示仅在进程内缓存
+        :param ttl: 缓存有效期（秒），小于等于0时不使用缓存
+        :param stale_ttl: 过期后仍可返回旧结果的时长（秒），期间由调用方在后台刷新
+        :param access_flush_interval: 访问次数写入数据库的最短间隔（秒）
+        """
+        self.path = path
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.access_flush_interval = access_flush_interval
+        self._lock = threading.Lock()
+        self._access_lock = threading.Lock()
+        self._pending_access: Dict[str, Tuple[int, float]] = {}
+        self._last_flush = time.time()
+        self._flushing = False
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30.0)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY,"
+            " payload TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        # 访问统计单独建表，不影响已有的缓存文件
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS access ("
+            " key TEXT PRIMARY KEY,"
+            " hits INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    @staticmethod
+    def make_key(provider: str, model: str, construction_direction: str,
+                 customer_type: str, business_status: str) -> str:
+        """
+        生成缓存键
+        """
+        return json.dumps([provider, model, construction_direction, customer_type, business_status],
+                          ensure_ascii=False)
+
+    def get(self, key: str, allow_stale: bool = False) -> Optional[CacheEntry]:
+        """
+        查询未过期的缓存条目
+        :param allow_stale: 是否返回已过期但仍在 stale_ttl 内的条目，可用 is_stale() 判断
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, created_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+        max_age = self.ttl + self.stale_ttl if allow_stale else self.ttl
+        if row is None or time.time() - row[1] > max_age:
+            return None
+        return CacheEntry(key, json.loads(row[0]), row[1])
+
+    def is_stale(self, entry: CacheEntry) -> bool:
+        """条目是否已超过有效期"""
+        return time.time() - entry.created_at > self.ttl
+
+    def record_access(self, key: str) -> None:
+        """
+        记录一次访问，用于后台预热时挑选高频的输入组合
+        访问次数先累计在内存中，距上次写入超过 access_flush_interval 秒时由后台线程写入数据库，
+        调用方（通常在事件循环中）不会等待数据库锁
+        """
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._access_lock:
+            hits, _ = self._pending_access.get(key, (0, now))
+            self._pending_access[key] = (hits + 1, now)
+            if self._flushing or now - self._last_flush < self.access_flush_interval:
+                return
+            self._flushing = True
+        threading.Thread(target=self.flush_access, name="result-cache-access", daemon=True).start()
+
+    def flush_access(self) -> None:
+        """将内存中累计的访问次数写入数据库"""
+        with self._access_lock:
+            pending, self._pending_access = self._pending_access, {}
+            self._last_flush = time.time()
+        try:
+            if pending:
+                with self._lock:
+                    self._conn.executemany(
+                        "INSERT INTO access (key, hits, last_access) VALUES (?, ?, ?)"
+                        " ON CONFLICT(key) DO UPDATE SET hits = hits + excluded.hits,"
+                        " last_access = MAX(last_access, excluded.last_access)",
+                        [(key, hits, last_access) for key, (hits, last_access) in pending.items()]
+                    )
+        finally:
+            with self._access_lock:
+                self._flushing = False
+
+    def access_counts(self, since: Optional[float] = None) -> Dict[str, int]:
+        """
+        各缓存键的访问次数，用于按历史选择频率推测用户的下一步输入
+        :param since: 只统计此时间之后访问过的键，默认不限制
+        """
+        self.flush_access()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, hits FROM access WHERE last_access >= ?", (since or 0.0,)
+            ).fetchall()
+        return dict(rows)
+
+    def refresh_candidates(self, min_age: float, limit: int = 10,
+                           since: Optional[float] = None) -> List[Tuple[str, int, float]]:
+        """
+        挑选需要预热的缓存键：条目已存在超过min_age秒（或已被删除/过期），按访问次数乘以条目年龄排序
+        :param min_age: 条目的最小年龄（秒）
+        :param limit: 最多返回的数量
+        :param since: 只考虑此时间之后访问过的键，默认不限制
+        :return: (缓存键, 访问次数, 条目年龄) 列表，不存在的条目年龄为 inf
+        """
+        self.flush_access()
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT access.key, access.hits, results.created_at FROM access"
+                " LEFT JOIN results ON results.key = access.key"
+                " WHERE access.last_access >= ? AND (results.created_at IS NULL OR results.created_at <= ?)",
+                (since or 0.0, now - min_age)
+            ).fetchall()
+        candidates = [(key, hits, now - created_at if created_at is not None else float("inf"))
+                      for key, hits, created_at in rows]
+        # 年龄按有效期封顶，避免不存在的条目总是排在最前
+        horizon = max(self.ttl, 1.0)
+        candidates.sort(key=lambda item: item[1] * min(item[2], horizon), reverse=True)
+        return candidates[:limit]
+
+    def put(self, key: str, items: List[Dict[str, Any]], created_at: Optional[float] = None) -> None:
+        """
+        写入已校验的商机数据
+        """
+        if not self.enabled:
+            return
+        payload = json.dumps(items, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, payload, created_at) VALUES (?, ?, ?)",
+                (key, payload, created_at if created_at is not None else time.time())
+            )
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._access_lock:
+            self._pending_access.clear()
+        with self._lock:
+            self._conn.execute("DELETE FROM results")
+            self._conn.execute("DELETE FROM access")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+
+def _default_ttl() -> float:
+    """
+    全局缓存默认关闭：设置了 RESULT_CACHE_TTL 时使用该值，只设置了 RESULT_CACHE_PATH 时有效期为一天
+    """
+    value = os.getenv("RESULT_CACHE_TTL", "").strip()
+    if value:
+        return float(value)
+    return 86400.0 if os.getenv("RESULT_CACHE_PATH") else 0.0
+
+
+# 全局实例，路径和有效期可通过环境变量配置，两者都未设置时不使用缓存
+result_cache = ResultCache(
+    path=os.getenv("RESULT_CACHE_PATH", ":memory:"),
+    ttl=_default_ttl(),
+    stale_ttl=float(os.getenv("RESULT_CACHE_STALE_TTL", "604800")),
+)
+atexit.register(result_cache.flush_access)
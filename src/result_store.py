@@ -0,0 +1,376 @@
+"""
+列式结果存储
+以追加方式保存大批量商机分析结果，每个文本字段使用字典编码，输入组合和时间戳使用定长整数列，
+支持零拷贝的行视图、基于内存映射的磁盘格式，以及按公司、方向等字段的过滤和分组统计
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from collections import Counter
+from itertools import compress
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from schemas import OPPORTUNITY_FIELDS, OpportunityAnalysisInput, OpportunityAnalysisOutput, OpportunityInfo
+
+
+INPUT_FIELDS = ("construction_direction", "customer_type", "business_status")
+
+# 每一行对应一个商机，文本列全部做字典编码
+STRING_COLUMNS = INPUT_FIELDS + OPPORTUNITY_FIELDS
+
+# 定长整数列及其array类型码
+INT_COLUMNS = {
+    "combination_id": "I",  # 输入组合编号（建筑方向、客户类型、商机状态三元组）
+    "created_at": "q",      # 生成时间，毫秒时间戳
+    "position": "B",        # 在所属报告中的序号
+}
+
+_MAGIC = b"CDRSTORE"
+_PREFIX = struct.Struct("<8sQ")
+_ALIGN = 8
+
+
+class StringDictionary:
+    """字符串字典，将重复出现的字符串映射为整数编码"""
+
+    def __init__(self):
+        self.values: List[str] = []
+        self._codes: Dict[str, int] = {}
+
+    def encode(self, value: str) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def lookup(self, value: str) -> Optional[int]:
+        """查询字符串的编码，不存在时返回None"""
+        return self._codes.get(value)
+
+    def decode(self, code: int) -> str:
+        return self.values[code]
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+class _MappedDictionary:
+    """
+    内存映射的只读字符串字典
+    字符串按UTF-8拼接存储，解码时按偏移量切片，反查索引在首次使用时建立
+    """
+
+    def __init__(self, blob: memoryview, offsets: memoryview):
+        self._blob = blob
+        self._offsets = offsets
+        self._codes: Optional[Dict[str, int]] = None
+
+    def decode(self, code: int) -> str:
+        return str(self._blob[self._offsets[code]:self._offsets[code + 1]], "utf-8")
+
+    def lookup(self, value: str) -> Optional[int]:
+        if self._codes is None:
+            self._codes = {self.decode(i): i for i in range(len(self))}
+        return self._codes.get(value)
+
+    def encode(self, value: str) -> int:
+        raise TypeError("内存映射的结果存储为只读，不能追加数据")
+
+    @property
+    def values(self) -> List[str]:
+        return [self.decode(i) for i in range(len(self))]
+
+    def index_size(self) -> int:
+        """反查索引占用的内存（字节），尚未建立时为0"""
+        if self._codes is None:
+            return 0
+        return sys.getsizeof(self._codes) + sum(sys.getsizeof(value) for value in self._codes)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+
+class RowView:
+    """
+    行视图
+    只保存存储对象和行号，访问字段时才解码，不复制任何数据
+    """
+    __slots__ = ("_store", "_index")
+
+    def __init__(self, store: "ColumnarResultStore", index: int):
+        self._store = store
+        self._index = index
+
+    def __getattr__(self, name: str) -> Any:
+        return self._store.value(name, self._index)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: self._store.value(name, self._index) for name in self._store.columns}
+
+    def to_model(self) -> OpportunityInfo:
+        """转换为pydantic模型"""
+        return OpportunityInfo(**{name: self._store.value(name, self._index) for name in OPPORTUNITY_FIELDS})
+
+    def __repr__(self) -> str:
+        return f"RowView({self._index}, company_name={self.company_name!r})"
+
+
+class ColumnarResultStore:
+    """
+    列式结果存储
+    内存中创建的实例支持追加；通过 open() 打开的磁盘文件为只读，列数据直接映射自文件
+    """
+
+    columns = STRING_COLUMNS + tuple(INT_COLUMNS)
+
+    def __init__(self):
+        self._strings: Dict[str, Union[StringDictionary, _MappedDictionary]] = {
+            name: StringDictionary() for name in STRING_COLUMNS
+        }
+        self._codes: Dict[str, Sequence[int]] = {name: array("I") for name in STRING_COLUMNS}
+        self._ints: Dict[str, Sequence[int]] = {name: array(code) for name, code in INT_COLUMNS.items()}
+        self._combinations: Dict[Tuple[str, str, str], int] = {}
+        self._mmap: Optional[mmap.mmap] = None
+        self._file = None
+        self._rows = 0
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+
+    def append(self, input_data: OpportunityAnalysisInput, output: OpportunityAnalysisOutput,
+               created_at: Optional[float] = None) -> None:
+        """
+        追加一份分析报告，每个商机占一行
+        :param input_data: 分析输入参数
+        :param output: 分析结果
+        :param created_at: 生成时间（秒），默认为当前时间
+        """
+        combination = (input_data.construction_direction, input_data.customer_type, input_data.business_status)
+        timestamp = int((created_at if created_at is not None else time.time()) * 1000)
+        for position, opportunity in enumerate(output.opportunities):
+            self.append_row(combination, opportunity.model_dump(), timestamp, position)
+
+    def append_row(self, combination: Tuple[str, str, str], opportunity: Dict[str, str],
+                   created_at_ms: int, position: int = 0) -> None:
+        """
+        追加单个商机
+        """
+        if self._mmap is not None:
+            raise TypeError("内存映射的结果存储为只读，不能追加数据")
+        combination_id = self._combinations.get(combination)
+        if combination_id is None:
+            combination_id = self._combinations[combination] = len(self._combinations)
+        for name, value in zip(INPUT_FIELDS, combination):
+            self._codes[name].append(self._strings[name].encode(value))
+        for name in OPPORTUNITY_FIELDS:
+            self._codes[name].append(self._strings[name].encode(opportunity[name]))
+        self._ints["combination_id"].append(combination_id)
+        self._ints["created_at"].append(created_at_ms)
+        self._ints["position"].append(position)
+        self._rows += 1
+
+    # ------------------------------------------------------------------
+    # 读取
+    # ------------------------------------------------------------------
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def __getitem__(self, index: int) -> RowView:
+        if index < 0:
+            index += self._rows
+        if not 0 <= index < self._rows:
+            raise IndexError(index)
+        return RowView(self, index)
+
+    def __iter__(self) -> Iterator[RowView]:
+        return (RowView(self, i) for i in range(self._rows))
+
+    def value(self, name: str, index: int) -> Any:
+        """读取单个单元格"""
+        if name in self._ints:
+            return self._ints[name][index]
+        if name in self._codes:
+            return self._strings[name].decode(self._codes[name][index])
+        raise AttributeError(name)
+
+    def column(self, name: str) -> Sequence[int]:
+        """
+        获取原始列数据：文本列返回字典编码，整数列返回数值，均不复制
+        """
+        return self._codes[name] if name in self._codes else self._ints[name]
+
+    def dictionary(self, name: str) -> List[str]:
+        """获取文本列的字典（按编码顺序）"""
+        return self._strings[name].values
+
+    def filter(self, **conditions: str) -> List[int]:
+        """
+        按文本列取值过滤，多个条件之间为“且”关系
+        例如 store.filter(company_name="中建八局", construction_direction="市政工程")
+        :return: 满足条件的行号列表
+        """
+        selected: Optional[List[int]] = None
+        for name, value in conditions.items():
+            if name not in self._codes:
+                raise ValueError(f"只能按文本列过滤，{name} 不是文本列")
+            code = self._strings[name].lookup(value)
+            if code is None:
+                return []
+            candidates = selected if selected is not None else range(self._rows)
+            codes = self._codes[name]
+            if selected is None:
+                selected = list(compress(candidates, map(code.__eq__, codes)))
+            else:
+                selected = [i for i in candidates if codes[i] == code]
+        return selected if selected is not None else list(range(self._rows))
+
+    def rows(self, indices: Sequence[int]) -> List[RowView]:
+        return [RowView(self, i) for i in indices]
+
+    def group_count(self, name: str) -> Dict[str, int]:
+        """
+        按文本列分组计数，计数在编码上完成，只解码分组键
+        """
+        counts = Counter(self._codes[name])
+        dictionary = self._strings[name]
+        return {dictionary.decode(code): count for code, count in counts.most_common()}
+
+    def combinations(self) -> List[Tuple[str, str, str]]:
+        """按编号顺序返回所有输入组合"""
+        return sorted(self._combinations, key=self._combinations.__getitem__)
+
+    # ------------------------------------------------------------------
+    # 磁盘格式
+    # ------------------------------------------------------------------
+
+    def save(self, path: str) -> None:
+        """
+        保存为可内存映射的文件
+        文件结构：8字节魔数 + 8字节头部长度 + JSON头部（8字节对齐）+ 各数据段（8字节对齐）
+        """
+        sections: List[Tuple[str, bytes]] = []
+        header: Dict[str, Any] = {
+            "version": 1,
+            "rows": self._rows,
+            "byteorder": sys.byteorder,
+            "combinations": [list(c) for c in self.combinations()],
+            "ints": {},
+            "strings": {},
+        }
+        for name, typecode in INT_COLUMNS.items():
+            header["ints"][name] = {"typecode": typecode, "section": len(sections)}
+            sections.append((name, array(typecode, self._ints[name]).tobytes()))
+        for name in STRING_COLUMNS:
+            encoded = [value.encode("utf-8") for value in self._strings[name].values]
+            offsets = array("Q", [0])
+            for item in encoded:
+                offsets.append(offsets[-1] + len(item))
+            header["strings"][name] = {"codes": len(sections), "offsets": len(sections) + 1, "blob": len(sections) + 2}
+            sections.append((f"{name}.codes", array("I", self._codes[name]).tobytes()))
+            sections.append((f"{name}.offsets", offsets.tobytes()))
+            sections.append((f"{name}.blob", b"".join(encoded)))
+
+        layout = []
+        position = 0
+        for _, data in sections:
+            layout.append([position, len(data)])
+            position += _padded(len(data))
+        header["sections"] = layout
+        header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(_PREFIX.pack(_MAGIC, len(header_bytes)))
+            file.write(header_bytes + b"\0" * (_padded(len(header_bytes)) - len(header_bytes)))
+            for _, data in sections:
+                file.write(data)
+                file.write(b"\0" * (_padded(len(data)) - len(data)))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def open(cls, path: str) -> "ColumnarResultStore":
+        """
+        以内存映射方式只读打开结果文件，列数据不会被读入内存
+        """
+        file = open(path, "rb")
+        try:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            file.close()
+            raise ValueError(f"结果文件为空: {path}")
+        magic, header_length = _PREFIX.unpack_from(mapped, 0)
+        if magic != _MAGIC:
+            mapped.close()
+            file.close()
+            raise ValueError(f"不是有效的结果存储文件: {path}")
+        header = json.loads(bytes(mapped[_PREFIX.size:_PREFIX.size + header_length]).decode("utf-8"))
+        if header["byteorder"] != sys.byteorder:
+            mapped.close()
+            file.close()
+            raise ValueError("结果文件的字节序与当前平台不一致")
+
+        data_start = _PREFIX.size + _padded(header_length)
+        view = memoryview(mapped)
+
+        def section(index: int) -> memoryview:
+            offset, length = header["sections"][index]
+            return view[data_start + offset:data_start + offset + length]
+
+        store = cls.__new__(cls)
+        store._mmap = mapped
+        store._file = file
+        store._rows = header["rows"]
+        store._combinations = {tuple(c): i for i, c in enumerate(header["combinations"])}
+        store._ints = {
+            name: section(meta["section"]).cast(meta["typecode"]) for name, meta in header["ints"].items()
+        }
+        store._codes = {}
+        store._strings = {}
+        for name, meta in header["strings"].items():
+            store._codes[name] = section(meta["codes"]).cast("I")
+            store._strings[name] = _MappedDictionary(section(meta["blob"]), section(meta["offsets"]).cast("Q"))
+        return store
+
+    def close(self) -> None:
+        """关闭内存映射文件"""
+        if self._mmap is None:
+            return
+        self._ints = {}
+        self._codes = {}
+        self._strings = {}
+        try:
+            self._mmap.close()
+        except BufferError:
+            # 仍有行视图或列数据引用映射内存时，由垃圾回收负责释放
+            pass
+        self._file.close()
+        self._mmap = None
+
+    def __enter__(self) -> "ColumnarResultStore":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def memory_usage(self) -> int:
+        """
+        估算内存占用（字节），内存映射打开的存储只统计已建立的反查索引
+        """
+        if self._mmap is not None:
+            return sum(dictionary.index_size() for dictionary in self._strings.values())
+        total = sum(col.itemsize * len(col) for col in self._codes.values())
+        total += sum(col.itemsize * len(col) for col in self._ints.values())
+        for dictionary in self._strings.values():
+            total += sum(sys.getsizeof(value) for value in dictionary.values)
+        return total
+
+
+def _padded(length: int) -> int:
+    return (length + _ALIGN - 1) // _ALIGN * _ALIGN
@@ -0,0 +1,204 @@
+"""
+商机分析数据模型
+定义输入输出模型，并基于 config.json 中的输出约束提供批量校验的快速路径
+"""
+import json
+import os
+from typing import Any, Dict, Iterable, List
+
+from pydantic import BaseModel, Field, TypeAdapter
+from typing_extensions import TypedDict
+
+from entity_index import dedupe_opportunities
+
+
+class OpportunityAnalysisInput(BaseModel):
+    """商机分析输入参数"""
+    construction_direction: str = Field(
+        ...,
+        description="建筑方向，可选值：结构工程、岩土工程、桥梁与隧道工程、道路与铁道工程、市政工程、水利工程，或自定义内容"
+    )
+    customer_type: str = Field(
+        ...,
+        description="客户类型，可选值：行政机关、事业单位、央企、国企、上市公司、民营企业，或自定义内容"
+    )
+    business_status: str = Field(
+        ...,
+        description="商机状态，可选值：意向阶段、争夺阶段、竞标阶段、废标重启、成果扩大，或自定义内容"
+    )
+
+
+class OpportunityInfo(BaseModel):
+    """单个商机信息"""
+    company_name: str = Field(..., description="公司名称")
+    project_info: str = Field(..., description="项目信息，50字以内")
+    proof_info: str = Field(..., description="证明信息，包括网站公告、招标信息等，255字以内")
+    inferred_info: str = Field(..., description="基于网络信息推断的商机信息，255字以内")
+    marketing_plan: str = Field(..., description="营销方案，255字以内")
+
+
+class OpportunityAnalysisOutput(BaseModel):
+    """商机分析输出结果"""
+    opportunities: List[OpportunityInfo] = Field(..., description="商机列表，包含5个客户或潜在客户的信息")
+
+
+OPPORTUNITY_FIELDS = ("company_name", "project_info", "proof_info", "inferred_info", "marketing_plan")
+
+# 大模型结果缺失字段时使用的默认值
+OPPORTUNITY_DEFAULTS = {
+    "company_name": "未知公司",
+    "project_info": "暂无项目信息",
+    "proof_info": "暂无证明信息",
+    "inferred_info": "暂无推断信息",
+    "marketing_plan": "暂无营销方案",
+}
+
+
+def _load_skill_schema() -> Dict[str, Any]:
+    """
+    从 config.json 中读取输入选项，以及输出的字段长度和商机数量约束
+    """
+    config_path = os.path.join(os.path.dirname(__file__), '..', 'config.json')
+    with open(config_path, 'r', encoding='utf-8') as file:
+        config = json.load(file)
+    inputs = config["input_schema"]["properties"]
+    schema = config["output_schema"]["properties"]["opportunities"]
+    properties = schema["items"]["properties"]
+    return {
+        "options": {
+            name: [value for value in prop.get("enum", []) if value != "自定义"]
+            for name, prop in inputs.items()
+        },
+        "max_lengths": {
+            name: prop["maxLength"] for name, prop in properties.items() if "maxLength" in prop
+        },
+        "min_items": schema.get("minItems", 5),
+        "max_items": schema.get("maxItems", 5),
+    }
+
+
+_SKILL_SCHEMA = _load_skill_schema()
+FIELD_MAX_LENGTHS: Dict[str, int] = _SKILL_SCHEMA["max_lengths"]
+MIN_OPPORTUNITIES: int = _SKILL_SCHEMA["min_items"]
+MAX_OPPORTUNITIES: int = _SKILL_SCHEMA["max_items"]
+
+# 预设的输入选项（不含“自定义”）
+CONSTRUCTION_DIRECTIONS: List[str] = _SKILL_SCHEMA["options"]["construction_direction"]
+CUSTOMER_TYPES: List[str] = _SKILL_SCHEMA["options"]["customer_type"]
+BUSINESS_STATUSES: List[str] = _SKILL_SCHEMA["options"]["business_status"]
+
+# 缓存的校验器，整个列表在pydantic-core中一次完成校验
+_OUTPUT_ADAPTER = TypeAdapter(OpportunityAnalysisOutput)
+_OPPORTUNITY_LIST_ADAPTER = TypeAdapter(List[OpportunityInfo])
+
+
+def truncate_text(value: str, limit: int) -> str:
+    """
+    将文本截断到 limit 个字符以内
+    截断位置落在【】包裹的网址中间时，整个网址一起去掉，避免留下无法访问的半截链接
+    """
+    if len(value) <= limit:
+        return value
+    truncated = value[:limit]
+    start = truncated.rfind("【")
+    if start != -1 and truncated.find("】", start) == -1:
+        truncated = truncated[:start].rstrip()
+    return truncated
+
+
+def normalize_opportunity(item: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    补全缺失字段并按 config.json 的 maxLength 截断超长文本
+    """
+    merged = {**OPPORTUNITY_DEFAULTS, **item}
+    for name, limit in FIELD_MAX_LENGTHS.items():
+        value = merged[name]
+        if isinstance(value, str) and len(value) > limit:
+            merged[name] = truncate_text(value, limit)
+    return merged
+
+
+def validate_output(items: List[Dict[str, Any]]) -> OpportunityAnalysisOutput:
+    """
+    将大模型解析结果转换为输出模型
+    先去掉重复的公司，再取前 MAX_OPPORTUNITIES 个结果，整体一次校验；
+    去重后可能少于 MIN_OPPORTUNITIES 个，由调用方判断结果是否可用
+    """
+    items = dedupe_opportunities(items)
+    return _OUTPUT_ADAPTER.validate_python(
+        {"opportunities": [normalize_opportunity(item) for item in items[:MAX_OPPORTUNITIES]]}
+    )
+
+
+def output_from_validated(items: List[Dict[str, Any]]) -> OpportunityAnalysisOutput:
+    """
+    由已校验过的数据（如缓存中的结果）构造输出模型，跳过补全和截断
+    """
+    return _OUTPUT_ADAPTER.validate_python({"opportunities": items})
+
+
+def validate_opportunities(items: Iterable[Dict[str, Any]]) -> List[OpportunityInfo]:
+    """
+    批量校验任意数量的商机数据，用于批处理流水线
+    """
+    return _OPPORTUNITY_LIST_ADAPTER.validate_python([normalize_opportunity(item) for item in items])
+
+
+class _OpportunityDict(TypedDict):
+    company_name: str
+    project_info: str
+    proof_info: str
+    inferred_info: str
+    marketing_plan: str
+
+
+_RECORD_LIST_ADAPTER = TypeAdapter(List[_OpportunityDict])
+
+
+class OpportunityRecord:
+    """
+    轻量商机记录
+    使用__slots__存储，供批量内部流水线使用，只在对外返回时转换为pydantic模型
+    """
+    __slots__ = OPPORTUNITY_FIELDS
+
+    def __init__(self, company_name: str, project_info: str, proof_info: str,
+                 inferred_info: str, marketing_plan: str):
+        self.company_name = company_name
+        self.project_info = project_info
+        self.proof_info = proof_info
+        self.inferred_info = inferred_info
+        self.marketing_plan = marketing_plan
+
+    def __repr__(self) -> str:
+        return f"OpportunityRecord(company_name={self.company_name!r})"
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, OpportunityRecord):
+            return NotImplemented
+        return self.as_tuple() == other.as_tuple()
+
+    def as_tuple(self) -> tuple:
+        return (self.company_name, self.project_info, self.proof_info, self.inferred_info, self.marketing_plan)
+
+    def as_dict(self) -> Dict[str, str]:
+        return dict(zip(OPPORTUNITY_FIELDS, self.as_tuple()))
+
+    def to_model(self) -> OpportunityInfo:
+        """转换为pydantic模型"""
+        return OpportunityInfo(**self.as_dict())
+
+
+def validate_records(items: Iterable[Dict[str, Any]]) -> List[OpportunityRecord]:
+    """
+    批量校验并转换为轻量记录
+    """
+    validated = _RECORD_LIST_ADAPTER.validate_python([normalize_opportunity(item) for item in items])
+    return [OpportunityRecord(**item) for item in validated]
+
+
+def records_to_output(records: List[OpportunityRecord]) -> OpportunityAnalysisOutput:
+    """
+    将轻量记录转换为对外的输出模型
+    """
+    return output_from_validated([record.as_dict() for record in records])
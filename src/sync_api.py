@@ -0,0 +1,196 @@
+"""
+同步调用接口
+为Django视图、Excel插件等同步宿主提供线程安全的分析接口。所有调用提交到同一个常驻后台线程中的事件循环，
+连接池、限流器和缓存在多次调用之间共享，不必每次 asyncio.run 重建事件循环和连接
+"""
+import asyncio
+import atexit
+import concurrent.futures
+import os
+import threading
+from typing import Any, Awaitable, Dict, Iterable, List, Optional, Union
+
+from core import analyze_opportunities
+from fair_scheduler import current_request_class, current_tenant, request_context
+from llm_client import opportunity_generator
+from metrics import get_logger
+from prefetch import Speculation, prefetcher
+from schemas import OpportunityAnalysisInput, OpportunityAnalysisOutput
+
+
+logger = get_logger("sync_api")
+
+InputLike = Union[OpportunityAnalysisInput, Dict[str, Any]]
+
+
+class BackgroundLoop:
+    """
+    常驻后台事件循环
+    首次提交任务时在守护线程中启动，进程fork后会在子进程中重新启动
+    """
+
+    def __init__(self, name: str = "opportunity-event-loop"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    @property
+    def running(self) -> bool:
+        return (self._thread is not None and self._thread.is_alive()
+                and self._pid == os.getpid())
+
+    def _run(self, loop: asyncio.AbstractEventLoop, started: threading.Event) -> None:
+        asyncio.set_event_loop(loop)
+        loop.call_soon(started.set)
+        loop.run_forever()
+
+    def start(self) -> asyncio.AbstractEventLoop:
+        """启动后台事件循环（已启动时直接返回）"""
+        with self._lock:
+            if not self.running:
+                loop = asyncio.new_event_loop()
+                started = threading.Event()
+                thread = threading.Thread(target=self._run, args=(loop, started), name=self.name, daemon=True)
+                thread.start()
+                started.wait()
+                self._loop, self._thread, self._pid = loop, thread, os.getpid()
+            return self._loop
+
+    def check_caller(self, *coros: Awaitable) -> asyncio.AbstractEventLoop:
+        """
+        启动后台事件循环，并确认调用方不在该循环内部（否则同步等待会死锁），此时关闭传入的协程并抛出异常
+        """
+        loop = self.start()
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            for coro in coros:
+                coro.close()
+            raise RuntimeError("不能在后台事件循环内部调用同步接口，请直接 await 对应的异步函数")
+        return loop
+
+    def submit(self, coro: Awaitable) -> "concurrent.futures.Future":
+        """
+        提交协程，立即返回 concurrent.futures.Future
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.check_caller(coro))
+
+    def run(self, coro: Awaitable, timeout: Optional[float] = None) -> Any:
+        """
+        提交协程并阻塞等待结果
+        :param timeout: 超时时间（秒），超时后取消任务并抛出 TimeoutError
+        """
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"分析超时（{timeout}秒）")
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """
+        关闭连接池并停止后台事件循环，之后再次调用会重新启动
+        """
+        with self._lock:
+            if not self.running:
+                self._loop = self._thread = self._pid = None
+                return
+            loop, thread = self._loop, self._thread
+            try:
+                asyncio.run_coroutine_threadsafe(_shutdown(), loop).result(timeout)
+            except Exception as e:
+                logger.warning("关闭后台事件循环时出错: %s", e)
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout)
+            if not thread.is_alive():
+                loop.close()
+            self._loop = self._thread = self._pid = None
+
+
+async def _shutdown() -> None:
+    """取消后台循环中剩余的任务并关闭HTTP连接池"""
+    current = asyncio.current_task()
+    tasks = [task for task in asyncio.all_tasks() if task is not current]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await opportunity_generator.llm_client.aclose()
+
+
+async def _in_context(coro: Awaitable, tenant: str, request_class: str) -> Any:
+    """后台循环中的任务不继承调用线程的上下文，在任务内恢复调用方的租户和请求类别"""
+    with request_context(tenant=tenant, request_class=request_class):
+        return await coro
+
+
+def _submit_in_context(coro: Awaitable, timeout: Optional[float]) -> Any:
+    background_loop.check_caller(coro)
+    return background_loop.run(_in_context(coro, current_tenant(), current_request_class()), timeout)
+
+
+def _as_input(input_data: InputLike) -> OpportunityAnalysisInput:
+    if isinstance(input_data, OpportunityAnalysisInput):
+        return input_data
+    return OpportunityAnalysisInput(**input_data)
+
+
+def analyze_opportunities_sync(input_data: InputLike, use_mock_data: bool = True,
+                               profile: Optional[float] = None,
+                               timeout: Optional[float] = None) -> OpportunityAnalysisOutput:
+    """
+    同步分析建筑行业新商机，可在任意线程中调用；调用线程中用 request_context 设置的租户和请求类别同样生效
+    :param input_data: 分析输入参数，也可以是包含三个字段的字典
+    :param use_mock_data: 大模型调用失败时是否允许使用模拟数据
+    :param profile: 本次请求的剖析采样率，同 analyze_opportunities
+    :param timeout: 超时时间（秒）
+    """
+    return _submit_in_context(
+        analyze_opportunities(_as_input(input_data), use_mock_data=use_mock_data, profile=profile),
+        timeout
+    )
+
+
+async def _analyze_batch(inputs: List[OpportunityAnalysisInput], concurrency: int,
+                         use_mock_data: bool, return_exceptions: bool) -> List[Any]:
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def analyze(input_data: OpportunityAnalysisInput) -> OpportunityAnalysisOutput:
+        async with semaphore:
+            return await analyze_opportunities(input_data, use_mock_data=use_mock_data)
+
+    return await asyncio.gather(*(analyze(input_data) for input_data in inputs),
+                                return_exceptions=return_exceptions)
+
+
+def analyze_opportunities_batch_sync(inputs: Iterable[InputLike], concurrency: int = 4,
+                                     use_mock_data: bool = True, return_exceptions: bool = False,
+                                     timeout: Optional[float] = None) -> List[Any]:
+    """
+    同步并发分析多组输入，结果顺序与输入一致
+    :param concurrency: 同时进行的分析数
+    :param return_exceptions: 为True时单个分析失败以异常对象作为结果，否则抛出第一个异常
+    :param timeout: 整批的超时时间（秒）
+    """
+    items = [_as_input(input_data) for input_data in inputs]
+    return _submit_in_context(_analyze_batch(items, concurrency, use_mock_data, return_exceptions), timeout)
+
+
+async def _speculate(construction_direction: str, customer_type: str) -> Speculation:
+    return await prefetcher.speculate(construction_direction, customer_type)
+
+
+def speculate_sync(construction_direction: str, customer_type: str) -> Speculation:
+    """
+    施工方向和客户类型确定后，在后台事件循环中为最可能的商机状态开始预取，立即返回
+    用户选定商机状态后调用返回对象的 resolve 取消未猜中的预取
+    """
+    return _submit_in_context(_speculate(construction_direction, customer_type), None)
+
+
+# 全局实例
+background_loop = BackgroundLoop()
+atexit.register(background_loop.stop)
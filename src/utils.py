@@ -1,26 +1,90 @@
 """
 工具模块，提供网络搜索和信息验证功能
 """
+import asyncio
 import re
-from typing import List, Dict, Optional
+import socket
+from typing import Iterable, List, Dict, Optional
 import aiohttp
 from urllib.parse import urljoin, urlparse
 
 
+# 联网验证链接的结果
+URL_OK = "ok"
+# 主机存在但页面无效（非200状态码），不能说明域名是编造的
+URL_PAGE_ERROR = "page_error"
+# 域名无法解析或连接被拒绝，主机本身不存在
+URL_HOST_ERROR = "host_error"
+# 超时等可能只是暂时的错误
+URL_UNREACHABLE = "unreachable"
+
+
 class WebSearcher:
     """网络搜索工具类"""
     
     @staticmethod
-    async def validate_url(url: str) -> bool:
+    async def probe_url(url: str) -> str:
         """
-        验证URL是否有效
+        联网验证URL并区分失败原因
+        :return: URL_OK、URL_PAGE_ERROR、URL_HOST_ERROR 或 URL_UNREACHABLE
         """
         try:
             async with aiohttp.ClientSession() as session:
                 async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                    return response.status == 200
+                    return URL_OK if response.status == 200 else URL_PAGE_ERROR
+        except aiohttp.ClientConnectorError as e:
+            if isinstance(e.os_error, (socket.gaierror, ConnectionRefusedError)):
+                return URL_HOST_ERROR
+            return URL_UNREACHABLE
         except Exception:
-            return False
+            return URL_UNREACHABLE
+
+    @staticmethod
+    async def validate_url(url: str) -> bool:
+        """
+        验证URL是否有效
+        """
+        return await WebSearcher.probe_url(url) == URL_OK
+
+    @staticmethod
+    async def validate_urls(urls: Iterable[str], index=None, concurrency: int = 8) -> Dict[str, bool]:
+        """
+        批量验证URL
+        先用域名信誉索引筛选，可信和可疑的链接直接给出结论，只有未知的链接联网验证。
+        验证成功的域名写回索引；只有域名无法解析或连接被拒绝时才记为失败，
+        页面不存在、超时等不代表域名是编造的，不写入索引，下次仍会联网验证
+        :param index: 域名信誉索引，默认为全局实例
+        :param concurrency: 同时进行的联网验证数
+        """
+        from domain_index import TRUSTED, UNKNOWN, domain_index
+        from metrics import metrics
+
+        index = index if index is not None else domain_index
+        urls = list(dict.fromkeys(urls))
+        results: Dict[str, bool] = {}
+        unknown: List[str] = []
+        for url in urls:
+            verdict = index.classify(url)
+            metrics.inc("llm_url_screen_total", verdict=verdict)
+            if verdict == UNKNOWN:
+                unknown.append(url)
+            else:
+                results[url] = verdict == TRUSTED
+
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        outcomes: Dict[str, str] = {}
+
+        async def check(url: str) -> None:
+            async with semaphore:
+                outcomes[url] = await WebSearcher.probe_url(url)
+                results[url] = outcomes[url] == URL_OK
+
+        await asyncio.gather(*(check(url) for url in unknown))
+        recorded = [(url, outcomes[url] == URL_OK) for url in unknown if outcomes[url] in (URL_OK, URL_HOST_ERROR)]
+        if recorded:
+            index.record_many(recorded)
+        return {url: results[url] for url in urls}
     
     @staticmethod
     async def extract_key_info_from_text(text: str) -> Dict[str, List[str]]:
@@ -100,6 +164,16 @@ TENDER_SITES = [
     "https://www.zhaobiao.cn/"    # 招标网
 ]
 
+# 施工方向对应的检索关键词，同时作为依赖跟踪和招标公告打标签使用的分类标签
+DIRECTION_KEYWORDS = {
+    "结构工程": ["建筑工程", "高层建筑", "工业厂房"],
+    "岩土工程": ["地基基础", "地下空间", "边坡治理"],
+    "桥梁与隧道工程": ["桥梁建设", "隧道工程", "跨海工程"],
+    "道路与铁道工程": ["高速公路", "城市道路", "铁路建设"],
+    "市政工程": ["市政建设", "基础设施", "管网改造"],
+    "水利工程": ["水库建设", "引水工程", "防洪治理"]
+}
+
 ENTERPRISE_SITES = [
     "http://www.sse.com.cn/",     # 上交所
     "http://www.szse.cn/",        # 深交所
@@ -0,0 +1,169 @@
+"""
+测试服务商离线批量任务
+使用 httpx.MockTransport 在本地模拟 /files 和 /batches 接口
+"""
+import asyncio
+import itertools
+import json
+import os
+import sys
+
+import httpx
+
+# 添加src目录到Python路径，以便能够导入模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from batch_jobs import BatchJobClient
+from core import analyze_opportunities, grid_inputs
+from llm_client import ConstructionOpportunityGenerator
+from result_cache import ResultCache
+
+
+class FakeBatchService:
+    """本地模拟的批量任务服务，查询两次后完成；custom_id 在 failed_ids 中的请求返回错误"""
+
+    def __init__(self, failed_ids=()):
+        self.files = {}
+        self.batches = {}
+        self.polls = 0
+        self.failed_ids = set(failed_ids)
+        self._ids = itertools.count(1)
+
+    def _result_line(self, request):
+        if request["custom_id"] in self.failed_ids:
+            return {"custom_id": request["custom_id"], "response": {"status_code": 500, "body": {}}}
+        opportunities = [
+            {
+                "company_name": f"批量公司{index}",
+                "project_info": "批量项目",
+                "proof_info": "批量证明",
+                "inferred_info": "批量推断",
+                "marketing_plan": "批量方案",
+            }
+            for index in range(5)
+        ]
+        content = json.dumps({"opportunities": opportunities}, ensure_ascii=False)
+        return {"custom_id": request["custom_id"], "response": {
+            "status_code": 200, "body": {"choices": [{"message": {"content": content}}]}
+        }}
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if request.method == "POST" and path.endswith("/files"):
+            body = request.read()
+            start = body.index(b"\r\n\r\n", body.index(b'name="file"')) + 4
+            content = body[start:body.index(b"\r\n--", start)]
+            file_id = f"file-{next(self._ids)}"
+            self.files[file_id] = content
+            return httpx.Response(200, json={"id": file_id})
+        if request.method == "POST" and path.endswith("/batches"):
+            payload = json.loads(request.read())
+            batch_id = f"batch-{next(self._ids)}"
+            self.batches[batch_id] = {"id": batch_id, "status": "in_progress",
+                                      "input_file_id": payload["input_file_id"]}
+            return httpx.Response(200, json=self.batches[batch_id])
+        if request.method == "GET" and "/batches/" in path:
+            batch = self.batches[path.rsplit("/", 1)[-1]]
+            self.polls += 1
+            if self.polls >= 2 and batch["status"] != "completed":
+                lines = [json.loads(line) for line in self.files[batch["input_file_id"]].splitlines()]
+                output = "\n".join(json.dumps(self._result_line(line), ensure_ascii=False) for line in lines)
+                output_id = f"file-{next(self._ids)}"
+                self.files[output_id] = output.encode("utf-8")
+                batch.update(status="completed", output_file_id=output_id)
+            return httpx.Response(200, json=batch)
+        if request.method == "GET" and path.endswith("/content"):
+            return httpx.Response(200, content=self.files[path.split("/")[-2]])
+        return httpx.Response(404)
+
+
+def _run_batch(service, inputs, cache):
+    generator = ConstructionOpportunityGenerator()
+    generator.llm_client.config = dict(generator.llm_client.config, api_key="test-key")
+    client = BatchJobClient(generator=generator, cache=cache)
+
+    async def run():
+        generator.llm_client._http_clients[asyncio.get_running_loop()] = httpx.AsyncClient(
+            transport=httpx.MockTransport(service.handler))
+        try:
+            return await client.run(inputs, poll_interval=0.01)
+        finally:
+            await generator.llm_client.aclose()
+
+    return asyncio.run(run()), generator
+
+
+def test_batch_job_fills_cache():
+    """批量任务结果解析后写入缓存"""
+    inputs = list(grid_inputs(["市政工程"], ["国企", "央企"]))
+    cache = ResultCache()
+    service = FakeBatchService()
+    summary, generator = _run_batch(service, inputs, cache)
+    assert summary["status"] == "completed"
+    assert summary["ok"] == len(inputs) and summary["failed"] == 0
+    assert service.polls == 2
+    assert len(cache) == len(inputs)
+
+    labels = generator.llm_client.metric_labels()
+    entry = cache.get(cache.make_key(labels["provider"], labels["model"], "市政工程", "国企", "意向阶段"))
+    assert entry is not None
+    assert entry.items[0]["company_name"] == "批量公司0"
+
+
+def test_batch_job_counts_failures():
+    """出错的请求记为失败，不写入缓存"""
+    from batch_runner import record_key
+    inputs = list(grid_inputs(["水利工程"], ["国企"]))
+    service = FakeBatchService(failed_ids={record_key(inputs[0])})
+    cache = ResultCache()
+    summary, _ = _run_batch(service, inputs, cache)
+    assert summary["ok"] == len(inputs) - 1
+    assert summary["failed"] == 1
+    assert len(cache) == len(inputs) - 1
+
+
+def test_disabled_cache_rejected_before_submit():
+    """结果缓存关闭时不提交批量任务"""
+    from batch_jobs import BatchJobError
+    inputs = list(grid_inputs(["市政工程"], ["国企"]))
+    service = FakeBatchService()
+    try:
+        _run_batch(service, inputs, ResultCache(ttl=0))
+        assert False, "缓存关闭时应拒绝提交"
+    except BatchJobError:
+        pass
+    assert not service.files
+
+
+def test_precomputed_results_served_from_cache():
+    """写入全局缓存后，在线分析直接命中，不再调用大模型"""
+    import result_cache as result_cache_module
+    from llm_client import opportunity_generator
+    from schemas import OpportunityAnalysisInput
+
+    inputs = [OpportunityAnalysisInput(construction_direction="岩土工程", customer_type="国企",
+                                       business_status="意向阶段")]
+    cache = result_cache_module.result_cache
+    # 全局缓存默认关闭，测试中临时开启
+    original_ttl, cache.ttl = cache.ttl, 86400.0
+    cache.clear()
+    summary, _ = _run_batch(FakeBatchService(), inputs, cache)
+    assert summary["ok"] == 1
+
+    original_key = opportunity_generator.llm_client.config["api_key"]
+    opportunity_generator.llm_client.config["api_key"] = ""
+    try:
+        output = asyncio.run(analyze_opportunities(inputs[0], use_mock_data=False))
+    finally:
+        opportunity_generator.llm_client.config["api_key"] = original_key
+        cache.clear()
+        cache.ttl = original_ttl
+    assert output.opportunities[0].company_name == "批量公司0"
+
+
+if __name__ == "__main__":
+    test_batch_job_fills_cache()
+    test_batch_job_counts_failures()
+    test_disabled_cache_rejected_before_submit()
+    test_precomputed_results_served_from_cache()
+    print("批量任务测试完成!")
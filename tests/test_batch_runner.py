@@ -0,0 +1,141 @@
+"""
+测试分片批处理
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+
+# 添加src目录到Python路径，以便能够导入模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from batch_runner import (
+    ProgressLog, _collect_results, _run_worker_async, assign, merge_parts, merge_shards, parse_shard,
+    read_records, record_key, shard_path,
+)
+from core import grid_inputs
+from llm_client import opportunity_generator
+from result_cache import result_cache
+
+SHARD_COUNT = 2
+WORKER_COUNT = 2
+
+
+async def _fake_call_llm(messages, temperature=0.7, **kwargs):
+    """返回固定的5个商机，不依赖网络"""
+    return json.dumps({"opportunities": [
+        {
+            "company_name": f"测试公司{index}",
+            "project_info": "测试项目",
+            "proof_info": "测试证明",
+            "inferred_info": "测试推断",
+            "marketing_plan": "测试方案",
+        }
+        for index in range(5)
+    ]}, ensure_ascii=False)
+
+
+def _write_inputs(path):
+    inputs = list(grid_inputs(["市政工程", "水利工程"], ["国企", "央企"], ["意向阶段", "竞标阶段"]))
+    with open(path, 'w', encoding='utf-8') as file:
+        for input_data in inputs:
+            file.write(json.dumps(input_data.model_dump(), ensure_ascii=False) + "\n")
+    return inputs
+
+
+def _run_all_workers(input_path, output_dir, progress_path):
+    """在当前进程中依次运行每个分片的每个工作进程逻辑"""
+    llm_client = opportunity_generator.llm_client
+    original_call = llm_client.call_llm
+    llm_client.call_llm = _fake_call_llm
+    result_cache.clear()
+    totals = {"ok": 0, "failed": 0, "skipped": 0}
+    try:
+        for shard in range(SHARD_COUNT):
+            for worker in range(WORKER_COUNT):
+                stats = asyncio.run(_run_worker_async(
+                    str(input_path), str(output_dir), shard, SHARD_COUNT, worker, WORKER_COUNT,
+                    str(progress_path), 2, False
+                ))
+                for name, value in stats.items():
+                    totals[name] += value
+            merge_parts(str(output_dir), shard, SHARD_COUNT)
+    finally:
+        llm_client.call_llm = original_call
+        result_cache.clear()
+    return totals
+
+
+def test_assign_is_deterministic():
+    """分片分配只取决于记录内容"""
+    inputs = list(grid_inputs())
+    first = [assign(record_key(item), 4, 3) for item in inputs]
+    second = [assign(record_key(item), 4, 3) for item in inputs]
+    assert first == second
+    assert all(0 <= shard < 4 and 0 <= worker < 3 for shard, worker in first)
+    assert len({shard for shard, _ in first}) == 4
+
+
+def test_parse_shard():
+    """分片参数格式校验"""
+    assert parse_shard("1/4") == (1, 4)
+    for spec in ("4/4", "a/b", "1", "-1/2"):
+        try:
+            parse_shard(spec)
+        except ValueError:
+            continue
+        raise AssertionError(f"应拒绝分片参数: {spec}")
+
+
+def test_shards_cover_all_records_and_resume(tmp_path):
+    """各分片的结果合起来恰好覆盖全部输入，重跑时跳过已完成记录"""
+    input_path = tmp_path / "inputs.jsonl"
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    progress_path = output_dir / "progress.jsonl"
+    inputs = _write_inputs(input_path)
+    assert len(list(read_records(str(input_path)))) == len(inputs)
+
+    totals = _run_all_workers(input_path, output_dir, progress_path)
+    assert totals == {"ok": len(inputs), "failed": 0, "skipped": 0}
+    assert len(ProgressLog(str(progress_path)).completed()) == len(inputs)
+    for shard in range(SHARD_COUNT):
+        with open(shard_path(str(output_dir), shard, SHARD_COUNT), encoding='utf-8') as file:
+            for line in file:
+                record = json.loads(line)
+                assert assign(record["key"], SHARD_COUNT, WORKER_COUNT)[0] == shard
+                assert len(record["output"]["opportunities"]) == 5
+
+    totals = _run_all_workers(input_path, output_dir, progress_path)
+    assert totals == {"ok": 0, "failed": 0, "skipped": len(inputs)}
+
+    merged_path = tmp_path / "merged.jsonl"
+    assert merge_shards(str(output_dir), str(merged_path)) == len(inputs)
+    with open(merged_path, encoding='utf-8') as file:
+        keys = [json.loads(line)["key"] for line in file]
+    assert sorted(keys) == sorted(record_key(item) for item in inputs)
+
+
+def test_dead_worker_reported_as_failure():
+    """未上报结果就退出的工作进程记为失败，不会一直等待"""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    crashed = context.Process(target=os._exit, args=(9,))
+    crashed.start()
+    results.put((1, {"ok": 3, "failed": 1, "skipped": 0}, None))
+    totals, errors = _collect_results({0: crashed, 1: crashed}, results, poll_interval=0.05)
+    crashed.join()
+    assert totals == {"ok": 3, "failed": 1, "skipped": 0}
+    assert errors == ["工作进程0: 未上报结果即退出，exitcode=9"]
+
+
+if __name__ == "__main__":
+    import pathlib
+    import tempfile
+    test_assign_is_deterministic()
+    test_parse_shard()
+    test_dead_worker_reported_as_failure()
+    with tempfile.TemporaryDirectory() as directory:
+        test_shards_cover_all_records_and_resume(pathlib.Path(directory))
+    print("分片批处理测试完成!")
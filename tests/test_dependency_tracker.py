@@ -0,0 +1,154 @@
+"""
+测试结果依赖跟踪和增量更新
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+
+# 添加src目录到Python路径，以便能够导入模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from core import analysis_cache_key, grid_inputs, store_output
+from dependency_tracker import CUSTOMER, SOURCE, TOPIC, DependencyTracker, notice_tags, report_dependencies
+from llm_client import opportunity_generator
+from refresh_scheduler import recompute_dirty
+from result_cache import ResultCache
+from schemas import validate_output
+
+
+def _items(name, project="项目", url="http://www.example.gov.cn/notice/1"):
+    return [
+        {
+            "company_name": f"{name}{index}",
+            "project_info": project,
+            "proof_info": f"公示信息：{url}",
+            "inferred_info": "推断",
+            "marketing_plan": "方案",
+        }
+        for index in range(5)
+    ]
+
+
+class FakeLLM:
+    """记录调用次数的假大模型"""
+
+    def __init__(self, fail=False):
+        self.calls = 0
+        self.fail = fail
+
+    async def __call__(self, messages, **kwargs):
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError("服务不可用")
+        return json.dumps({"opportunities": _items("新公司")}, ensure_ascii=False)
+
+
+def _populate(cache, tracker):
+    """为全部预设组合写入结果，市政工程的结果引用一条公示链接"""
+    keys = {}
+
+    async def run():
+        for input_data in grid_inputs():
+            _, key = analysis_cache_key(input_data)
+            if input_data.construction_direction == "市政工程":
+                items = _items("旧公司", "某市污水管网改造项目", "http://www.zfcg.gov.cn/notice/42")
+            else:
+                items = _items("旧公司")
+            await store_output(key, validate_output(items), cache, tracker)
+            keys[(input_data.construction_direction, input_data.customer_type, input_data.business_status)] = key
+
+    asyncio.run(run())
+    return keys
+
+
+def test_dependencies_and_tags():
+    """结果依赖包括施工方向关键词、项目中出现的分类词和引用链接"""
+    key = ResultCache.make_key("qwen", "qwen-plus", "市政工程", "国企", "意向阶段")
+    dependencies = report_dependencies(key, _items("公司", "跨海工程配套的管网改造", "https://a.gov.cn/n/1。"))
+    assert {(TOPIC, "市政工程"), (TOPIC, "管网改造"), (TOPIC, "跨海工程"), (CUSTOMER, "国企")} <= dependencies
+    assert (SOURCE, "https://a.gov.cn/n/1") in dependencies
+
+    tags = notice_tags({"title": "某区高速公路改扩建工程招标公告", "content": "招标人为某市属国企", "url": "http://x/1"})
+    assert tags == {(TOPIC, "高速公路"), (CUSTOMER, "国企"), (SOURCE, "http://x/1")}
+    assert notice_tags({"tags": ["水库建设", "customer:央企"]}) == {(TOPIC, "水库建设"), (CUSTOMER, "央企")}
+    assert notice_tags({"tags": ["source:https://x/2", "http://x/3"]}) == {(SOURCE, "https://x/2"),
+                                                                          (TOPIC, "http://x/3")}
+
+
+def test_ingest_marks_only_matching_reports():
+    """公告只标记主题和客户类型都匹配的结果，以及引用了该公告的结果"""
+    cache, tracker = ResultCache(), DependencyTracker()
+    keys = _populate(cache, tracker)
+    marked = tracker.ingest([
+        {"title": "某市管网改造工程施工招标公告", "content": "招标人：某市城投集团（国企）"},
+        {"title": "关于公示内容的更正", "content": "", "url": "http://www.zfcg.gov.cn/notice/42"},
+    ])
+    assert len(keys) > 100
+    # 市政工程 × 国企 的全部商机状态由第一条公告标记，市政工程的全部结果由第二条公告标记
+    expected = {key for (direction, _, _), key in keys.items() if direction == "市政工程"}
+    assert set(marked) == expected
+    assert marked[keys[("市政工程", "国企", "意向阶段")]] == 2
+    assert marked[keys[("市政工程", "央企", "意向阶段")]] == 1
+    assert not tracker.is_dirty(keys[("水利工程", "国企", "意向阶段")])
+
+    # 访问次数多、匹配公告多的结果优先
+    hot = keys[("市政工程", "央企", "竞标阶段")]
+    ranked = tracker.dirty_keys(hits={hot: 5})
+    assert ranked[0] == (hot, 6)
+    assert ranked[1][1] == 2 and len(ranked) == len(expected)
+
+
+def test_recompute_only_dirty_set():
+    """只重新计算待更新的结果，成功后清除标记，失败的保持待更新"""
+    cache, tracker = ResultCache(), DependencyTracker()
+    keys = _populate(cache, tracker)
+    tracker.ingest([{"tags": ["水库建设", "customer:央企"]}])
+    dirty = {key for key, _ in tracker.dirty_keys()}
+    assert dirty == {key for (direction, customer, _), key in keys.items()
+                     if direction == "水利工程" and customer == "央企"}
+
+    llm_client = opportunity_generator.llm_client
+    original_call = llm_client.call_llm
+    try:
+        llm_client.call_llm = FakeLLM(fail=True)
+        stats = asyncio.run(recompute_dirty(limit=2, cache=cache, tracker=tracker))
+        assert stats == {"refreshed": 0, "failed": 2, "skipped": 0}
+        assert len(tracker.dirty_keys()) == len(dirty)
+
+        fake = FakeLLM()
+        llm_client.call_llm = fake
+        stats = asyncio.run(recompute_dirty(cache=cache, tracker=tracker))
+    finally:
+        llm_client.call_llm = original_call
+    assert stats["refreshed"] == fake.calls == len(dirty)
+    assert tracker.dirty_keys() == []
+    for key in dirty:
+        assert cache.get(key).items[0]["company_name"] == "新公司0"
+    assert cache.get(keys[("水利工程", "国企", "意向阶段")]).items[0]["company_name"] == "旧公司0"
+
+
+def test_ingest_cli():
+    """命令行导入公告，依赖记录与结果缓存保存在同一文件"""
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    from main import main
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cache.db")
+        cache, tracker = ResultCache(path), DependencyTracker(path)
+        _populate(cache, tracker)
+        notices = os.path.join(directory, "notices.jsonl")
+        with open(notices, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"title": "某新区防洪治理工程招标", "content": "招标人为某事业单位"},
+                               ensure_ascii=False) + "\n")
+        assert main(["ingest", "--notices", notices, "--cache", path]) == 0
+        assert len(tracker.dirty_keys()) == 5
+
+
+if __name__ == "__main__":
+    test_dependencies_and_tags()
+    test_ingest_marks_only_matching_reports()
+    test_recompute_only_dirty_set()
+    test_ingest_cli()
+    print("依赖跟踪测试完成!")
@@ -0,0 +1,149 @@
+"""
+测试域名信誉索引
+"""
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+
+# 添加src目录到Python路径，以便能够导入模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from domain_index import SUSPECT, TRUSTED, UNKNOWN, DomainIndex, extract_urls, normalize_host
+from llm_client import LLMClient
+from utils import URL_HOST_ERROR, URL_OK, URL_PAGE_ERROR, URL_UNREACHABLE, WebSearcher
+
+
+def test_seed_sites_and_suffixes():
+    """内置网站信任整个域名，子域名也可信，其他域名未知"""
+    index = DomainIndex()
+    assert index.classify("http://www.mohurd.gov.cn/notice/1") == TRUSTED
+    assert index.classify("https://ggzy.sz.gov.cn/jyxx") == TRUSTED
+    assert index.classify("HTTPS://WWW.ZHAOBIAO.CN:8443/a") == TRUSTED
+    assert index.classify("tianyancha.com") == TRUSTED
+    assert index.classify("http://www.gov.cn.fake-portal.com/") == UNKNOWN
+    assert index.classify("http://notgov.cn/") == UNKNOWN
+    assert index.classify("http://[broken/") == SUSPECT
+    assert normalize_host("https://Www.Example.COM.:80/path?q=1") == "www.example.com"
+
+
+def test_outcomes_take_effect_and_rebuild():
+    """验证结果立即生效，达到阈值后合并进索引文件，重新打开后仍然有效"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "domains.idx")
+        index = DomainIndex(path, rebuild_threshold=50)
+        index.record("http://www.fake-bidding.com/notice/9", False)
+        index.record("http://www.shuiwu-group.com/", True)
+        assert index.classify("http://www.fake-bidding.com/other") == SUSPECT
+        assert index.classify("http://www.shuiwu-group.com/about") == TRUSTED
+        # 确切域名的验证结果不扩展到子域名
+        assert index.classify("http://news.shuiwu-group.com/") == UNKNOWN
+        assert index.stats()["pending_bad"] == 1
+
+        index.record_many([(f"http://hallucinated{i}.com/x", False) for i in range(60)])
+        stats = index.stats()
+        assert stats["pending_bad"] == 0 and stats["pending_trusted"] == 0
+        assert index.classify("http://hallucinated7.com/") == SUSPECT
+        assert index.classify("http://www.fake-bidding.com/") == SUSPECT
+
+        # 之后恢复访问的域名以最后一次结果为准
+        index.record("http://hallucinated7.com/", True)
+        assert index.classify("http://hallucinated7.com/") == TRUSTED
+        index.close()
+
+        reopened = DomainIndex(path, rebuild_threshold=50)
+        assert reopened.classify("http://hallucinated7.com/") == TRUSTED
+        assert reopened.classify("http://hallucinated8.com/") == SUSPECT
+        assert reopened.stats()["pending_trusted"] == 1
+        reopened.rebuild()
+        assert reopened.classify("http://hallucinated7.com/") == TRUSTED
+        with open(f"{path}.log", encoding="utf-8") as f:
+            assert len(f.readlines()) == 62
+        reopened.close()
+
+
+def test_interrupted_log_line():
+    """日志末尾的不完整行被跳过，新记录另起一行"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "domains.idx")
+        DomainIndex(path).close()
+        with open(f"{path}.log", "a", encoding="utf-8") as f:
+            f.write('["partial.com", ')
+        index = DomainIndex(path)
+        index.record("http://fine.com/", False)
+        index.close()
+        assert DomainIndex(path).classify("http://fine.com/") == SUSPECT
+
+
+def test_learn_notices_and_screen():
+    """本地招标公告的链接加入可信域名，文本中的链接按分类返回"""
+    index = DomainIndex()
+    assert index.learn_notices([
+        {"title": "某市管网改造工程招标公告", "url": "http://ggzy.example-city.cn/notice/42",
+         "content": "详见 https://jsj.example-city.cn/file/1。"},
+    ]) == 2
+    index.record("http://www.nonexistent-bids.com/", False)
+    text = LLMClient()._format_urls(
+        "根据 http://ggzy.example-city.cn/notice/43 和 http://www.mwr.gov.cn/xw/ 公示，"
+        "另见http://www.nonexistent-bids.com/a 以及 http://www.industrynews.com/article/1"
+    )
+    assert extract_urls(text)[0] == "http://ggzy.example-city.cn/notice/43"
+    assert index.screen(text) == {
+        TRUSTED: ["http://ggzy.example-city.cn/notice/43", "http://www.mwr.gov.cn/xw"],
+        SUSPECT: ["http://www.nonexistent-bids.com/a"],
+        UNKNOWN: ["http://www.industrynews.com/article/1"],
+    }
+
+
+def test_validate_urls_only_checks_unknown():
+    """批量验证只对未知链接联网，只有成功和主机级失败写回索引"""
+    index = DomainIndex()
+    index.record("http://www.nonexistent-bids.com/", False)
+    checked = []
+    original = WebSearcher.probe_url
+    outcomes = {"real": URL_OK, "made-up": URL_HOST_ERROR, "missing-page": URL_PAGE_ERROR, "slow": URL_UNREACHABLE}
+
+    async def fake_probe(url):
+        checked.append(url)
+        return next(outcome for name, outcome in outcomes.items() if f"//{name}" in url)
+
+    WebSearcher.probe_url = staticmethod(fake_probe)
+    try:
+        urls = ["http://www.gov.cn/a", "http://www.nonexistent-bids.com/b", "http://real-news.com/1",
+                "http://made-up.com/2", "http://www.gov.cn/a", "http://missing-page.com/3", "http://slow.com/4"]
+        results = asyncio.run(WebSearcher.validate_urls(urls, index=index))
+        assert results == {"http://www.gov.cn/a": True, "http://www.nonexistent-bids.com/b": False,
+                           "http://real-news.com/1": True, "http://made-up.com/2": False,
+                           "http://missing-page.com/3": False, "http://slow.com/4": False}
+        assert checked == ["http://real-news.com/1", "http://made-up.com/2",
+                           "http://missing-page.com/3", "http://slow.com/4"]
+        assert index.classify("http://made-up.com/") == SUSPECT
+        # 页面无效或超时不代表域名是编造的，下次仍联网验证
+        assert index.classify("http://missing-page.com/") == UNKNOWN
+        assert index.classify("http://slow.com/") == UNKNOWN
+
+        asyncio.run(WebSearcher.validate_urls(["http://real-news.com/3", "http://made-up.com/4",
+                                               "http://slow.com/5"], index=index))
+        assert checked[4:] == ["http://slow.com/5"]
+    finally:
+        WebSearcher.probe_url = original
+
+
+def test_probe_url_distinguishes_host_errors():
+    """域名无法解析或连接被拒绝时为主机级失败"""
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        port = listener.getsockname()[1]
+    assert asyncio.run(WebSearcher.probe_url(f"http://127.0.0.1:{port}/")) == URL_HOST_ERROR
+    assert asyncio.run(WebSearcher.probe_url("http://host.invalid/")) == URL_HOST_ERROR
+
+
+if __name__ == "__main__":
+    test_seed_sites_and_suffixes()
+    test_outcomes_take_effect_and_rebuild()
+    test_interrupted_log_line()
+    test_learn_notices_and_screen()
+    test_validate_urls_only_checks_unknown()
+    test_probe_url_distinguishes_host_errors()
+    print("域名信誉索引测试完成!")
@@ -0,0 +1,122 @@
+"""
+测试公司实体索引和结果去重
+"""
+import os
+import sys
+
+# 添加src目录到Python路径，以便能够导入模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from entity_index import (
+    EntityIndex, dedupe_opportunities, fingerprint, hamming_distance, normalize_company_name,
+)
+from schemas import validate_output
+
+
+def _item(name, project="项目", **extra):
+    return dict({
+        "company_name": name,
+        "project_info": project,
+        "proof_info": "证明",
+        "inferred_info": "推断",
+        "marketing_plan": "方案",
+    }, **extra)
+
+
+def test_normalize_company_name():
+    """全称、简称、带或不带集团的写法规范化为同一名称"""
+    expected = normalize_company_name("中国建筑第八工程局有限公司")
+    assert expected == "中国建筑八局"
+    for variant in ("中建八局", "中建八局（集团）", "中建第8工程局有限公司", " 中国建筑第八工程局 "):
+        assert normalize_company_name(variant) == expected
+    assert normalize_company_name("北京城建集团有限责任公司") == normalize_company_name("北京城建")
+    assert normalize_company_name("中建材") != normalize_company_name("中建")
+
+
+def test_normalize_crcc_and_numbers():
+    """中铁十一局等中国铁建下属单位不归入中国中铁；阿拉伯数字按中文写法统一"""
+    assert normalize_company_name("中铁十一局集团有限公司") == "中国铁建十一局"
+    assert normalize_company_name("中铁11局") == normalize_company_name("中国铁建第十一工程局")
+    assert normalize_company_name("中铁二十局") == "中国铁建二十局"
+    assert normalize_company_name("中铁建") == "中国铁建"
+    assert normalize_company_name("中铁建设集团有限公司") != normalize_company_name("中国中铁")
+    assert normalize_company_name("中铁一局") == normalize_company_name("中国中铁第1工程局") == "中国中铁一局"
+    assert normalize_company_name("中铁十局") == normalize_company_name("中铁10局") == "中国中铁十局"
+    assert normalize_company_name("中铁20局") != normalize_company_name("中铁2局")
+    assert normalize_company_name("北京城建2020项目部") == "北京城建二〇二〇项目部"
+
+
+def test_fingerprint_is_stable_and_close_for_variants():
+    """指纹与进程无关，仅标点不同的文本指纹相同"""
+    first = fingerprint("上海隧道工程股份有限公司", "上海机场联络线隧道工程，预计投资300亿元")
+    second = fingerprint("上海隧道工程股份有限公司", "上海机场联络线隧道工程。预计投资300亿元")
+    other = fingerprint("深圳地铁集团有限公司", "深圳地铁16号线二期土建施工")
+    assert first == second
+    assert hamming_distance(first, other) > 3
+    assert first.bit_length() <= 64
+
+
+def test_index_merges_variants_incrementally():
+    """同一公司的不同写法归并为一个实体，近似查找可找到指纹相近的实体"""
+    index = EntityIndex()
+    first = index.add("中国建筑第八工程局有限公司", "济南轨道交通4号线", report="a")
+    second = index.add("中建八局", "青岛胶东机场配套工程", report="b")
+    third = index.add("深圳地铁集团有限公司", "深圳地铁16号线二期", report="b")
+    assert first is second
+    assert third is not first
+    assert len(index) == 2
+    assert first.mentions == 2 and first.reports == {"a", "b"}
+    assert index.lookup("中建八局（集团）") is first
+    assert index.lookup("不存在的公司") is None
+
+    similar = index.find_similar("深圳地铁集团", "深圳地铁16号线二期。")
+    assert similar and similar[0][0] is third
+    assert index.most_mentioned(1) == [first]
+
+
+def test_index_add_output():
+    """可直接加入分析结果"""
+    index = EntityIndex()
+    output = validate_output([_item(f"测试公司{number}", f"测试项目{number}") for number in range(5)])
+    entities = index.add_output(output, report="key")
+    assert len(entities) == 5 and len(index) == 5
+
+
+def test_dedupe_within_response():
+    """同一结果中的重复公司被去掉，后面的不同公司补上空位"""
+    items = [
+        _item("中国建筑第八工程局有限公司", "济南轨道交通4号线"),
+        _item("中建八局", "济南轨道交通4号线"),
+        _item("上海隧道工程股份有限公司", "上海机场联络线"),
+        _item("上海隧道工程股份有限公司 ", "上海机场联络线"),
+        _item("深圳地铁集团", "深圳地铁16号线"),
+        _item("广州地铁集团", "广州地铁11号线"),
+        _item("成都轨道交通集团", "成都地铁30号线"),
+        _item("武汉地铁集团", "武汉地铁12号线"),
+    ]
+    unique = dedupe_opportunities(items)
+    assert [item["company_name"] for item in unique] == [
+        "中国建筑第八工程局有限公司", "上海隧道工程股份有限公司", "深圳地铁集团", "广州地铁集团",
+        "成都轨道交通集团", "武汉地铁集团",
+    ]
+    output = validate_output(items)
+    assert len(output.opportunities) == 5
+    assert output.opportunities[1].company_name == "上海隧道工程股份有限公司"
+
+
+def test_dedupe_never_pads_with_duplicates():
+    """去重后数量不足时不补回重复条目，由调用方判定结果不足"""
+    items = [_item("中建八局")] * 3 + [_item("深圳地铁集团"), _item("广州地铁集团")]
+    assert [item["company_name"] for item in dedupe_opportunities(items)] == ["中建八局", "深圳地铁集团", "广州地铁集团"]
+    assert len(validate_output(items).opportunities) == 3
+
+
+if __name__ == "__main__":
+    test_normalize_company_name()
+    test_normalize_crcc_and_numbers()
+    test_fingerprint_is_stable_and_close_for_variants()
+    test_index_merges_variants_incrementally()
+    test_index_add_output()
+    test_dedupe_within_response()
+    test_dedupe_never_pads_with_duplicates()
+    print("实体索引测试完成!")
@@ -0,0 +1,139 @@
+"""
+测试分析结果流式导出
+"""
+import asyncio
+import csv
+import json
+import os
+import sys
+import zipfile
+from xml.etree import ElementTree
+
+# 添加src目录到Python路径，以便能够导入模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from core import grid_inputs, iter_analyses
+from exporters import aiter_store, export_results, iter_rows
+from llm_client import opportunity_generator
+from result_store import ColumnarResultStore
+from schemas import OpportunityAnalysisInput, validate_output
+
+_SHEET_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+
+
+async def _mock_results():
+    """分析两个方向的全部组合，模拟数据不依赖网络"""
+    inputs = grid_inputs(["市政工程", "水利工程"], ["国企"], ["意向阶段", "竞标阶段"])
+    async for item in iter_analyses(inputs, concurrency=2):
+        yield item
+
+
+def _export(path, flush_rows=3):
+    original_key = opportunity_generator.llm_client.config["api_key"]
+    opportunity_generator.llm_client.config["api_key"] = ""
+    try:
+        return asyncio.run(export_results(_mock_results(), str(path), flush_rows=flush_rows))
+    finally:
+        opportunity_generator.llm_client.config["api_key"] = original_key
+
+
+def test_export_ndjson(tmp_path):
+    """NDJSON每行一个商机"""
+    path = tmp_path / "results.ndjson"
+    assert _export(path) == 20
+    with open(path, encoding='utf-8') as file:
+        rows = [json.loads(line) for line in file]
+    assert len(rows) == 20
+    assert {row["construction_direction"] for row in rows} == {"市政工程", "水利工程"}
+    assert sorted({row["position"] for row in rows}) == [1, 2, 3, 4, 5]
+
+
+def test_export_csv_has_bom_and_header(tmp_path):
+    """CSV带UTF-8 BOM和中文表头"""
+    path = tmp_path / "results.csv"
+    assert _export(path) == 20
+    with open(path, 'rb') as file:
+        assert file.read(3) == b"\xef\xbb\xbf"
+    with open(path, encoding='utf-8-sig', newline='') as file:
+        rows = list(csv.reader(file))
+    assert rows[0][:4] == ["建筑方向", "客户类型", "商机状态", "序号"]
+    assert len(rows) == 21
+
+
+def test_export_xlsx_is_valid_workbook(tmp_path):
+    """XLSX为合法的zip包，工作表包含表头和全部数据行"""
+    path = tmp_path / "results.xlsx"
+    assert _export(path) == 20
+    with zipfile.ZipFile(path) as archive:
+        assert "xl/workbook.xml" in archive.namelist()
+        sheet = ElementTree.fromstring(archive.read("xl/worksheets/sheet1.xml"))
+    rows = sheet.findall(f"{_SHEET_NS}sheetData/{_SHEET_NS}row")
+    assert len(rows) == 21
+    first_cell = rows[0].find(f"{_SHEET_NS}c/{_SHEET_NS}is/{_SHEET_NS}t")
+    assert first_cell.text == "建筑方向"
+
+
+def test_export_from_result_store(tmp_path):
+    """可直接从列式结果存储导出"""
+    async def collect():
+        store = ColumnarResultStore()
+        async for input_data, output in _mock_results():
+            store.append(input_data, output)
+        return await export_results(aiter_store(store, chunk_size=7), str(tmp_path / "store.csv"))
+
+    original_key = opportunity_generator.llm_client.config["api_key"]
+    opportunity_generator.llm_client.config["api_key"] = ""
+    try:
+        assert asyncio.run(collect()) == 20
+    finally:
+        opportunity_generator.llm_client.config["api_key"] = original_key
+
+
+async def _risky_results():
+    """包含分析失败的输入和以公式字符开头的文本"""
+    input_data = OpportunityAnalysisInput(construction_direction="市政工程", customer_type="国企",
+                                          business_status="意向阶段")
+    items = [{"company_name": f"=HYPERLINK(\"http://evil.example\",\"公司{index}\")",
+              "project_info": "-1+2", "proof_info": "@SUM(A1)", "inferred_info": "推断",
+              "marketing_plan": "方案"} for index in range(5)]
+    yield input_data, validate_output(items)
+    yield input_data, RuntimeError("大模型调用失败")
+
+
+def test_errors_and_formula_cells(tmp_path):
+    """失败的输入导出为错误行；CSV中以公式字符开头的文本加单引号前缀，XLSX和NDJSON保持原样"""
+    async def rows():
+        return [row async for row in iter_rows(_risky_results())]
+
+    collected = asyncio.run(rows())
+    assert len(collected) == 6
+    assert collected[-1] == {"construction_direction": "市政工程", "customer_type": "国企",
+                             "business_status": "意向阶段", "error": "大模型调用失败"}
+    assert collected[0]["project_info"] == "-1+2"
+
+    path = tmp_path / "risky.csv"
+    assert asyncio.run(export_results(_risky_results(), str(path))) == 6
+    with open(path, encoding='utf-8-sig', newline='') as file:
+        table = list(csv.reader(file))
+    assert table[0][-1] == "错误信息"
+    assert table[1][4].startswith("'=HYPERLINK") and table[1][5] == "'-1+2" and table[1][6] == "'@SUM(A1)"
+    assert table[1][3] == "1" and table[1][-1] == ""
+    assert table[6][:4] == ["市政工程", "国企", "意向阶段", ""] and table[6][-1] == "大模型调用失败"
+
+    path = tmp_path / "risky.xlsx"
+    assert asyncio.run(export_results(_risky_results(), str(path))) == 6
+    with zipfile.ZipFile(path) as archive:
+        sheet = ElementTree.fromstring(archive.read("xl/worksheets/sheet1.xml"))
+    texts = [cell.text for cell in sheet.iter(f"{_SHEET_NS}t")]
+    assert "-1+2" in texts and "'-1+2" not in texts
+
+
+if __name__ == "__main__":
+    import pathlib
+    import tempfile
+    with tempfile.TemporaryDirectory() as directory:
+        for test in (test_export_ndjson, test_export_csv_has_bom_and_header,
+                     test_export_xlsx_is_valid_workbook, test_export_from_result_store,
+                     test_errors_and_formula_cells):
+            test(pathlib.Path(directory))
+    print("导出测试完成!")
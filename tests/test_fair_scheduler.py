@@ -0,0 +1,172 @@
+"""
+测试多租户加权公平调度
+"""
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+# 添加src目录到Python路径，以便能够导入模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from fair_scheduler import (
+    BATCH, INTERACTIVE, FairScheduler, current_request_class, current_tenant, fair_schedulers, request_context,
+)
+from llm_client import LLMClient
+from rate_limiter import rate_limiters
+
+
+async def _run_all(scheduler, requests, hold=0.0):
+    """
+    依次提交请求，记录放行顺序
+    :param requests: (租户, 请求类别, 开销) 列表
+    """
+    order = []
+
+    async def call(tenant, request_class, cost):
+        ticket = await scheduler.acquire(cost, tenant=tenant, request_class=request_class)
+        order.append((tenant, request_class))
+        await asyncio.sleep(hold)
+        ticket.release()
+
+    # 先占住全部名额，让请求都进入队列
+    blocker = await scheduler.acquire(0, tenant="blocker")
+    tasks = [asyncio.ensure_future(call(*request)) for request in requests]
+    await asyncio.sleep(0)
+    blocker.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_interactive_strictly_before_batch():
+    """交互请求先于已在排队的批处理请求放行"""
+    scheduler = FairScheduler(lambda: 1)
+    requests = [("nightly", BATCH, 100)] * 5 + [("sales", INTERACTIVE, 100)] * 3
+    order = asyncio.run(_run_all(scheduler, requests))
+    assert [request_class for _, request_class in order] == [INTERACTIVE] * 3 + [BATCH] * 5
+
+
+def test_weighted_share_within_class():
+    """同一类别内按权重分配放行次数"""
+    scheduler = FairScheduler(lambda: 1, quantum=100, weights={"east": 3, "west": 1})
+    requests = [("east", BATCH, 100)] * 40 + [("west", BATCH, 100)] * 40
+    order = asyncio.run(_run_all(scheduler, requests))
+    first = [tenant for tenant, _ in order[:40]]
+    assert first.count("east") == 30 and first.count("west") == 10
+
+    # 开销大的请求消耗更多额度
+    scheduler = FairScheduler(lambda: 1, quantum=100)
+    requests = [("big", BATCH, 400)] * 10 + [("small", BATCH, 100)] * 40
+    order = asyncio.run(_run_all(scheduler, requests))
+    assert [tenant for tenant, _ in order[:25]].count("big") == 5
+
+
+def test_tenant_concurrency_limit():
+    """租户达到并发上限时，名额让给其他租户"""
+    scheduler = FairScheduler(lambda: 4, max_concurrency={"east": 1})
+
+    async def run():
+        first = await scheduler.acquire(tenant="east")
+        waiting = asyncio.ensure_future(scheduler.acquire(tenant="east"))
+        others = [await asyncio.wait_for(scheduler.acquire(tenant="west"), 1) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        assert scheduler.stats()["east"]["interactive_queued"] == 1
+        first.release()
+        second = await asyncio.wait_for(waiting, 1)
+        for ticket in others + [second]:
+            ticket.release()
+        assert scheduler.inflight == 0
+
+    asyncio.run(run())
+
+
+def test_tenant_token_quota():
+    """租户token配额用完后等待补充，其他租户不受影响"""
+    # 每秒补充100个token，桶容量为一分钟的额度
+    scheduler = FairScheduler(lambda: 8, tpm={"east": 6000})
+
+    async def run():
+        started = time.monotonic()
+        (await scheduler.acquire(6000, tenant="east")).release(used_tokens=6000)
+        (await asyncio.wait_for(scheduler.acquire(6000, tenant="west"), 0.05)).release()
+        (await scheduler.acquire(10, tenant="east")).release()
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) >= 0.08
+
+
+def test_cancelled_waiter_releases_slot():
+    """排队中被取消的请求不会占用名额"""
+    scheduler = FairScheduler(lambda: 1)
+
+    async def run():
+        holder = await scheduler.acquire(tenant="east")
+        cancelled = asyncio.ensure_future(scheduler.acquire(tenant="east"))
+        waiting = asyncio.ensure_future(scheduler.acquire(tenant="west"))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        holder.release()
+        ticket = await asyncio.wait_for(waiting, 1)
+        ticket.release()
+        assert scheduler.inflight == 0
+
+    asyncio.run(run())
+
+
+def test_request_context():
+    """租户和请求类别通过上下文传递，可嵌套"""
+    assert (current_tenant(), current_request_class()) == ("default", INTERACTIVE)
+    with request_context(tenant="east", request_class=BATCH):
+        with request_context(request_class=INTERACTIVE):
+            assert (current_tenant(), current_request_class()) == ("east", INTERACTIVE)
+        assert current_request_class() == BATCH
+    assert current_tenant() == "default"
+    try:
+        with request_context(request_class="bulk"):
+            pass
+        assert False
+    except ValueError:
+        pass
+
+
+def test_call_llm_records_tenant_wait():
+    """大模型调用经过调度器，按上下文中的租户统计"""
+    def handler(request):
+        return httpx.Response(200, json={
+            "choices": [{"message": {"content": "ok"}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+        })
+
+    client = LLMClient()
+    client.config = dict(client.config, api_key="test-key", provider="mock-fair")
+    rate_limiters.configure("mock-fair", max_concurrency=2, initial_concurrency=2)
+    scheduler = fair_schedulers.configure("mock-fair", weights={"east": 2})
+
+    async def run():
+        client._http_clients[asyncio.get_running_loop()] = httpx.AsyncClient(
+            transport=httpx.MockTransport(handler))
+        try:
+            with request_context(tenant="east"):
+                return await asyncio.gather(*(client.call_llm([{"role": "user", "content": "测试"}])
+                                              for _ in range(5)))
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(run()) == ["ok"] * 5
+    stats = scheduler.stats()["east"]
+    assert stats["granted"] == 5 and stats["inflight"] == 0 and stats["weight"] == 2
+    assert scheduler.inflight == 0
+
+
+if __name__ == "__main__":
+    test_interactive_strictly_before_batch()
+    test_weighted_share_within_class()
+    test_tenant_concurrency_limit()
+    test_tenant_token_quota()
+    test_cancelled_waiter_releases_slot()
+    test_request_context()
+    test_call_llm_records_tenant_wait()
+    print("公平调度测试完成!")
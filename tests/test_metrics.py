@@ -0,0 +1,94 @@
+"""
+测试运行指标采集模块
+"""
+import asyncio
+import json
+import os
+import sys
+import urllib.request
+
+# 添加src目录到Python路径，以便能够导入模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import httpx
+
+import llm_client
+from metrics import MetricsRegistry, metrics, start_metrics_server
+
+
+def test_disabled_registry_records_nothing():
+    """关闭时不记录任何指标"""
+    registry = MetricsRegistry(enabled=False)
+    with registry.span("parse", provider="qwen", model="qwen-plus"):
+        pass
+    registry.inc("llm_cache_hits_total", provider="qwen")
+    snapshot = registry.snapshot()
+    assert snapshot["counters"] == [] and snapshot["histograms"] == []
+
+
+def test_span_and_counter_export():
+    """阶段耗时和计数器可导出为Prometheus文本和JSON"""
+    registry = MetricsRegistry(enabled=True)
+    with registry.span("parse", provider="qwen", model="qwen-plus"):
+        pass
+    registry.inc("llm_prompt_tokens_total", 120, provider="qwen", model="qwen-plus")
+    registry.inc("llm_prompt_tokens_total", 30, provider="qwen", model="qwen-plus")
+
+    text = registry.render_prometheus()
+    assert '# TYPE llm_prompt_tokens_total counter' in text
+    assert 'llm_prompt_tokens_total{model="qwen-plus",provider="qwen"} 150' in text
+    assert 'llm_stage_duration_seconds_count{model="qwen-plus",provider="qwen",stage="parse"} 1' in text
+    assert 'le="+Inf"' in text
+
+    snapshot = json.loads(registry.to_json())
+    assert snapshot["histograms"][0]["labels"]["stage"] == "parse"
+
+
+def test_call_llm_records_usage_and_stages():
+    """大模型调用记录token用量和首字节、生成阶段耗时"""
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={
+            "choices": [{"message": {"content": "详见 https://www.gov.cn/notice/1"}}],
+            "usage": {"prompt_tokens": 42, "completion_tokens": 7},
+        })
+
+    original_client = llm_client.httpx.AsyncClient
+    llm_client.httpx.AsyncClient = lambda **kwargs: original_client(transport=httpx.MockTransport(handler), **kwargs)
+    metrics.enabled = True
+    metrics.reset()
+    try:
+        client = llm_client.LLMClient()
+        client.config = dict(client.config, api_key="test-key", provider="qwen")
+        content = asyncio.run(client.call_llm([{"role": "user", "content": "你好"}], model="qwen-plus"))
+    finally:
+        llm_client.httpx.AsyncClient = original_client
+        metrics.enabled = False
+
+    assert content == "详见 【https://www.gov.cn/notice/1】"
+    text = metrics.render_prometheus()
+    assert 'llm_prompt_tokens_total{model="qwen-plus",provider="qwen"} 42' in text
+    assert 'llm_completion_tokens_total{model="qwen-plus",provider="qwen"} 7' in text
+    assert 'stage="ttfb"' in text and 'stage="generation"' in text
+    metrics.reset()
+
+
+def test_scrape_endpoint():
+    """抓取端点返回Prometheus文本"""
+    registry = MetricsRegistry(enabled=True)
+    registry.inc("llm_cache_hits_total", provider="qwen", model="qwen-plus")
+    server = start_metrics_server(port=0, registry=registry)
+    try:
+        port = server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            body = response.read().decode("utf-8")
+    finally:
+        server.shutdown()
+    assert 'llm_cache_hits_total{model="qwen-plus",provider="qwen"} 1' in body
+
+
+if __name__ == "__main__":
+    test_disabled_registry_records_nothing()
+    test_span_and_counter_export()
+    test_call_llm_records_usage_and_stages()
+    test_scrape_endpoint()
+    print("指标模块测试完成!")
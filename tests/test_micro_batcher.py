@@ -0,0 +1,215 @@
+"""
+测试分析请求微批处理
+"""
+import asyncio
+import json
+import os
+import re
+import sys
+
+# 添加src目录到Python路径，以便能够导入模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from core import grid_inputs, refresh_analysis
+from dependency_tracker import DependencyTracker
+from fair_scheduler import BATCH, request_context
+from llm_client import ConstructionOpportunityGenerator, opportunity_generator
+from micro_batcher import MicroBatcher, build_batch_messages, parse_batch_response
+from result_cache import ResultCache
+
+_SECTION = re.compile(r"【(\d+)】建筑方向：(.+?)；客户类型：(.+?)；商机状态：(.+)")
+_SINGLE = re.compile(r"建筑方向：(.+)\n\s*客户类型：(.+)\n\s*商机状态：(.+)")
+
+
+def _items(request):
+    return [
+        {
+            "company_name": f"{'-'.join(request)}公司{index}",
+            "project_info": "项目",
+            "proof_info": "证明",
+            "inferred_info": "推断",
+            "marketing_plan": "方案",
+        }
+        for index in range(5)
+    ]
+
+
+class FakeLLM:
+    """按提示词中的条件返回结果的假大模型，可指定合并结果中缺失的编号"""
+
+    def __init__(self, missing=(), fail_batch=False, fail_single=()):
+        self.batches = []
+        self.singles = []
+        self.missing = set(missing)
+        self.fail_batch = fail_batch
+        self.fail_single = set(fail_single)
+
+    async def __call__(self, messages, **kwargs):
+        await asyncio.sleep(0.01)
+        prompt = messages[-1]["content"]
+        sections = _SECTION.findall(prompt)
+        if sections:
+            self.batches.append((len(sections), kwargs.get("max_tokens")))
+            if self.fail_batch:
+                raise RuntimeError("服务不可用")
+            results = {number: {"opportunities": _items(request)}
+                       for number, *request in sections if number not in self.missing}
+            return "结果如下：" + json.dumps({"results": results}, ensure_ascii=False)
+        request = tuple(value.strip() for value in _SINGLE.search(prompt).groups())
+        self.singles.append(request)
+        if request in self.fail_single:
+            raise RuntimeError("单独调用失败")
+        return json.dumps({"opportunities": _items(request)}, ensure_ascii=False)
+
+
+def _batcher(fake, **kwargs):
+    generator = ConstructionOpportunityGenerator()
+    generator.llm_client.call_llm = fake
+    return MicroBatcher(generator, **kwargs)
+
+
+def _requests(count):
+    return [(item.construction_direction, item.customer_type, item.business_status)
+            for item in list(grid_inputs())[:count]]
+
+
+def test_prompt_and_parse():
+    """合并提示词按编号列出条件，返回结果按编号解析"""
+    requests = _requests(3)
+    prompt = build_batch_messages(requests)[-1]["content"]
+    assert [tuple(section[1:]) for section in _SECTION.findall(prompt)] == requests
+    response = json.dumps({"results": {"1": {"opportunities": [1]}, "2": [2], "3": "坏结果"}})
+    assert parse_batch_response(f"```json\n{response}\n```") == {"1": [1], "2": [2]}
+    assert parse_batch_response("无法解析") == {}
+    assert parse_batch_response('{"opportunities": []}') == {}
+
+
+def test_merges_concurrent_requests():
+    """窗口内的不同组合按数量上限合并，结果分发给各自的调用方，相同组合只请求一次"""
+    fake = FakeLLM()
+    batcher = _batcher(fake, window=0.05, max_batch=4)
+    requests = _requests(10)
+
+    async def run():
+        return await asyncio.gather(*(batcher.generate(*request) for request in requests[:2] + requests))
+
+    results = asyncio.run(run())
+    for request, items in zip(requests[:2] + requests, results):
+        assert items == _items(request)
+    # 两批在达到数量上限时立即发出，剩余两个组合在窗口结束时发出
+    assert fake.batches == [(4, 8192), (4, 8192), (2, 4096)]
+    assert fake.singles == []
+
+
+def test_token_cap_and_disabled():
+    """预估token超过上限时提前发出；窗口为0时不合并"""
+    fake = FakeLLM()
+    batcher = _batcher(fake, window=0.05, max_batch=8, max_tokens=5000)
+
+    async def run(batcher):
+        return await asyncio.gather(*(batcher.generate(*request) for request in _requests(5)))
+
+    asyncio.run(run(batcher))
+    # 每批只能容纳两个组合，最后剩下的一个组合直接单独调用
+    assert [size for size, _ in fake.batches] == [2, 2]
+    assert len(fake.singles) == 1
+
+    fake = FakeLLM()
+    asyncio.run(run(_batcher(fake)))
+    assert fake.batches == [] and len(fake.singles) == 5
+
+
+def test_output_cap_limits_batch_size():
+    """每批组合数受服务商最大生成token数限制，合并调用的max_tokens不超过该值"""
+    fake = FakeLLM()
+    batcher = _batcher(fake, window=0.05, max_batch=8, max_tokens=10 ** 6, max_output_tokens=4096)
+    assert batcher.max_batch == 2
+
+    async def run():
+        return await asyncio.gather(*(batcher.generate(*request) for request in _requests(4)))
+
+    asyncio.run(run())
+    assert fake.batches == [(2, 4096), (2, 4096)]
+    assert not _batcher(FakeLLM(), window=0.05, max_output_tokens=3000).enabled
+
+
+def test_failed_sections_fall_back():
+    """合并结果中缺失的组合单独调用；合并调用失败时全部单独调用，单独调用失败只影响对应调用方"""
+    requests = _requests(3)
+    fake = FakeLLM(missing={"2"})
+    batcher = _batcher(fake, window=0.02, max_batch=4)
+
+    async def run():
+        return await asyncio.gather(*(batcher.generate(*request) for request in requests), return_exceptions=True)
+
+    assert asyncio.run(run()) == [_items(request) for request in requests]
+    assert fake.singles == [requests[1]]
+
+    fake = FakeLLM(fail_batch=True, fail_single={requests[0]})
+    batcher = _batcher(fake, window=0.02, max_batch=4)
+    results = asyncio.run(run())
+    assert isinstance(results[0], RuntimeError)
+    assert results[1:] == [_items(request) for request in requests[1:]]
+    assert sorted(fake.singles) == sorted(requests)
+
+
+def test_groups_by_tenant_and_cancellation():
+    """不同租户和请求类别不合并；取消一个调用方不影响同批次的其他组合"""
+    fake = FakeLLM()
+    batcher = _batcher(fake, window=0.03, max_batch=4)
+    requests = _requests(4)
+
+    async def call(request, tenant, request_class="interactive"):
+        with request_context(tenant=tenant, request_class=request_class):
+            return await batcher.generate(*request)
+
+    async def run():
+        tasks = [asyncio.ensure_future(call(requests[0], "east")),
+                 asyncio.ensure_future(call(requests[1], "east")),
+                 asyncio.ensure_future(call(requests[2], "west")),
+                 asyncio.ensure_future(call(requests[3], "east", BATCH))]
+        await asyncio.sleep(0)
+        tasks[0].cancel()
+        done = await asyncio.gather(*tasks, return_exceptions=True)
+        return done
+
+    results = asyncio.run(run())
+    assert isinstance(results[0], asyncio.CancelledError)
+    assert results[1:] == [_items(request) for request in requests[1:]]
+    assert sorted(size for size, _ in fake.batches) == [2]
+    assert sorted(fake.singles) == sorted([requests[2], requests[3]])
+
+
+def test_refresh_uses_micro_batcher():
+    """启用后，并发的结果刷新合并为一次大模型调用"""
+    from micro_batcher import micro_batcher
+
+    fake = FakeLLM()
+    llm_client = opportunity_generator.llm_client
+    original_call, original_window = llm_client.call_llm, micro_batcher.window
+    cache, tracker = ResultCache(), DependencyTracker()
+    inputs = list(grid_inputs())[:3]
+
+    async def run():
+        return await asyncio.gather(*(refresh_analysis(item, cache, tracker) for item in inputs))
+
+    try:
+        llm_client.call_llm = fake
+        micro_batcher.window = 0.02
+        assert asyncio.run(run()) == [True] * 3
+    finally:
+        llm_client.call_llm = original_call
+        micro_batcher.window = original_window
+    assert [size for size, _ in fake.batches] == [3] and fake.singles == []
+    assert len(cache) == 3
+
+
+if __name__ == "__main__":
+    test_prompt_and_parse()
+    test_merges_concurrent_requests()
+    test_token_cap_and_disabled()
+    test_output_cap_limits_batch_size()
+    test_failed_sections_fall_back()
+    test_groups_by_tenant_and_cancellation()
+    test_refresh_uses_micro_batcher()
+    print("微批处理测试完成!")
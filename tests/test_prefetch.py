@@ -0,0 +1,208 @@
+"""
+测试交互流程中的推测预取
+"""
+import asyncio
+import json
+import os
+import sys
+
+# 添加src目录到Python路径，以便能够导入模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from core import analysis_cache_key, analyze_opportunities, schedule_refresh
+from llm_client import opportunity_generator
+from prefetch import Prefetcher
+from result_cache import result_cache
+from schemas import BUSINESS_STATUSES, OpportunityAnalysisInput
+
+
+class SlowLLM:
+    """耗时较长的假大模型，记录开始和完成的商机状态"""
+
+    def __init__(self, delay=0.2):
+        self.delay = delay
+        self.started = []
+        self.finished = []
+
+    async def __call__(self, messages, **kwargs):
+        prompt = messages[-1]["content"]
+        status = next(status for status in BUSINESS_STATUSES if status in prompt)
+        self.started.append(status)
+        await asyncio.sleep(self.delay)
+        self.finished.append(status)
+        items = [
+            {
+                "company_name": f"{status}公司{index}",
+                "project_info": "项目",
+                "proof_info": "证明",
+                "inferred_info": "推断",
+                "marketing_plan": "方案",
+            }
+            for index in range(5)
+        ]
+        return json.dumps({"opportunities": items}, ensure_ascii=False)
+
+
+def _with_fake_llm(run):
+    fake = SlowLLM()
+    llm_client = opportunity_generator.llm_client
+    original_call = llm_client.call_llm
+    llm_client.call_llm = fake
+    # 全局缓存默认关闭，测试中临时开启
+    original_ttl, result_cache.ttl = result_cache.ttl, 86400.0
+    result_cache.clear()
+    try:
+        return run(fake)
+    finally:
+        llm_client.call_llm = original_call
+        result_cache.clear()
+        result_cache.ttl = original_ttl
+
+
+def _input(status, direction="市政工程", customer_type="国企"):
+    return OpportunityAnalysisInput(construction_direction=direction, customer_type=customer_type,
+                                    business_status=status)
+
+
+def _record_history(history, direction="市政工程", customer_type="国企"):
+    for status, hits in history.items():
+        _, key = analysis_cache_key(_input(status, direction, customer_type))
+        for _ in range(hits):
+            result_cache.record_access(key)
+
+
+def test_rank_statuses_from_history():
+    """按同一前缀的历史选择排序，没有记录时使用全部组合的分布"""
+    def run(fake):
+        _record_history({"竞标阶段": 6, "意向阶段": 3, "成果扩大": 1})
+        _record_history({"争夺阶段": 20}, direction="水利工程")
+        ranking = asyncio.run(Prefetcher().rank_statuses("市政工程", "国企"))
+        assert [status for status, _ in ranking] == ["竞标阶段", "意向阶段", "成果扩大"]
+        assert abs(ranking[0][1] - 0.6) < 1e-9
+        assert asyncio.run(Prefetcher().rank_statuses("结构工程", "央企"))[0][0] == "争夺阶段"
+
+    _with_fake_llm(run)
+
+
+def test_speculation_hit_lands_in_cache():
+    """猜中的预取继续完成并被正式请求复用，未猜中的预取被取消"""
+    def run(fake):
+        _record_history({"竞标阶段": 6, "意向阶段": 3, "成果扩大": 1})
+        prefetcher = Prefetcher(top_k=2, per_minute=6000)
+
+        async def scenario():
+            speculation = await prefetcher.speculate("市政工程", "国企")
+            assert speculation.statuses == ["竞标阶段", "意向阶段"]
+            # 模拟用户思考时间
+            await asyncio.sleep(fake.delay * 0.75)
+            assert speculation.resolve("竞标阶段")
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            output = await analyze_opportunities(_input("竞标阶段"), use_mock_data=False)
+            elapsed = loop.time() - started
+            await asyncio.sleep(0)
+            return output, elapsed, speculation
+
+        output, elapsed, speculation = asyncio.run(scenario())
+        assert output.opportunities[0].company_name == "竞标阶段公司0"
+        assert elapsed < fake.delay * 0.5
+        assert fake.finished == ["竞标阶段"]
+        assert speculation.tasks["意向阶段"].cancelled()
+
+    _with_fake_llm(run)
+
+
+def test_speculation_miss_is_cancelled():
+    """全部未猜中时取消预取，正式请求正常生成"""
+    def run(fake):
+        _record_history({"竞标阶段": 6, "意向阶段": 3})
+        prefetcher = Prefetcher(top_k=2, per_minute=6000)
+
+        async def scenario():
+            speculation = await prefetcher.speculate("市政工程", "国企")
+            await asyncio.sleep(0.01)
+            assert not speculation.resolve("废标重启")
+            return await analyze_opportunities(_input("废标重启"), use_mock_data=False)
+
+        output = asyncio.run(scenario())
+        assert output.opportunities[0].company_name == "废标重启公司0"
+        assert fake.finished == ["废标重启"]
+
+    _with_fake_llm(run)
+
+
+def test_shared_task_not_cancelled_while_needed():
+    """多个推测共用的预取任务，只有都未猜中时才取消"""
+    def run(fake):
+        _record_history({"竞标阶段": 10})
+        prefetcher = Prefetcher(top_k=1, per_minute=6000)
+
+        async def scenario():
+            first = await prefetcher.speculate("市政工程", "国企")
+            second = await prefetcher.speculate("市政工程", "国企")
+            assert first.tasks["竞标阶段"] is second.tasks["竞标阶段"]
+            first.resolve("意向阶段")
+            await asyncio.sleep(0)
+            assert not second.tasks["竞标阶段"].cancelled()
+            second.resolve("竞标阶段")
+            await second.tasks["竞标阶段"]
+
+        asyncio.run(scenario())
+        assert fake.finished == ["竞标阶段"]
+
+    _with_fake_llm(run)
+
+
+def test_existing_refresh_is_never_cancelled():
+    """共用已在进行的后台刷新时，未猜中也不取消该任务"""
+    def run(fake):
+        _record_history({"竞标阶段": 10})
+        prefetcher = Prefetcher(top_k=1, per_minute=6000)
+
+        async def scenario():
+            refresh = schedule_refresh(_input("竞标阶段"))
+            speculation = await prefetcher.speculate("市政工程", "国企")
+            assert speculation.tasks["竞标阶段"] is refresh
+            assert not speculation.resolve("意向阶段")
+            await asyncio.sleep(0)
+            assert not refresh.cancelled()
+            await refresh
+
+        asyncio.run(scenario())
+        assert fake.finished == ["竞标阶段"]
+
+    _with_fake_llm(run)
+
+
+def test_speculation_respects_caps():
+    """已有缓存、占比过低或超出速率限制时不预取"""
+    def run(fake):
+        _record_history({"竞标阶段": 5, "意向阶段": 4, "成果扩大": 1})
+        _, key = analysis_cache_key(_input("竞标阶段"))
+        result_cache.put(key, [{"company_name": "已缓存"}])
+
+        async def scenario():
+            capped = Prefetcher(top_k=3, min_share=0.2, per_minute=6000)
+            speculation = await capped.speculate("市政工程", "国企")
+            assert speculation.statuses == ["意向阶段"]
+            speculation.cancel()
+
+            throttled = Prefetcher(top_k=1, min_share=0.0, per_minute=0.001)
+            assert (await throttled.speculate("结构工程", "国企")).statuses == ["竞标阶段"]
+            assert (await throttled.speculate("岩土工程", "国企")).statuses == []
+
+            assert (await Prefetcher(top_k=0).speculate("市政工程", "国企")).statuses == []
+
+        asyncio.run(scenario())
+
+    _with_fake_llm(run)
+
+
+if __name__ == "__main__":
+    test_rank_statuses_from_history()
+    test_speculation_hit_lands_in_cache()
+    test_speculation_miss_is_cancelled()
+    test_shared_task_not_cancelled_while_needed()
+    test_existing_refresh_is_never_cancelled()
+    test_speculation_respects_caps()
+    print("推测预取测试完成!")
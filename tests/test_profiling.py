@@ -0,0 +1,102 @@
+"""
+测试按需性能剖析模块
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# 添加src目录到Python路径，以便能够导入模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from core import OpportunityAnalysisInput, analyze_opportunities
+from llm_client import opportunity_generator
+from profiling import AnalysisProfiler, LoopStallDetector, profiler
+
+
+def test_sampling_decision():
+    """未开启时不采样，请求级采样率优先"""
+    off = AnalysisProfiler(enabled=False)
+    assert not off.should_sample()
+    assert off.should_sample(1.0)
+    assert not off.should_sample(0)
+    assert AnalysisProfiler(enabled=True, sample_rate=1.0).should_sample()
+
+
+def test_loop_stall_detector_reports_blocking_coroutine():
+    """阻塞事件循环的协程会被记录"""
+    async def blocking_step():
+        time.sleep(0.3)
+
+    async def run():
+        detector = LoopStallDetector(asyncio.get_running_loop(), threshold=0.05)
+        detector.start()
+        await asyncio.sleep(0.05)
+        await asyncio.create_task(blocking_step(), name="blocking")
+        await asyncio.sleep(0.1)
+        detector.stop()
+        return detector.stalls
+
+    stalls = asyncio.run(run())
+    assert stalls, "应检测到事件循环阻塞"
+    assert stalls[0]["coroutine"].endswith("blocking_step")
+    assert stalls[0]["duration_ms"] >= 200
+
+
+def test_profiled_analysis_writes_rotated_artifacts():
+    """采样的请求写入剖析结果，并按数量滚动清理"""
+    original = (profiler.output_dir, profiler.max_artifacts)
+    original_key = opportunity_generator.llm_client.config["api_key"]
+    opportunity_generator.llm_client.config["api_key"] = ""
+    input_data = OpportunityAnalysisInput(
+        construction_direction="市政工程", customer_type="国企", business_status="意向阶段"
+    )
+    with tempfile.TemporaryDirectory() as output_dir:
+        profiler.output_dir, profiler.max_artifacts = output_dir, 2
+        try:
+            for _ in range(3):
+                result = asyncio.run(analyze_opportunities(input_data, profile=1.0))
+                assert len(result.opportunities) == 5
+        finally:
+            profiler.output_dir, profiler.max_artifacts = original
+            opportunity_generator.llm_client.config["api_key"] = original_key
+
+        artifacts = sorted(os.listdir(output_dir))
+        assert len(artifacts) == 2
+        files = os.listdir(os.path.join(output_dir, artifacts[-1]))
+        assert {"summary.json", "stacks.collapsed"} <= set(files)
+        with open(os.path.join(output_dir, artifacts[-1], "summary.json"), encoding='utf-8') as file:
+            summary = json.load(file)
+        assert summary["memory_peak_bytes"] >= 0 and "loop_stalls" in summary
+
+
+def test_overlapping_sessions_do_not_share_collectors():
+    """重叠的会话中只有先开始的一个采集cProfile和内存数据，tracemalloc在其结束时停止"""
+    async def run(output_dir):
+        sessions = AnalysisProfiler(output_dir=output_dir)
+
+        async def work(name, delay):
+            async with sessions.session(name) as session:
+                data = [bytearray(1024) for _ in range(100)]
+                await asyncio.sleep(delay)
+                del data
+            return session.summary
+
+        return await asyncio.gather(work("first", 0.05), work("second", 0.1))
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        first, second = asyncio.run(run(output_dir))
+    assert first["memory_peak_bytes"] >= 100 * 1024
+    assert "memory_peak_bytes" not in second
+    assert not tracemalloc.is_tracing()
+
+
+if __name__ == "__main__":
+    test_sampling_decision()
+    test_loop_stall_detector_reports_blocking_coroutine()
+    test_profiled_analysis_writes_rotated_artifacts()
+    test_overlapping_sessions_do_not_share_collectors()
+    print("剖析模块测试完成!")
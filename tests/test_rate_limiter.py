@@ -0,0 +1,168 @@
+"""
+测试大模型调用限流
+"""
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+# 添加src目录到Python路径，以便能够导入模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from llm_client import LLMClient
+from rate_limiter import AdaptiveWindow, ProviderLimiter, TokenBucket, estimate_tokens, rate_limiters
+
+
+def test_token_bucket_waits_for_refill():
+    """令牌用完后按速率折算等待时间"""
+    bucket = TokenBucket(rate=10, capacity=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert abs(bucket.reserve() - 0.1) < 0.01
+    assert TokenBucket(rate=0, capacity=1).reserve(100) == 0
+
+
+def test_window_aimd():
+    """正常时加性增长，限流时乘性减小"""
+    window = AdaptiveWindow(initial=4, min_limit=1, max_limit=8, cooldown=0)
+
+    async def run():
+        for _ in range(8):
+            await window.acquire()
+            window.release(latency=0.1)
+        grown = window.limit
+        await window.acquire()
+        window.release(throttled=True)
+        return grown
+
+    grown = asyncio.run(run())
+    assert grown > 5
+    assert abs(window.limit - grown / 2) < 1e-9
+    assert window.inflight == 0
+
+
+def test_window_limits_concurrency():
+    """窗口满时排队等待，同时进行的任务数不超过窗口"""
+    limiter = ProviderLimiter("test", max_concurrency=2, initial_concurrency=2)
+    state = {"running": 0, "peak": 0}
+
+    async def task():
+        reservation = await limiter.acquire()
+        state["running"] += 1
+        state["peak"] = max(state["peak"], state["running"])
+        await asyncio.sleep(0.01)
+        state["running"] -= 1
+        reservation.release()
+
+    async def run():
+        await asyncio.gather(*(task() for _ in range(10)))
+
+    asyncio.run(run())
+    assert state["peak"] == 2
+    assert limiter.effective_rates()["inflight"] == 0
+    assert limiter.effective_rates()["rpm"] == 10
+
+
+def test_burst_capacity_and_cancel_refund():
+    """令牌桶允许一整分钟的突发量且至少容纳一次最大调用；等待期间被取消时归还额度"""
+    limiter = ProviderLimiter("test-burst", rpm=60, tpm=6000)
+    assert limiter.requests.capacity == 60 and limiter.tokens.capacity == 6000
+
+    async def run():
+        reservation = await limiter.acquire(9000)
+        reservation.release()
+        assert limiter.tokens.capacity == 9000
+
+        limiter.requests.drain()
+        task = asyncio.ensure_future(limiter.acquire(100))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(run())
+    assert limiter.requests.available() > -0.5
+    assert limiter.window.inflight == 0
+
+
+def test_estimate_tokens():
+    """中文按字计数"""
+    assert estimate_tokens([{"role": "user", "content": "建筑行业"}]) == 4 + 4
+
+
+def test_call_llm_retries_on_429():
+    """429时缩小窗口并按Retry-After重试"""
+    calls = []
+
+    def handler(request):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            return httpx.Response(429, headers={"Retry-After": "0.05"}, text="rate limited")
+        return httpx.Response(200, json={
+            "choices": [{"message": {"content": "ok"}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+        })
+
+    client = LLMClient()
+    client.config = dict(client.config, api_key="test-key", provider="mock-429")
+    limiter = rate_limiters.configure("mock-429", max_concurrency=8, initial_concurrency=8)
+
+    async def run():
+        client._http_clients[asyncio.get_running_loop()] = httpx.AsyncClient(
+            transport=httpx.MockTransport(handler))
+        try:
+            return await client.call_llm([{"role": "user", "content": "测试"}])
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(run()) == "ok"
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 0.04
+    rates = limiter.effective_rates()
+    assert rates["throttled"] == 1
+    assert rates["concurrency_limit"] == 4
+    assert rates["inflight"] == 0
+
+
+def test_window_latency_normalised_per_output_token():
+    """并发窗口按每个生成token的耗时调整，长回复不会被误判为服务商变慢"""
+    releases = []
+
+    def handler(request):
+        return httpx.Response(200, json={
+            "choices": [{"message": {"content": "ok"}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 200, "total_tokens": 210},
+        })
+
+    client = LLMClient()
+    client.config = dict(client.config, api_key="test-key", provider="mock-latency")
+    limiter = rate_limiters.configure("mock-latency", max_concurrency=8, initial_concurrency=8)
+    original = limiter.window.release
+    limiter.window.release = lambda latency=None, throttled=False: (releases.append(latency),
+                                                                      original(latency, throttled))
+
+    async def run():
+        client._http_clients[asyncio.get_running_loop()] = httpx.AsyncClient(
+            transport=httpx.MockTransport(handler))
+        try:
+            await client.call_llm([{"role": "user", "content": "测试"}])
+        finally:
+            await client.aclose()
+
+    asyncio.run(run())
+    assert len(releases) == 1 and 0 < releases[0] < 0.01
+
+
+if __name__ == "__main__":
+    test_token_bucket_waits_for_refill()
+    test_window_aimd()
+    test_window_limits_concurrency()
+    test_burst_capacity_and_cancel_refund()
+    test_estimate_tokens()
+    test_call_llm_retries_on_429()
+    test_window_latency_normalised_per_output_token()
+    print("限流测试完成!")
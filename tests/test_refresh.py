@@ -0,0 +1,220 @@
+"""
+测试过期结果的后台刷新和缓存预热调度
+"""
+import asyncio
+import datetime
+import json
+import os
+import sys
+import time
+
+# 添加src目录到Python路径，以便能够导入模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from core import analysis_cache_key, analyze_opportunities, pending_refreshes, schedule_refresh
+from fair_scheduler import BATCH, INTERACTIVE, request_context
+from rate_limiter import rate_limiters
+from llm_client import opportunity_generator
+from refresh_scheduler import RefreshScheduler, parse_window
+from result_cache import result_cache
+from schemas import OpportunityAnalysisInput
+
+
+def _input(direction="市政工程", customer_type="国企", status="意向阶段"):
+    return OpportunityAnalysisInput(construction_direction=direction, customer_type=customer_type,
+                                    business_status=status)
+
+
+def _items(name):
+    return [
+        {
+            "company_name": f"{name}{index}",
+            "project_info": "项目",
+            "proof_info": "证明",
+            "inferred_info": "推断",
+            "marketing_plan": "方案",
+        }
+        for index in range(5)
+    ]
+
+
+class FakeLLM:
+    """记录调用的假大模型，每次返回新的结果"""
+
+    def __init__(self):
+        self.prompts = []
+
+    async def __call__(self, messages, **kwargs):
+        self.prompts.append(messages[-1]["content"])
+        await asyncio.sleep(0.01)
+        return json.dumps({"opportunities": _items("新公司")}, ensure_ascii=False)
+
+
+def _with_fake_llm(run):
+    fake = FakeLLM()
+    llm_client = opportunity_generator.llm_client
+    original_call = llm_client.call_llm
+    llm_client.call_llm = fake
+    # 全局缓存默认关闭，测试中临时开启
+    original_ttl, result_cache.ttl = result_cache.ttl, 86400.0
+    result_cache.clear()
+    try:
+        return run(fake)
+    finally:
+        llm_client.call_llm = original_call
+        result_cache.clear()
+        result_cache.ttl = original_ttl
+
+
+def _put_aged(input_data, age, name="旧公司"):
+    _, key = analysis_cache_key(input_data)
+    result_cache.put(key, _items(name), created_at=time.time() - age)
+    return key
+
+
+def test_stale_entry_served_and_refreshed_once():
+    """过期结果立即返回，并发请求只触发一次后台刷新"""
+    def run(fake):
+        input_data = _input()
+        key = _put_aged(input_data, result_cache.ttl + 60)
+
+        async def scenario():
+            outputs = await asyncio.gather(*(analyze_opportunities(input_data) for _ in range(5)))
+            assert pending_refreshes() == 1
+            while pending_refreshes():
+                await asyncio.sleep(0.01)
+            return outputs
+
+        outputs = asyncio.run(scenario())
+        assert all(output.opportunities[0].company_name == "旧公司0" for output in outputs)
+        assert len(fake.prompts) == 1
+        entry = result_cache.get(key)
+        assert entry is not None and entry.items[0]["company_name"] == "新公司0"
+
+    _with_fake_llm(run)
+
+
+def test_too_old_entry_regenerated():
+    """超过可用期限的结果不再返回"""
+    def run(fake):
+        input_data = _input("水利工程")
+        _put_aged(input_data, result_cache.ttl + result_cache.stale_ttl + 60)
+        output = asyncio.run(analyze_opportunities(input_data, use_mock_data=False))
+        assert output.opportunities[0].company_name == "新公司0"
+        assert len(fake.prompts) == 1
+
+    _with_fake_llm(run)
+
+
+def test_interactive_request_skips_batch_refresh():
+    """交互请求不等待批处理类别的刷新任务，批处理请求等待其完成"""
+    def run(fake):
+        async def scenario(request_class):
+            refresh = schedule_refresh(_input("桥梁与隧道工程"))
+            with request_context(request_class=request_class):
+                output = await analyze_opportunities(_input("桥梁与隧道工程"), use_mock_data=False)
+            calls = len(fake.prompts)
+            await refresh
+            return output, calls
+
+        # 交互请求自行调用大模型
+        output, calls = asyncio.run(scenario("interactive"))
+        assert output.opportunities[0].company_name == "新公司0"
+        assert calls == 2
+
+        # 批处理请求复用刷新任务的结果
+        result_cache.clear()
+        output, calls = asyncio.run(scenario(BATCH))
+        assert output.opportunities[0].company_name == "新公司0"
+        assert calls == 3 and len(fake.prompts) == 3
+
+    _with_fake_llm(run)
+
+
+def test_scheduler_refreshes_hot_keys_first():
+    """预热按访问次数和年龄排序，只刷新足够旧的条目"""
+    def run(fake):
+        hot, warm, fresh = _input("结构工程"), _input("岩土工程"), _input("桥梁与隧道工程")
+        old = result_cache.ttl * 0.8
+        keys = {
+            "hot": _put_aged(hot, old),
+            "warm": _put_aged(warm, old),
+            "fresh": _put_aged(fresh, 10),
+        }
+        for name, hits in (("hot", 5), ("warm", 2), ("fresh", 9)):
+            for _ in range(hits):
+                result_cache.record_access(keys[name])
+
+        scheduler = RefreshScheduler(per_minute=6000, window="", batch_size=10)
+        stats = asyncio.run(scheduler.run_once())
+        assert stats == {"refreshed": 2, "failed": 0, "skipped": 0, "deferred": 0}
+        assert "结构工程" in fake.prompts[0] and "岩土工程" in fake.prompts[1]
+        assert result_cache.get(keys["fresh"]).items[0]["company_name"] == "旧公司0"
+        assert result_cache.get(keys["hot"]).items[0]["company_name"] == "新公司0"
+
+    _with_fake_llm(run)
+
+
+def test_scheduler_counts_failed_and_cancelled_refreshes():
+    """刷新失败或结果无效记为失败，任务被取消记为跳过，都不计入已刷新"""
+    def run(fake):
+        keys = [_put_aged(_input(direction), result_cache.ttl * 0.8) for direction in ("结构工程", "岩土工程")]
+        for key in keys:
+            result_cache.record_access(key)
+        scheduler = RefreshScheduler(per_minute=6000, window="", batch_size=10)
+
+        async def invalid(messages, **kwargs):
+            fake.prompts.append(messages[-1]["content"])
+            return json.dumps({"opportunities": _items("新公司")[:2]}, ensure_ascii=False)
+
+        opportunity_generator.llm_client.call_llm = invalid
+        assert asyncio.run(scheduler.run_once()) == {"refreshed": 0, "failed": 2, "skipped": 0, "deferred": 0}
+
+        async def cancelled(messages, **kwargs):
+            raise asyncio.CancelledError()
+
+        opportunity_generator.llm_client.call_llm = cancelled
+        assert asyncio.run(scheduler.run_once()) == {"refreshed": 0, "failed": 0, "skipped": 2, "deferred": 0}
+        assert result_cache.get(keys[0]).items[0]["company_name"] == "旧公司0"
+
+    _with_fake_llm(run)
+
+
+def test_busy_counts_only_interactive_slots():
+    """判断在线请求是否繁忙时，只统计已获准的交互类调用，后台刷新和批处理不计入"""
+    limiter = rate_limiters.get("refresh-busy-test")
+    limiter.window.limit = 4
+    scheduler = RefreshScheduler(window="", busy_ratio=0.5)
+
+    async def run():
+        background = [await limiter.acquire(request_class=BATCH) for _ in range(2)]
+        assert not scheduler._interactive_busy("refresh-busy-test")
+        online = [await limiter.acquire(request_class=INTERACTIVE) for _ in range(2)]
+        assert scheduler._interactive_busy("refresh-busy-test")
+        online.pop().release()
+        assert not scheduler._interactive_busy("refresh-busy-test")
+        for reservation in background + online:
+            reservation.release()
+        assert limiter.inflight() == 0 and limiter.inflight(INTERACTIVE) == 0
+
+    asyncio.run(run())
+
+
+def test_refresh_window():
+    """预热时间段支持跨越午夜"""
+    assert parse_window("") is None
+    scheduler = RefreshScheduler(window="23:00-05:00")
+    assert scheduler.in_window(datetime.datetime(2024, 1, 1, 23, 30))
+    assert scheduler.in_window(datetime.datetime(2024, 1, 1, 4, 59))
+    assert not scheduler.in_window(datetime.datetime(2024, 1, 1, 12, 0))
+
+
+if __name__ == "__main__":
+    test_stale_entry_served_and_refreshed_once()
+    test_too_old_entry_regenerated()
+    test_interactive_request_skips_batch_refresh()
+    test_scheduler_refreshes_hot_keys_first()
+    test_scheduler_counts_failed_and_cancelled_refreshes()
+    test_busy_counts_only_interactive_slots()
+    test_refresh_window()
+    print("后台刷新测试完成!")
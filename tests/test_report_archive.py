@@ -0,0 +1,209 @@
+"""
+测试历史报告归档
+"""
+import json
+import os
+import sys
+import tempfile
+import zlib
+
+# 添加src目录到Python路径，以便能够导入模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from core import build_analysis_output, grid_inputs
+from llm_client import opportunity_generator
+from report_archive import MAX_DICTIONARY_SIZE, ReportArchive, train_dictionary
+from schemas import OpportunityAnalysisInput
+
+DAY = 86400
+START = 1700000000.0
+
+
+def _reports():
+    """全部预设组合的模拟报告"""
+    for input_data in grid_inputs():
+        output = build_analysis_output(opportunity_generator._generate_mock_data(
+            input_data.construction_direction, input_data.customer_type, input_data.business_status))
+        yield input_data, output
+
+
+def _raw_size(input_data, output):
+    return len(json.dumps({"input": input_data.model_dump(), "output": output.model_dump()},
+                          ensure_ascii=False).encode("utf-8"))
+
+
+def test_round_trip_and_lookup():
+    """报告原样读回，按输入键读取最新报告和历史，按日期范围读取"""
+    input_data = OpportunityAnalysisInput(construction_direction="市政工程", customer_type="国企",
+                                          business_status="意向阶段")
+    reports = list(_reports())
+    with tempfile.TemporaryDirectory() as directory:
+        with ReportArchive(os.path.join(directory, "reports.cda"), block_size=8) as archive:
+            for day in range(3):
+                for other, output in reports[:20]:
+                    archive.append(other, output, START + day * DAY)
+            first = build_analysis_output(opportunity_generator._generate_mock_data("市政工程", "国企", "意向阶段"))
+            archive.append(input_data, first, START)
+            archive.append(input_data, reports[0][1], START + 2 * DAY)
+
+            assert len(archive) == 62
+            history = archive.history(input_data)
+            assert [report.created_at for report in history] == [START, START + 2 * DAY]
+            assert history[0].output == first
+            assert archive.latest(input_data).output == reports[0][1]
+            assert archive.latest(OpportunityAnalysisInput(construction_direction="桥梁工程", customer_type="外企",
+                                                           business_status="竞标阶段")) is None
+
+            dates = list(archive.dates())
+            assert len(dates) == 3 and sum(archive.dates().values()) == 62
+            second_day = list(archive.by_date(dates[1]))
+            assert [(report.input, report.output) for report in second_day] == reports[:20]
+            assert len(list(archive.by_date(dates[1], dates[2]))) == 41
+            assert len(list(archive)) == 62
+
+
+def test_storage_drops_several_fold():
+    """与逐行JSON相比存储大幅减少，小块借助预置字典也能压缩"""
+    reports = list(_reports())
+    raw = sum(_raw_size(*report) for report in reports)
+    with tempfile.TemporaryDirectory() as directory:
+        with ReportArchive(os.path.join(directory, "reports.cda")) as archive:
+            for input_data, output in reports:
+                archive.append(input_data, output, START)
+            assert raw / archive.storage_size() > 5
+
+        # 每块只有两份报告时，预置字典比单独压缩每个块节省明显
+        dictionary = train_dictionary(json.dumps(output.model_dump(), ensure_ascii=False).encode("utf-8")
+                                      for _, output in reports[:32])
+        assert 0 < len(dictionary) <= MAX_DICTIONARY_SIZE
+        sizes = {}
+        for name, preset in (("plain", b""), ("preset", None)):
+            with ReportArchive(os.path.join(directory, f"{name}.cda"), block_size=2, dictionary=preset) as archive:
+                for input_data, output in reports:
+                    archive.append(input_data, output, START)
+                sizes[name] = os.path.getsize(archive.path)
+        assert sizes["preset"] < sizes["plain"] * 0.7
+        assert raw / sizes["preset"] > 3
+
+
+def test_point_lookup_decodes_one_block():
+    """按键查找只解压报告所在的块"""
+    reports = list(_reports())
+    decoded = []
+    original = zlib.decompressobj
+
+    def counting(*args, **kwargs):
+        decoded.append(args)
+        return original(*args, **kwargs)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "reports.cda")
+        with ReportArchive(path, block_size=16) as archive:
+            for input_data, output in reports:
+                archive.append(input_data, output, START)
+
+        archive = ReportArchive(path)
+        zlib.decompressobj = counting
+        try:
+            input_data, output = reports[100]
+            assert archive.latest(input_data).output == output
+        finally:
+            zlib.decompressobj = original
+            archive.close()
+        assert len(decoded) == 1
+
+
+def test_reopen_and_recover_interrupted_write():
+    """重新打开后继续追加并沿用字典；索引之后的残留块被截断"""
+    reports = list(_reports())
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "reports.cda")
+        with ReportArchive(path, block_size=10, train_samples=20) as archive:
+            for input_data, output in reports[:30]:
+                archive.append(input_data, output, START)
+        with open(f"{path}.dict", "rb") as f:
+            dictionary = f.read()
+        size = os.path.getsize(path)
+
+        # 模拟写入数据块后、写入索引前中断
+        with open(path, "ab") as f:
+            f.write(b"\x10\x00\x00\x00partial-block")
+        with open(f"{path}.idx", "a", encoding="utf-8") as f:
+            f.write('["broken", "2023-11')
+
+        with ReportArchive(path, block_size=10) as archive:
+            assert os.path.getsize(path) == size
+            assert len(archive) == 30
+            for input_data, output in reports[30:45]:
+                archive.append(input_data, output, START + DAY)
+            assert archive.dictionary == dictionary
+
+        with ReportArchive(path) as archive:
+            assert len(archive) == 45
+            assert archive.latest(reports[40][0]).output == reports[40][1]
+            assert archive.latest(reports[5][0]).output == reports[5][1]
+
+        with open(path, "wb") as f:
+            f.write(b"not an archive")
+        try:
+            ReportArchive(path)
+            assert False
+        except ValueError:
+            pass
+
+
+def test_dictionary_trained_from_first_reports():
+    """字典在积累足够样本后训练，之前的块不使用字典；读取不会把未满的块提前写入"""
+    reports = list(_reports())
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "reports.cda")
+        with ReportArchive(path, block_size=4, train_samples=12) as archive:
+            for input_data, output in reports[:6]:
+                archive.append(input_data, output, START)
+            size = os.path.getsize(path)
+            input_data, output = reports[5]
+            assert archive.latest(input_data).output == output
+            assert [report.output for report in archive.history(input_data)] == [output]
+            assert len(list(archive)) == 6 and archive.dates() == {"2023-11-14": 6}
+            assert os.path.getsize(path) == size
+            assert archive.dictionary is None
+
+        # 重新打开后从已写入的块中取回样本，继续积累
+        with ReportArchive(path, block_size=4, train_samples=12) as archive:
+            assert archive.dictionary is None
+            for input_data, output in reports[6:20]:
+                archive.append(input_data, output, START)
+            assert archive.dictionary
+        with open(f"{path}.dict", "rb") as f:
+            assert f.read() == archive.dictionary
+
+        with ReportArchive(path) as archive:
+            assert [(report.input, report.output) for report in archive] == reports[:20]
+
+
+def test_archive_cli():
+    """命令行将批处理结果文件追加到归档"""
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    from main import main
+
+    reports = list(_reports())[:12]
+    with tempfile.TemporaryDirectory() as directory:
+        merged = os.path.join(directory, "merged.jsonl")
+        with open(merged, "w", encoding="utf-8") as f:
+            for input_data, output in reports:
+                f.write(json.dumps({"key": "k", "input": input_data.model_dump(), "output": output.model_dump()},
+                                   ensure_ascii=False) + "\n")
+        path = os.path.join(directory, "reports.cda")
+        assert main(["archive", "--input", merged, "--archive", path, "--block-size", "5"]) == 0
+        with ReportArchive(path) as archive:
+            assert [(report.input, report.output) for report in archive] == reports
+
+
+if __name__ == "__main__":
+    test_round_trip_and_lookup()
+    test_storage_drops_several_fold()
+    test_point_lookup_decodes_one_block()
+    test_reopen_and_recover_interrupted_write()
+    test_dictionary_trained_from_first_reports()
+    test_archive_cli()
+    print("历史报告归档测试完成!")
@@ -0,0 +1,89 @@
+"""
+测试列式结果存储
+"""
+import os
+import sys
+
+# 添加src目录到Python路径，以便能够导入模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from result_store import ColumnarResultStore
+from schemas import OpportunityAnalysisInput, OpportunityAnalysisOutput
+
+
+def _report(direction, customer_type, companies):
+    input_data = OpportunityAnalysisInput(
+        construction_direction=direction, customer_type=customer_type, business_status="意向阶段"
+    )
+    output = OpportunityAnalysisOutput(opportunities=[
+        {
+            "company_name": company,
+            "project_info": f"{direction}项目",
+            "proof_info": "根据招标公告【http://www.cebpubservice.com/】",
+            "inferred_info": "企业正在扩大业务规模",
+            "marketing_plan": "安排技术专家进行深度交流",
+        }
+        for company in companies
+    ])
+    return input_data, output
+
+
+def _build_store():
+    store = ColumnarResultStore()
+    companies = ["中建八局", "中铁十局", "中交一公局", "上海建工", "北京城建"]
+    for i in range(40):
+        direction = "市政工程" if i % 2 == 0 else "水利工程"
+        store.append(*_report(direction, "国企", companies), created_at=1700000000 + i)
+    return store
+
+
+def test_append_and_query():
+    """追加后可按行视图读取、过滤和分组"""
+    store = _build_store()
+    assert len(store) == 200
+    assert len(store.dictionary("company_name")) == 5
+    assert len(store.dictionary("proof_info")) == 1
+    assert store[7].company_name == "中交一公局"
+    assert store[7].created_at == 1700000001000
+    assert store[7].to_model().project_info == "水利工程项目"
+
+    selected = store.filter(company_name="中建八局", construction_direction="市政工程")
+    assert len(selected) == 20
+    assert all(row.construction_direction == "市政工程" for row in store.rows(selected))
+    assert store.filter(company_name="不存在的公司") == []
+    assert store.group_count("construction_direction") == {"市政工程": 100, "水利工程": 100}
+    try:
+        store.filter(created_at=1700000001000)
+        assert False, "整数列不能按文本过滤"
+    except ValueError as e:
+        assert "created_at" in str(e)
+
+
+def test_memory_mapped_roundtrip(tmp_path):
+    """保存后以内存映射方式打开，查询结果与内存中一致"""
+    store = _build_store()
+    path = str(tmp_path / "results.cdr")
+    store.save(path)
+
+    with ColumnarResultStore.open(path) as mapped:
+        assert len(mapped) == len(store)
+        assert mapped[123].as_dict() == store[123].as_dict()
+        assert mapped.memory_usage() == 0
+        assert mapped.filter(company_name="上海建工") == store.filter(company_name="上海建工")
+        assert mapped.group_count("company_name") == store.group_count("company_name")
+        assert mapped.combinations() == store.combinations()
+        assert mapped.memory_usage() > 0
+        try:
+            mapped.append(*_report("市政工程", "国企", ["新公司"] * 5))
+            assert False, "只读存储不应允许追加"
+        except TypeError:
+            pass
+
+
+if __name__ == "__main__":
+    import pathlib
+    import tempfile
+    test_append_and_query()
+    with tempfile.TemporaryDirectory() as directory:
+        test_memory_mapped_roundtrip(pathlib.Path(directory))
+    print("列式结果存储测试完成!")
@@ -0,0 +1,181 @@
+"""
+测试数据模型的批量校验快速路径和结果缓存
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+# 添加src目录到Python路径，以便能够导入模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from core import OpportunityAnalysisInput, analyze_opportunities
+from llm_client import opportunity_generator
+from result_cache import ResultCache, result_cache
+from schemas import (
+    FIELD_MAX_LENGTHS,
+    MAX_OPPORTUNITIES,
+    OpportunityInfo,
+    records_to_output,
+    truncate_text,
+    validate_opportunities,
+    validate_output,
+    validate_records,
+)
+
+
+def _items(count):
+    return [
+        {
+            "company_name": f"测试公司{i}",
+            "project_info": "综合管廊项目" * 20,
+            "proof_info": "根据公告【http://www.gov.cn/notice/1】",
+            "inferred_info": "推断信息",
+            "marketing_plan": "营销方案",
+        }
+        for i in range(count)
+    ]
+
+
+def test_validate_output_applies_schema_constraints():
+    """按config.json的约束截断超长字段、补全缺失字段并取前5个"""
+    items = _items(7)
+    del items[0]["marketing_plan"]
+    output = validate_output(items)
+    assert len(output.opportunities) == MAX_OPPORTUNITIES
+    assert len(output.opportunities[0].project_info) == FIELD_MAX_LENGTHS["project_info"]
+    assert output.opportunities[0].marketing_plan == "暂无营销方案"
+    assert isinstance(output.opportunities[0], OpportunityInfo)
+
+
+def test_truncation_keeps_urls_whole():
+    """截断位置落在网址中间时，整个网址一起去掉"""
+    url = "【http://www.ggzy.gov.cn/notice/2024/1】"
+    text = "某市发布招标公告" + url + "，详见" + url
+    assert truncate_text(text, len(text)) == text
+    assert truncate_text(text, len(text) - 1) == "某市发布招标公告" + url + "，详见"
+    assert truncate_text(text, 20) == "某市发布招标公告"
+    assert truncate_text(text, 6) == "某市发布招标"
+
+    limit = FIELD_MAX_LENGTHS["proof_info"]
+    items = [{**item, "proof_info": "证" * (limit - 10) + url} for item in _items(5)]
+    assert validate_output(items).opportunities[0].proof_info == "证" * (limit - 10)
+
+
+def test_batch_validation_and_records():
+    """批量校验和轻量记录的结果与pydantic模型一致"""
+    items = _items(1000)
+    models = validate_opportunities(items)
+    records = validate_records(items)
+    assert len(models) == len(records) == 1000
+    assert records[3].to_model() == models[3]
+    output = records_to_output(records[:5])
+    assert output.opportunities[4].company_name == "测试公司4"
+
+
+def test_cache_roundtrip(tmp_path):
+    """文件缓存可跨实例读取，过期后不再返回"""
+    path = str(tmp_path / "cache.db")
+    key = ResultCache.make_key("qwen", "qwen-plus", "市政工程", "国企", "意向阶段")
+    ResultCache(path).put(key, _items(5))
+    assert ResultCache(path).get(key).items[0]["company_name"] == "测试公司0"
+    assert ResultCache(path, ttl=1).get(key) is not None
+    ResultCache(path).put(key, _items(5), created_at=0)
+    assert ResultCache(path, ttl=1).get(key) is None
+
+
+def test_analyze_uses_cache_and_respects_use_mock_data():
+    """大模型结果写入缓存；不允许模拟数据时调用失败直接抛出异常"""
+    calls = []
+
+    async def fake_call_llm(messages, **kwargs):
+        calls.append(messages)
+        return json.dumps({"opportunities": _items(5)}, ensure_ascii=False)
+
+    async def failing_call_llm(messages, **kwargs):
+        raise Exception("连接到API服务器失败")
+
+    client = opportunity_generator.llm_client
+    original = client.call_llm
+    input_data = OpportunityAnalysisInput(
+        construction_direction="水利工程", customer_type="事业单位", business_status="争夺阶段"
+    )
+    # 全局缓存默认关闭，测试中临时开启
+    original_ttl, result_cache.ttl = result_cache.ttl, 86400.0
+    result_cache.clear()
+    try:
+        client.call_llm = fake_call_llm
+        first = asyncio.run(analyze_opportunities(input_data))
+        second = asyncio.run(analyze_opportunities(input_data))
+        assert len(calls) == 1
+        assert first == second
+
+        result_cache.clear()
+        client.call_llm = failing_call_llm
+        try:
+            asyncio.run(analyze_opportunities(input_data, use_mock_data=False))
+            assert False, "应抛出异常"
+        except Exception as e:
+            assert "不允许使用模拟数据" in str(e)
+        mock = asyncio.run(analyze_opportunities(input_data))
+        assert len(mock.opportunities) == 5
+        assert len(result_cache) == 0
+    finally:
+        client.call_llm = original
+        result_cache.clear()
+        result_cache.ttl = original_ttl
+
+
+def test_global_cache_is_opt_in():
+    """未设置缓存路径和有效期时全局缓存关闭"""
+    import result_cache as result_cache_module
+
+    saved = {name: os.environ.pop(name, None) for name in ("RESULT_CACHE_PATH", "RESULT_CACHE_TTL")}
+    try:
+        assert result_cache_module._default_ttl() == 0
+        os.environ["RESULT_CACHE_PATH"] = "cache.db"
+        assert result_cache_module._default_ttl() == 86400
+        os.environ["RESULT_CACHE_TTL"] = "600"
+        assert result_cache_module._default_ttl() == 600
+    finally:
+        for name, value in saved.items():
+            os.environ.pop(name, None)
+            if value is not None:
+                os.environ[name] = value
+
+
+def test_access_counts_buffered_off_loop():
+    """访问次数先累计在内存中，读取统计或到达写入间隔时再写入数据库"""
+    cache = ResultCache(access_flush_interval=3600)
+    for _ in range(3):
+        cache.record_access("a")
+    cache.record_access("b")
+    with cache._lock:
+        assert cache._conn.execute("SELECT COUNT(*) FROM access").fetchone()[0] == 0
+    assert cache.access_counts() == {"a": 3, "b": 1}
+    cache.record_access("a")
+    assert cache.access_counts()["a"] == 4
+
+    cache = ResultCache(access_flush_interval=0)
+    cache.record_access("c")
+    for _ in range(100):
+        if cache._flushing is False and not cache._pending_access:
+            break
+        time.sleep(0.01)
+    with cache._lock:
+        assert cache._conn.execute("SELECT hits FROM access WHERE key = 'c'").fetchone() == (1,)
+
+
+if __name__ == "__main__":
+    import tempfile
+    import pathlib
+    test_validate_output_applies_schema_constraints()
+    test_truncation_keeps_urls_whole()
+    test_batch_validation_and_records()
+    with tempfile.TemporaryDirectory() as directory:
+        test_cache_roundtrip(pathlib.Path(directory))
+    test_analyze_uses_cache_and_respects_use_mock_data()
+    test_global_cache_is_opt_in()
+    test_access_counts_buffered_off_loop()
+    print("数据模型测试完成!")
@@ -0,0 +1,124 @@
+"""
+测试同步调用接口
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加src目录到Python路径，以便能够导入模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from llm_client import opportunity_generator
+from result_cache import result_cache
+from schemas import OpportunityAnalysisInput
+from sync_api import analyze_opportunities_batch_sync, analyze_opportunities_sync, background_loop
+
+
+DIRECTIONS = ["建筑工程", "市政工程", "结构工程", "岩土工程", "水利工程", "桥梁与隧道工程"]
+
+
+class FakeLLM:
+    """记录所在事件循环的假大模型，返回的公司名称包含输入的施工方向"""
+
+    def __init__(self):
+        self.loops = set()
+        self.threads = set()
+
+    async def __call__(self, messages, **kwargs):
+        self.loops.add(asyncio.get_running_loop())
+        self.threads.add(threading.get_ident())
+        await asyncio.sleep(0.01)
+        prompt = messages[-1]["content"]
+        direction = next(name for name in sorted(DIRECTIONS, key=len, reverse=True) if name in prompt)
+        items = [
+            {
+                "company_name": f"{direction}公司{index}",
+                "project_info": "项目",
+                "proof_info": "证明",
+                "inferred_info": "推断",
+                "marketing_plan": "方案",
+            }
+            for index in range(5)
+        ]
+        return json.dumps({"opportunities": items}, ensure_ascii=False)
+
+
+def _with_fake_llm(run):
+    fake = FakeLLM()
+    llm_client = opportunity_generator.llm_client
+    original_call = llm_client.call_llm
+    llm_client.call_llm = fake
+    result_cache.clear()
+    try:
+        return run(fake)
+    finally:
+        llm_client.call_llm = original_call
+        result_cache.clear()
+
+
+def _input(direction):
+    return {"construction_direction": direction, "customer_type": "国企", "business_status": "意向阶段"}
+
+
+def test_calls_from_threads_share_one_loop():
+    """多个线程的同步调用都在同一个后台事件循环中执行"""
+    def run(fake):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            outputs = list(executor.map(lambda direction: analyze_opportunities_sync(_input(direction)),
+                                        DIRECTIONS))
+        assert [output.opportunities[0].company_name for output in outputs] == [
+            f"{direction}公司0" for direction in DIRECTIONS
+        ]
+        assert len(fake.loops) == 1 and len(fake.threads) == 1
+        assert fake.threads != {threading.get_ident()}
+
+    _with_fake_llm(run)
+
+
+def test_batch_keeps_input_order():
+    """批量接口结果顺序与输入一致，并接受模型对象"""
+    def run(fake):
+        inputs = [OpportunityAnalysisInput(**_input(direction)) for direction in reversed(DIRECTIONS)]
+        outputs = analyze_opportunities_batch_sync(inputs, concurrency=3)
+        assert [output.opportunities[0].company_name for output in outputs] == [
+            f"{direction}公司0" for direction in reversed(DIRECTIONS)
+        ]
+
+    _with_fake_llm(run)
+
+
+def test_sync_call_inside_loop_rejected():
+    """在后台事件循环内部调用同步接口会直接报错，而不是死锁"""
+    async def nested():
+        try:
+            analyze_opportunities_sync(_input("建筑工程"))
+        except RuntimeError as e:
+            return str(e)
+        return None
+
+    assert "await" in background_loop.run(nested())
+
+
+def test_stop_and_restart():
+    """停止后再次调用会重新启动后台事件循环"""
+    def run(fake):
+        analyze_opportunities_sync(_input("建筑工程"))
+        background_loop.stop()
+        assert not background_loop.running
+        output = analyze_opportunities_sync(_input("市政工程"))
+        assert output.opportunities[0].company_name == "市政工程公司0"
+        assert background_loop.running
+        assert len(fake.loops) == 2
+
+    _with_fake_llm(run)
+
+
+if __name__ == "__main__":
+    test_calls_from_threads_share_one_loop()
+    test_batch_keeps_input_order()
+    test_sync_call_inside_loop_rejected()
+    test_stop_and_restart()
+    print("同步接口测试完成!")
@@ -3,12 +3,14 @@ import os
 # 添加项目根目录到Python路径，以便能够导入main模块
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
-from main import OpportunityAnalysisInput, analyze_opportunities
-import asyncio
+from main import OpportunityAnalysisInput, analyze_opportunities_sync, speculate_sync
 
 
-def get_user_input():
-    """获取用户输入"""
+def get_user_input(on_prefix=None):
+    """
+    获取用户输入
+    :param on_prefix: 选定建筑方向和客户类型后调用的回调，参数为 (建筑方向, 客户类型)
+    """
     print("欢迎使用建筑行业新商机分析系统")
     print("=" * 40)
     
@@ -68,6 +70,9 @@ def get_user_input():
         }
         customer_type = customer_map[customer_choice]
     
+    if on_prefix is not None:
+        on_prefix(construction_direction, customer_type)
+    
     # 商机状态选择
     print("\n请选择商机状态：")
     business_statuses = [
@@ -99,7 +104,7 @@ def get_user_input():
     return construction_direction, customer_type, business_status
 
 
-async def run_analysis(construction_direction, customer_type, business_status):
+def run_analysis(construction_direction, customer_type, business_status):
     """运行分析"""
     print(f"\n正在分析 {construction_direction} 领域中 {customer_type} 类型客户的 {business_status} 商机...")
     
@@ -111,8 +116,8 @@ async def run_analysis(construction_direction, customer_type, business_status):
     )
 
     try:
-        # 异步调用分析函数，不允许使用模拟数据
-        result = await analyze_opportunities(input_data, use_mock_data=False)
+        # 通过常驻后台事件循环同步调用分析函数，多次分析复用同一个连接池，不允许使用模拟数据
+        result = analyze_opportunities_sync(input_data, use_mock_data=False)
         
         # 输出结果
         print(f"\n找到 {len(result.opportunities)} 个潜在商机:")
@@ -129,14 +134,20 @@ async def run_analysis(construction_direction, customer_type, business_status):
         print("提示: 请检查您的API密钥配置和网络连接，确保大模型服务正常可用。")
 
 
-async def main():
+def main():
     """主函数"""
     while True:
-        # 获取用户输入
-        construction_direction, customer_type, business_status = get_user_input()
+        # 获取用户输入；选定建筑方向和客户类型后即按历史选择推测商机状态并在后台预取，
+        # 用户选择商机状态期间结果已在生成
+        speculations = []
+        construction_direction, customer_type, business_status = get_user_input(
+            on_prefix=lambda direction, ctype: speculations.append(speculate_sync(direction, ctype))
+        )
+        for speculation in speculations:
+            speculation.resolve(business_status)
         
         # 运行分析
-        await run_analysis(construction_direction, customer_type, business_status)
+        run_analysis(construction_direction, customer_type, business_status)
         
         # 询问是否继续
         continue_choice = input("\n是否继续分析其他商机? (y/n): ").lower().strip()
@@ -146,4 +157,4 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    main()
\ No newline at end of file